@@ -302,6 +302,22 @@ class ScanMapPanelDelegate(object):
                 self.coord_dict = coord_dict
                 logging.info('Loaded all mapping configs successfully.')
 
+        def resume_button_clicked():
+            if self.Mapper.is_running:
+                logging.warn('There is already a mapping going on. Please abort it or wait for it to terminate.')
+                return
+            mappath = self.Mapper.savepath
+            if os.path.isfile(mappath):
+                mappath = os.path.dirname(mappath)
+
+            if not os.path.isfile(os.path.join(mappath, 'configs_map.txt')):
+                logging.warn('Please type the path to the folder of the map into the \'savepath\' field to resume it.')
+            else:
+                self.thread_communication = self.Mapper.gui_communication
+                self.Mapper.resume(mappath)
+                self.coord_dict = self.Mapper.coord_dict.copy()
+                sync_gui()
+
         def test_button_clicked():
             if self.Mapper is not None and self.Mapper.is_running:
                 threading.Thread(target=self.Mapper.handle_retuning).start()
@@ -320,6 +336,20 @@ class ScanMapPanelDelegate(object):
                                                            units='nm')
                 di.set_dimensional_calibrations([calibration, calibration])
 
+        def preview_button_clicked():
+            if None in self.coord_dict.values():
+                logging.warn('You must save all four corners before previewing the focus map.')
+                return
+            self.Mapper.coord_dict = self.coord_dict.copy()
+            z_map, focus_map = self.Mapper.preview_focus_map()
+            self.__api.library.create_data_item_from_data(z_map, 'Focus preview (z) '+ time.strftime('%Y_%m_%d_%H_%M'))
+            self.__api.library.create_data_item_from_data(focus_map, 'Focus preview (EHTFocus) '+
+                                                          time.strftime('%Y_%m_%d_%H_%M'))
+            logging.info('Focus map: z from {:g} to {:g}, EHTFocus from {:g} to {:g}.'.format(np.nanmin(z_map),
+                                                                                             np.nanmax(z_map),
+                                                                                             np.nanmin(focus_map),
+                                                                                             np.nanmax(focus_map)))
+
         def done_button_clicked():
 
 #            if self.thread is not None and self.thread.is_alive():
@@ -671,7 +701,9 @@ class ScanMapPanelDelegate(object):
         drive_br = ui.create_push_button_widget(_("Bottom\nRight"))
         save_button = ui.create_push_button_widget(_("Save Configs"))
         load_button = ui.create_push_button_widget(_("Load Configs"))
+        resume_button = ui.create_push_button_widget(_("Resume map"))
         test_button = ui.create_push_button_widget(_("Test image"))
+        preview_button = ui.create_push_button_widget(_("Preview focus"))
         done_button = ui.create_push_button_widget(_("Start map"))
         abort_button = ui.create_push_button_widget(_("Abort map"))
         analyze_button = ui.create_push_button_widget(_("Analyze image"))
@@ -687,6 +719,20 @@ class ScanMapPanelDelegate(object):
         overview_checkbox = ui.create_check_box_widget(_("Acquire Overview"))
         overview_checkbox.check_state = 'checked'
         overview_checkbox.on_check_state_changed = checkbox_changed
+        adaptive_settle_checkbox = ui.create_check_box_widget(_("Adaptive settle time"))
+        adaptive_settle_checkbox.on_check_state_changed = checkbox_changed
+        survey_checkbox = ui.create_check_box_widget(_("Survey pass first"))
+        survey_checkbox.on_check_state_changed = checkbox_changed
+        offload_checkbox = ui.create_check_box_widget(_("Process in worker processes"))
+        offload_checkbox.on_check_state_changed = checkbox_changed
+        series_container_checkbox = ui.create_check_box_widget(_("Series in one file"))
+        series_container_checkbox.on_check_state_changed = checkbox_changed
+        live_mosaic_checkbox = ui.create_check_box_widget(_("Live mosaic"))
+        live_mosaic_checkbox.on_check_state_changed = checkbox_changed
+        compress_checkbox = ui.create_check_box_widget(_("Compress frames"))
+        compress_checkbox.on_check_state_changed = checkbox_changed
+        partial_frames_checkbox = ui.create_check_box_widget(_("Check partial frames"))
+        partial_frames_checkbox.on_check_state_changed = checkbox_changed
         blank_checkbox = ui.create_check_box_widget(_("Blank beam between images"))
         blank_checkbox.on_check_state_changed = checkbox_changed
         correct_stage_errors_checkbox = ui.create_check_box_widget(_("Correct Stage Movement"))
@@ -723,7 +769,9 @@ class ScanMapPanelDelegate(object):
         drive_br.on_clicked = drive_br_button_clicked
         save_button.on_clicked = save_button_clicked
         load_button.on_clicked = load_button_clicked
+        resume_button.on_clicked = resume_button_clicked
         test_button.on_clicked = test_button_clicked
+        preview_button.on_clicked = preview_button_clicked
         done_button.on_clicked = done_button_clicked
         abort_button.on_clicked = abort_button_clicked
         analyze_button.on_clicked = analyze_button_clicked
@@ -752,17 +800,31 @@ class ScanMapPanelDelegate(object):
 
         checkbox_row2.add(overview_checkbox)
         checkbox_row2.add_spacing(3)
+        checkbox_row2.add(adaptive_settle_checkbox)
+        checkbox_row2.add_spacing(3)
+        checkbox_row2.add(survey_checkbox)
+        checkbox_row2.add_spacing(3)
         #checkbox_row2.add(blank_checkbox)
         checkbox_row2.add_stretch()
 
         checkbox_row3.add(correct_stage_errors_checkbox)
         checkbox_row3.add_spacing(3)
         checkbox_row3.add(z_drive_checkbox)
+        checkbox_row3.add_spacing(3)
+        checkbox_row3.add(offload_checkbox)
+        checkbox_row3.add_spacing(3)
+        checkbox_row3.add(series_container_checkbox)
+        checkbox_row3.add_spacing(3)
+        checkbox_row3.add(live_mosaic_checkbox)
+        checkbox_row3.add_spacing(3)
+        checkbox_row3.add(compress_checkbox)
         checkbox_row3.add_stretch()
 
         checkbox_row4.add(abort_series_on_dirt_checkbox)
         checkbox_row4.add(dirt_area_line_edit)
         checkbox_row4.add(ui.create_label_widget(_('% dirt in image')))
+        checkbox_row4.add_spacing(3)
+        checkbox_row4.add(partial_frames_checkbox)
         checkbox_row4.add_stretch()
 
         checkbox_row5.add(abort_series_on_intensity_change_checkbox)
@@ -798,7 +860,11 @@ class ScanMapPanelDelegate(object):
         save_button_row.add_spacing(4)
         save_button_row.add(load_button)
         save_button_row.add_spacing(4)
+        save_button_row.add(resume_button)
+        save_button_row.add_spacing(4)
         save_button_row.add(test_button)
+        save_button_row.add_spacing(4)
+        save_button_row.add(preview_button)
 
         done_button_row.add(done_button)
         done_button_row.add_spacing(4)
@@ -815,10 +881,19 @@ class ScanMapPanelDelegate(object):
         self._checkboxes['aligned_average'] = align_average_checkbox
         self._checkboxes['abort_series_on_intensity_drop'] = abort_series_on_intensity_change_checkbox
         self._checkboxes['exclude_contamination'] = exclude_contamination_checkbox
+        self._checkboxes['adaptive_settle_time'] = adaptive_settle_checkbox
+        self._checkboxes['survey_first'] = survey_checkbox
+        self._checkboxes['offload_processing'] = offload_checkbox
+        self._checkboxes['series_container'] = series_container_checkbox
+        self._checkboxes['live_mosaic'] = live_mosaic_checkbox
+        self._checkboxes['compress_frames'] = compress_checkbox
+        self._checkboxes['abort_on_partial_frames'] = partial_frames_checkbox
 
         self._buttons['test'] = test_button
+        self._buttons['preview'] = preview_button
         self._buttons['done'] = done_button
         self._buttons['load'] = load_button
+        self._buttons['resume'] = resume_button
         self._buttons['save'] = save_button
         self._buttons['abort'] = abort_button
         self._buttons['analyze'] = analyze_button
@@ -871,7 +946,8 @@ class ScanMapPanelDelegate(object):
 
             def disable_buttons():
                 for key, value in self._buttons.items():
-                    if key in ['tl', 'tr', 'bl', 'br', 'drive_tl', 'drive_tr', 'drive_bl', 'drive_br', 'save', 'load']:
+                    if key in ['tl', 'tr', 'bl', 'br', 'drive_tl', 'drive_tr', 'drive_bl', 'drive_br', 'save', 'load',
+                               'resume']:
                         value._widget.enabled = False
             self.document_controller.queue_task(disable_buttons)
 
@@ -895,7 +971,8 @@ class ScanMapPanelDelegate(object):
 
             def enable_buttons():
                 for key, value in self._buttons.items():
-                    if key in ['tl', 'tr', 'bl', 'br', 'drive_tl', 'drive_tr', 'drive_bl', 'drive_br', 'save', 'load']:
+                    if key in ['tl', 'tr', 'bl', 'br', 'drive_tl', 'drive_tr', 'drive_bl', 'drive_br', 'save', 'load',
+                               'resume']:
                         value._widget.enabled = True
             self.document_controller.queue_task(enable_buttons)
 
@@ -10,9 +10,17 @@ import cv2
 import os
 #import tifffile
 from scipy.stats.mstats import theilslopes
-import scipy.ndimage as ndimage
 import matplotlib.pyplot as plt
 import matplotlib.animation as animation
+import warnings
+with warnings.catch_warnings():
+    warnings.simplefilter("ignore")
+    try:
+        from .maptools import series
+        from .maptools.tilelog import TileLog
+    except:
+        from maptools import series
+        from maptools.tilelog import TileLog
 
 
 class Positionfinder(object):
@@ -214,14 +222,14 @@ class Positionfinder(object):
         if 'scaledframes' in self.loaded_data:
             print('Loaded scaled frames from disk.')
         else:
-            image = ndimage.imread(os.path.join(self.framepath, self.framelist[0]))
+            image = self.read_frame(self.framelist[0])
             scale = (self.size_frames/float(image.shape[0])/(self.size_overview/float(self.overview.shape[0])))
             scaledframe = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
             self.scaledframes.append(scaledframe)
             #means = np.mean(scaledframe)
 
             for i in range(1, len(self.framelist)):
-                image = ndimage.imread(os.path.join(self.framepath, self.framelist[i]))
+                image = self.read_frame(self.framelist[i])
                 scaledframe = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
                 self.scaledframes.append(scaledframe)
                 #means += np.mean(scaledframe)
@@ -673,7 +681,16 @@ class Positionfinder(object):
                         self.optimized_positions[j, i] = np.array((-1, -1))
         print('\nFinished removing outliers.')
 
+    def read_frame(self, name):
+        """
+        Reads the frame "name" from framepath. For series that were saved in one file per position, the frame given by
+        "choose_frame" in get_framelist is read from it.
+        """
+        return series.read_frame(os.path.join(self.framepath, name), getattr(self, 'choose_frame', 0))
+
     def get_framelist(self, extension='tif', separator='_', name_overview='Overview', choose_frame=0):
+        # Frames of a series in one file per position are found as single frames, "read_frame" picks the right one
+        self.choose_frame = choose_frame
         frames = os.listdir(self.framepath)
         frames.sort()
 
@@ -681,6 +698,27 @@ class Positionfinder(object):
             self.overview = np.array(cv2.imread(os.path.join(self.framepath, self.overview_name), -1))
             self.overview = cv2.GaussianBlur(self.overview, None, 2)
 
+        # Maps that have a tile log list the files of each tile in it, so the file names do not have to be parsed
+        records = TileLog.read(self.framepath)
+        if records:
+            if self.overview is None:
+                for name in frames:
+                    splitname = os.path.splitext(name)
+                    if (splitname[1].lower().endswith(extension.lower()) and
+                        splitname[0].lower().startswith(name_overview.lower())):
+                        self.overview_name = name
+                        self.overview = np.array(cv2.imread(os.path.join(self.framepath, name), -1))
+                        self.overview = cv2.GaussianBlur(self.overview, None, 2)
+                        break
+            for record in records:
+                files = record.get('files', [])
+                # A series container holds all frames of a tile in one file
+                if len(files) == 1:
+                    self.framelist.append(files[0])
+                elif -len(files) <= choose_frame < len(files):
+                    self.framelist.append(files[choose_frame])
+            return
+
         lastposition = None
         position = None
         lastname = None
@@ -748,7 +786,8 @@ class Positionfinder(object):
                 - name_overview : String that specifies how the overview image is called. (default: Overview) (Overview
                                   frame name has to start with this)
                 - choose_frame : Number that specifies which frame will be taken if there exist more frames with the
-                                 same number. (default: 0) (Number has to be at the end of the frame name)
+                                 same number. (default: 0) (Number has to be at the end of the frame name or it is
+                                 the index of the frame in a series that was saved as one file per position)
 
             For find_borders:
                 - border_min_correlation : Number between 0 and 1 (default: 0.6)
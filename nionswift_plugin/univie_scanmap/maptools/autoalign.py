@@ -80,7 +80,7 @@ def shift_fft(im1, im2, return_cps=False, hamming_window=False):
     transy -= translation.shape[0]/2
     transx -= translation.shape[1]/2
     
-    return np.array((transy,transx), dtype=np.int)
+    return np.array((transy,transx), dtype=int)
 
 def rot_dist_fft(im1, im2):
     try:
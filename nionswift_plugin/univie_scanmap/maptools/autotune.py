@@ -18,6 +18,7 @@ from scipy.signal import fftconvolve
 import os
 import json
 from . import tifffile
+from .display import DisplayUpdater
 #import cv2
 #try:
 #    import cv2
@@ -80,8 +81,8 @@ class Imaging(object):
         self.as2 = kwargs.get('as2')
         self.document_controller = kwargs.get('document_controller')
         self.delta_graphene = None
-        self.live_data_item_MAADF = None
-        self.live_data_item_HAADF = None
+        # Live images are shown by a display.DisplayUpdater (created on first use if not given)
+        self.display = kwargs.get('display')
         self._vacuum_level = kwargs.get('vacuum_level', 0.002)
 
     @property
@@ -967,18 +968,16 @@ class Imaging(object):
     def show_live_image(self, image):
         assert self.document_controller is not None, 'Cannot create a data item without a document controller instance'
 
-        if self.live_data_item_MAADF is None and self.detectors['MAADF']:
-            self.live_data_item_MAADF = self.document_controller.library.create_data_item('Live (MAADF)')
-        if self.live_data_item_HAADF is None and self.detectors['HAADF']:
-            self.live_data_item_HAADF = self.document_controller.library.create_data_item('Live (HAADF)')
+        if self.display is None:
+            self.display = DisplayUpdater(self.document_controller)
 
         if self.detectors['HAADF'] and self.detectors['MAADF']:
-            self.live_data_item_HAADF.set_data(image[0])
-            self.live_data_item_MAADF.set_data(image[1])
+            self.display.update('Live (HAADF)', image[0])
+            self.display.update('Live (MAADF)', image[1])
         elif self.detectors['HAADF']:
-            self.live_data_item_HAADF.set_data(image)
+            self.display.update('Live (HAADF)', image)
         elif self.detectors['MAADF']:
-            self.live_data_item_MAADF.set_data(image)
+            self.display.update('Live (MAADF)', image)
 
 class Peaking(Imaging):
 
@@ -993,7 +992,7 @@ class Peaking(Imaging):
     def image(self, image):
         self._image = image
         self._shape = np.shape(image)
-        self._center = tuple((np.array(np.shape(image))/2).astype(np.int))
+        self._center = tuple((np.array(np.shape(image))/2).astype(int))
         self.fft = None
         self._mask = None
         self.peaks = None
@@ -1001,8 +1000,8 @@ class Peaking(Imaging):
     @property
     def center(self):
         if self._center is None:
-            self._center = (np.array(self.shape)/2).astype(np.int)
-        return np.array(self._center).astype(np.int)
+            self._center = (np.array(self.shape)/2).astype(int)
+        return np.array(self._center).astype(int)
 
     @center.setter
     def center(self, center):
@@ -1245,12 +1244,12 @@ class Peaking(Imaging):
                     if i == 1:
                         position_tolerance = int(np.rint(position_tolerance * np.sqrt(3)))
                     for coord1 in peaks[i]:
-                        coord = coord1.astype(np.int)
+                        coord = coord1.astype(int)
                         fft[coord[0]-position_tolerance:coord[0]+position_tolerance+1,
                             coord[1]-position_tolerance:coord[1]+position_tolerance+1] *= 4.0
             else:
                 for coord1 in peaks:
-                    coord = coord1.astype(np.int)
+                    coord = coord1.astype(int)
                     fft[coord[0]-position_tolerance:coord[0]+position_tolerance+1,
                         coord[1]-position_tolerance:coord[1]+position_tolerance+1] *= 4.0
             return (peaks, fft)
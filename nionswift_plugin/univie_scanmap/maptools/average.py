@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 03:41:26 2026
+
+@author: mittelberger
+"""
+
+import threading
+import numpy as np
+
+try:
+    from scipy import fft as fftpack
+    fft_kwargs = {'workers': -1}
+except ImportError:
+    fftpack = np.fft
+    fft_kwargs = {}
+
+
+class FrameAligner(object):
+    """
+    Registers frames to a reference frame by cross-correlation. The Fourier transform of the reference is computed
+    once, so registering a frame only needs the transform of the frame itself. Shifts are found with subpixel
+    precision (parabolic fit around the correlation maximum) and are at most "max_shift" times the frame size in each
+    direction, like the "ratio" of autoalign.align. Frames that do not correlate with the reference are not shifted.
+    """
+
+    def __init__(self, reference, max_shift=0.01):
+        reference = np.asarray(reference, dtype=np.float32)
+        self.shape = reference.shape
+        self.max_shift = max_shift
+        self._reference_fft = np.conj(self._fft(reference))
+        self._frequencies = (np.fft.fftfreq(self.shape[0])[:, np.newaxis].astype(np.float32),
+                             np.fft.rfftfreq(self.shape[1])[np.newaxis, :].astype(np.float32))
+
+    @staticmethod
+    def _fft(frame):
+        return fftpack.rfft2(frame - np.mean(frame), **fft_kwargs)
+
+    def _shift(self, frame_fft):
+        correlation = fftpack.irfft2(frame_fft * self._reference_fft, s=self.shape, **fft_kwargs)
+        # Only shifts up to "max_shift" are searched (the correlation wraps around at the edges)
+        limits = [max(int(np.ceil(self.max_shift * size)), 1) for size in self.shape]
+        rows = np.arange(-limits[0], limits[0] + 1)
+        columns = np.arange(-limits[1], limits[1] + 1)
+        window = correlation[np.ix_(rows % self.shape[0], columns % self.shape[1])]
+        peak = np.unravel_index(np.argmax(window), window.shape)
+        # Frames without a clear correlation maximum (e.g. without structure) are not shifted, like in
+        # autoalign.shift_fft
+        if window[peak] <= np.mean(correlation) + 3*np.std(correlation):
+            return np.zeros(2)
+        shift = np.array((rows[peak[0]], columns[peak[1]]), dtype=np.float64)
+        for axis in range(2):
+            if 0 < peak[axis] < window.shape[axis] - 1:
+                index = list(peak)
+                values = []
+                for offset in (-1, 0, 1):
+                    index[axis] = peak[axis] + offset
+                    values.append(window[tuple(index)])
+                denominator = values[0] - 2*values[1] + values[2]
+                if denominator < 0:
+                    shift[axis] += 0.5 * (values[0] - values[2]) / denominator
+        return shift
+
+    def shift(self, frame):
+        """
+        Returns the shift (y, x) of "frame" with respect to the reference in pixels.
+        """
+        return self._shift(self._fft(np.asarray(frame, dtype=np.float32)))
+
+    def align(self, frame):
+        """
+        Returns (aligned frame, shift). The frame is shifted back onto the reference in Fourier space. Like in
+        autoalign.align, the parts that were shifted in from the opposite edge are set to zero.
+        """
+        frame = np.asarray(frame, dtype=np.float32)
+        frame_fft = self._fft(frame)
+        shift = self._shift(frame_fft)
+        if not shift.any():
+            return (frame, shift)
+        phase = np.exp(2j * np.pi * (self._frequencies[0] * shift[0] + self._frequencies[1] * shift[1]))
+        aligned = fftpack.irfft2(frame_fft * phase.astype(np.complex64), s=self.shape, **fft_kwargs)
+        aligned += np.mean(frame)
+        for axis in range(2):
+            border = int(np.ceil(abs(shift[axis])))
+            if border == 0:
+                continue
+            index = [slice(None), slice(None)]
+            index[axis] = slice(self.shape[axis] - border, None) if shift[axis] > 0 else slice(0, border)
+            aligned[tuple(index)] = 0
+        return (aligned.astype(np.float32, copy=False), shift)
+
+
+class RunningAverage(object):
+    """
+    Average of the last "length" frames. The frames are kept in a preallocated ring together with their sum, so
+    adding a frame only subtracts the oldest one from the sum and adds the new one, independent of "length".
+    Frames can be aligned to the first frame after the last "reset" (see FrameAligner).
+    """
+
+    def __init__(self, length, max_shift=0.01):
+        self.length = max(int(length), 1)
+        self.max_shift = max_shift
+        self._lock = threading.Lock()
+        self._frames = None
+        self._sum = None
+        self.reset()
+
+    def __len__(self):
+        return self.count
+
+    def reset(self):
+        """
+        Starts a new average (e.g. for a new series). The memory of the ring is kept.
+        """
+        with self._lock:
+            self.count = 0
+            self._index = 0
+            self._aligner = None
+            if self._sum is not None:
+                self._sum[:] = 0
+
+    def _allocate(self, shape):
+        self._frames = np.zeros((self.length,) + tuple(shape), dtype=np.float32)
+        self._sum = np.zeros(shape, dtype=np.float64)
+        self.count = 0
+        self._index = 0
+        self._aligner = None
+
+    def add(self, frame, align=False):
+        """
+        Adds "frame" to the average, replacing the oldest frame if the ring is full. If "align" is True, the frame is
+        aligned to the reference first. Returns the shift (y, x) that was corrected or None.
+        """
+        frame = np.asarray(getattr(frame, 'data', frame))
+        shift = None
+        with self._lock:
+            if self._frames is None or self._frames.shape[1:] != frame.shape:
+                self._allocate(frame.shape)
+            if align:
+                if self._aligner is None:
+                    self._aligner = FrameAligner(frame, max_shift=self.max_shift)
+                else:
+                    frame, shift = self._aligner.align(frame)
+            slot = self._frames[self._index]
+            if self.count == self.length:
+                self._sum -= slot
+            else:
+                self.count += 1
+            slot[:] = frame
+            self._sum += slot
+            self._index = (self._index + 1) % self.length
+        return shift
+
+    def average(self):
+        """
+        Returns the average of the frames in the ring (float32) or None if it is empty.
+        """
+        with self._lock:
+            if self.count == 0:
+                return None
+            return (self._sum / self.count).astype(np.float32)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 03:05:18 2026
+
+@author: mittelberger
+
+Runs complete maps with SuperScanMapper on the simulated microscope (see simulation.py) and reports how fast they are.
+Run it with
+    python -m nionswift_plugin.univie_scanmap.maptools.benchmark --suite quick --output benchmark.json
+and compare two result files with
+    python -m nionswift_plugin.univie_scanmap.maptools.benchmark --compare baseline.json benchmark.json
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from .mapper import SuperScanMapper
+from .simulation import simulated_hardware
+
+# Parameters of the scenarios in each suite. Every combination of tile count, frame size, series length and
+# processing tasks (with or without dirt and intensity checks) is one scenario.
+suites = {'quick': {'tiles': [10, 100], 'sizes': [512], 'series': [1, 10], 'tasks': [False, True]},
+          'standard': {'tiles': [10, 100, 1000], 'sizes': [512, 1024, 2048], 'series': [1, 10],
+                       'tasks': [False, True]},
+          'full': {'tiles': [10, 100, 1000, 10000], 'sizes': [512, 1024, 2048, 4096], 'series': [1, 10, 50],
+                   'tasks': [False, True]}}
+
+# Version of the result file format
+result_format = 1
+
+
+def make_scenarios(tiles, sizes, series, tasks=(False, True)):
+    """
+    Returns a list of scenarios (dictionaries) for all combinations of the given tile counts, frame sizes (pixels),
+    series lengths and processing task settings.
+    """
+    scenarios = []
+    for number_tiles, size, number_images, with_tasks in itertools.product(tiles, sizes, series, tasks):
+        name = '{:d}_tiles_{:d}px_{:d}_frames_{:s}'.format(number_tiles, size, number_images,
+                                                           'tasks' if with_tasks else 'no_tasks')
+        scenarios.append({'name': name, 'tiles': number_tiles, 'size': size, 'series': number_images,
+                          'tasks': with_tasks})
+    return scenarios
+
+
+def map_coordinates(number_tiles, fov, offset):
+    """
+    Returns the coordinate dictionary for a map with (at least) "number_tiles" tiles with a field of view "fov" (nm)
+    and "offset", and the shape (rows, columns) of the map. The map is as square as possible.
+    """
+    columns = int(np.ceil(np.sqrt(number_tiles)))
+    rows = int(np.ceil(number_tiles / columns))
+    spacing = fov * 1e-9 * (1 + offset)
+    # Half a tile more than needed, so that rounding cannot remove a row or column
+    width = (columns - 0.5) * spacing
+    height = (rows - 0.5) * spacing
+    coord_dict = {'top-left': (0, height, 0, 0), 'top-right': (width, height, 0, 0), 'bottom-right': (width, 0, 0, 0),
+                  'bottom-left': (0, 0, 0, 0)}
+    return (coord_dict, (rows, columns))
+
+
+class MemorySampler(object):
+    """
+    Records the peak resident memory of this process (bytes) in a background thread while it is running. Uses psutil
+    if it is available and /proc/self/statm otherwise (on systems that have neither, "peak" stays None).
+    """
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self.peak = None
+        self._stop_event = threading.Event()
+        self._t = None
+
+    @staticmethod
+    def rss():
+        if psutil is not None:
+            return psutil.Process().memory_info().rss
+        try:
+            with open('/proc/self/statm') as statm:
+                return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def _sample(self):
+        rss = self.rss()
+        if rss is not None:
+            self.peak = max(self.peak or 0, rss)
+
+    def _sampler_thread(self):
+        while not self._stop_event.wait(timeout=self.interval):
+            self._sample()
+
+    def start(self):
+        self._stop_event.clear()
+        self._sample()
+        self._t = threading.Thread(target=self._sampler_thread, daemon=True)
+        self._t.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._t is not None:
+            self._t.join()
+        self._sample()
+        return self.peak
+
+
+def run_scenario(scenario, workdir, time_scale=1, **kwargs):
+    """
+    Runs the map described by "scenario" (see make_scenarios) on simulated hardware and returns its results.
+    All waits of the simulation (frame time, stage moves, settle times) are multiplied by "time_scale", so large maps
+    can be benchmarked faster than they would run on the microscope. Dwell time and overhead are computed with the
+    scaled frame time.
+
+    Parameters
+    -----------
+    scenario : dict
+        "tiles", "size", "series" and "tasks" of the map.
+    workdir : str
+        The map is saved in a new folder in "workdir", which is deleted afterwards unless "keep_data" is True.
+    time_scale : optional, float
+        Factor for all waits of the simulation.
+
+    Other parameters (keyword arguments)
+    -------------------------------------
+    pixeltime : float
+        Pixel time (us), default 1.
+    fov : float
+        Field of view (nm), default 8.
+    offset : float
+        Offset between tiles, default 0.5.
+    sleeptime : float
+        Settle time after each stage move (s) before scaling, default 1.
+    keep_data : bool
+        Keep the map folder, default False.
+    seed : int
+        Seed of the simulated specimen, default 0.
+    mapper_kwargs : dict
+        Additional keyword arguments for SuperScanMapper.
+    switches : dict
+        Switches that are set in addition to the ones of the scenario.
+
+    Returns
+    --------
+    result : dict
+        "tiles" (number of tiles that were acquired), "frames", "wall_time" (s), "tiles_per_hour", "dwell_time" (s),
+        "overhead_fraction" (fraction of the wall time that was not dwell time), "simulation_time" (s spent generating
+        images, which is included in the wall time), "peak_rss" (bytes), "buffer" and "writer" (reports of the frame
+        buffer and the frame writer) and "stages" (statistics of the timing records, e.g. per-task latency).
+    """
+    fov = kwargs.get('fov', 8)
+    offset = kwargs.get('offset', 0.5)
+    coord_dict, shape = map_coordinates(scenario['tiles'], fov, offset)
+    superscan, as2 = simulated_hardware(time_scale=time_scale, seed=kwargs.get('seed', 0))
+    switches = {'do_retuning': False, 'use_z_drive': False, 'compensate_stage_error': False,
+                'acquire_overview': False, 'show_last_frames_average': False, 'aligned_average': False,
+                'exclude_contamination': False, 'abort_series_on_dirt': scenario['tasks'],
+                'abort_series_on_intensity_drop': scenario['tasks']}
+    switches.update(kwargs.get('switches', {}))
+    savepath = tempfile.mkdtemp(prefix='benchmark_', dir=workdir)
+    frame_parameters = {'size_pixels': (scenario['size'], scenario['size']), 'pixeltime': kwargs.get('pixeltime', 1),
+                        'fov': fov, 'rotation': 0}
+    mapper = SuperScanMapper(superscan=superscan, as2=as2, coord_dict=coord_dict, switches=switches,
+                             savepath=savepath, number_of_images=scenario['series'],
+                             frame_parameters=frame_parameters, offset=offset,
+                             sleeptime=kwargs.get('sleeptime', 1) * time_scale, first_wait_time=0,
+                             settle_model_path=os.path.join(savepath, 'settle_model.json'),
+                             **kwargs.get('mapper_kwargs', {}))
+    sampler = MemorySampler()
+    sampler.start()
+    starttime = time.perf_counter()
+    try:
+        mapper.start()
+        mapper._t.join()
+    finally:
+        wall_time = time.perf_counter() - starttime
+        peak_rss = sampler.stop()
+    summary = mapper.timer.summary()
+    stages = summary['stages']
+    number_frames = stages.get('grab', {}).get('count', 0)
+    dwell_time = number_frames * superscan.frame_time(mapper.nion_frame_parameters)
+    result = dict(scenario)
+    result.update({'shape': shape, 'time_scale': time_scale, 'requested_tiles': scenario['tiles'],
+                   'tiles': summary['number_tiles'],
+                   'frames': number_frames, 'wall_time': wall_time,
+                   'tiles_per_hour': summary['number_tiles'] / wall_time * 3600 if wall_time > 0 else 0,
+                   'dwell_time': dwell_time,
+                   'overhead_fraction': 1 - dwell_time / wall_time if wall_time > 0 else None,
+                   'simulation_time': superscan.simulation_time, 'peak_rss': peak_rss,
+                   'buffer': mapper.buffer.report(), 'writer': mapper.writer.report(), 'stages': stages,
+                   'grab_failures': superscan.number_failures})
+    if not kwargs.get('keep_data'):
+        shutil.rmtree(savepath, ignore_errors=True)
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(scenarios, output=None, workdir=None, time_scale=1, **kwargs):
+    """
+    Runs all "scenarios" one after the other and returns the results. If "output" is given, the results are also
+    written to this JSON file (after every scenario, so that nothing is lost if a run is interrupted).
+    "kwargs" are passed to run_scenario.
+    """
+    results = {'format': result_format, 'created': time.strftime('%Y-%m-%d %H:%M:%S'), 'revision': git_revision(),
+               'host': {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__,
+                        'processor': platform.processor(), 'cpus': os.cpu_count()},
+               'time_scale': time_scale, 'results': []}
+    if workdir is not None and not os.path.exists(workdir):
+        os.makedirs(workdir)
+    for scenario in scenarios:
+        logging.info('Running benchmark ' + scenario['name'])
+        try:
+            result = run_scenario(scenario, workdir, time_scale=time_scale, **kwargs)
+        except Exception as detail:
+            logging.error('Benchmark {:s} failed. Reason: {:s}'.format(scenario['name'], str(detail)))
+            result = dict(scenario, error=str(detail))
+        results['results'].append(result)
+        print(format_result(result))
+        if output is not None:
+            save_results(results, output)
+    return results
+
+
+def save_results(results, path):
+    with open(path, 'w') as result_file:
+        json.dump(results, result_file, indent=1, default=lambda value: value.tolist() if hasattr(value, 'tolist')
+                  else str(value))
+
+
+def load_results(path):
+    with open(path) as result_file:
+        return json.load(result_file)
+
+
+def format_result(result):
+    if 'error' in result:
+        return '{:s}: failed ({:s})'.format(result['name'], result['error'])
+    tasks = ', '.join('{:s}: {:.3f} s'.format(stage, values['p90']) for stage, values in result['stages'].items()
+                      if stage not in ['buffer_depth', 'grab', 'move', 'settle', 'focus_map'])
+    return ('{name:s}: {tiles:.0f} tiles in {wall_time:.1f} s, {tiles_per_hour:.0f} tiles/h, {overhead:.0%} overhead, '
+            'peak RSS {rss:.0f} MB, buffer high-water mark {buffer:.0f}, writer queue {writer:.0f}. '
+            'Task latency (p90): {tasks:s}').format(name=result['name'], tiles=result['tiles'],
+                                                    wall_time=result['wall_time'],
+                                                    tiles_per_hour=result['tiles_per_hour'],
+                                                    overhead=result['overhead_fraction'] or 0,
+                                                    rss=(result['peak_rss'] or 0) / 1024**2,
+                                                    buffer=result['buffer']['high_water_mark'],
+                                                    writer=result['writer']['high_water_mark'], tasks=tasks or '-')
+
+
+def compare_results(baseline, results, tolerance=0.05):
+    """
+    Compares two benchmark results (as returned by run_benchmark or load_results) scenario by scenario. Returns a list
+    of (name, baseline tiles/h, tiles/h, relative change, regression) for all scenarios that are in both. A scenario
+    is a regression if its throughput dropped by more than "tolerance".
+    """
+    baseline_results = {result['name']: result for result in baseline['results'] if 'error' not in result}
+    comparison = []
+    for result in results['results']:
+        reference = baseline_results.get(result['name'])
+        if reference is None or 'error' in result or reference['tiles_per_hour'] <= 0:
+            continue
+        change = result['tiles_per_hour'] / reference['tiles_per_hour'] - 1
+        comparison.append((result['name'], reference['tiles_per_hour'], result['tiles_per_hour'], change,
+                           change < -tolerance))
+    return comparison
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark complete maps on the simulated microscope.')
+    parser.add_argument('--suite', choices=sorted(suites.keys()), default='quick')
+    parser.add_argument('--tiles', type=int, nargs='+', help='Tile counts (overrides the suite)')
+    parser.add_argument('--sizes', type=int, nargs='+', help='Frame sizes in pixels (overrides the suite)')
+    parser.add_argument('--series', type=int, nargs='+', help='Series lengths (overrides the suite)')
+    parser.add_argument('--tasks', choices=['with', 'without', 'both'], default='both',
+                        help='Run with dirt and intensity tasks, without them or both')
+    parser.add_argument('--time-scale', type=float, default=1, help='Factor for all waits of the simulation')
+    parser.add_argument('--pixeltime', type=float, default=1, help='Pixel time (us)')
+    parser.add_argument('--output', help='JSON file for the results')
+    parser.add_argument('--workdir', help='Folder for the map data (default: temporary folder)')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'RESULTS'),
+                        help='Compare two result files instead of running the benchmark')
+    parser.add_argument('--tolerance', type=float, default=0.05,
+                        help='Throughput drop that counts as a regression when comparing')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        comparison = compare_results(load_results(args.compare[0]), load_results(args.compare[1]),
+                                     tolerance=args.tolerance)
+        for name, reference, tiles_per_hour, change, regression in comparison:
+            print('{:s}: {:.0f} -> {:.0f} tiles/h ({:+.1%}){:s}'.format(name, reference, tiles_per_hour, change,
+                                                                       ' REGRESSION' if regression else ''))
+        return 1 if any(item[4] for item in comparison) else 0
+
+    suite = suites[args.suite]
+    tasks = {'with': [True], 'without': [False], 'both': [False, True]}[args.tasks]
+    scenarios = make_scenarios(args.tiles or suite['tiles'], args.sizes or suite['sizes'],
+                               args.series or suite['series'], tasks=tasks)
+    run_benchmark(scenarios, output=args.output, workdir=args.workdir, time_scale=args.time_scale,
+                  pixeltime=args.pixeltime)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 04:12:50 2026
+
+@author: mittelberger
+"""
+
+import logging
+import threading
+import time
+import numpy as np
+
+
+def bin_image(data, max_size):
+    """
+    Returns a binned copy of "data" (float32) whose sides are at most "max_size" pixels. The binning factor is the same
+    for both axes; rows and columns that do not fill a whole bin are cut off.
+    """
+    data = np.asarray(getattr(data, 'data', data))
+    factor = int(np.ceil(max(data.shape) / max_size)) if max_size else 1
+    if factor <= 1:
+        return np.array(data, dtype=np.float32)
+    rows, columns = data.shape[0] // factor, data.shape[1] // factor
+    cropped = data[:rows*factor, :columns*factor]
+    # Summing one axis after the other is much faster than a mean over both axes of the 4D view
+    binned = cropped.reshape(rows, factor, columns*factor).sum(axis=1, dtype=np.float32)
+    binned = binned.reshape(rows, columns, factor).sum(axis=2)
+    binned /= factor**2
+    return binned
+
+
+class DisplayUpdater(object):
+    """
+    Shows data in Nion Swift data items without flooding the UI thread. "update" only stores the data as pending for
+    its data item (a newer update replaces an older one that was not shown yet) and returns immediately. A display
+    thread sends the pending data to the UI thread with document_controller.queue_task, at most "max_rate" times per
+    second for each data item and only when the UI thread has shown the previous update of this item.
+    Frames are binned to at most "max_size" pixels per side, so the UI thread only gets small previews (the full
+    resolution data is saved by the writer). The caller only copies the frame into a staging buffer that is reused
+    for the next frames, binning happens in the display thread.
+    "data" can also be a function that returns the data. It is called in the display thread and only for updates that
+    are actually shown, which is useful for data that is expensive to compute (e.g. an average).
+    """
+
+    def __init__(self, document_controller, max_rate=2, max_size=512):
+        self.document_controller = document_controller
+        self.max_rate = max_rate
+        self.max_size = max_size
+        self.data_items = {}
+        self.number_updates = 0
+        self.number_coalesced = 0
+        self._pending = {}
+        # Staging buffers that can be reused for the next frame of each data item
+        self._free = {}
+        self._in_flight = set()
+        self._last_sent = {}
+        self._condition = threading.Condition()
+        self._stop = False
+        self._t = None
+
+    def start(self):
+        with self._condition:
+            if self._t is not None and self._t.is_alive():
+                return
+            self._stop = False
+            self._t = threading.Thread(target=self._display_thread, daemon=True)
+            self._t.start()
+
+    def update(self, title, data):
+        """
+        Shows "data" in the data item with the name "title" (it is created when it is shown for the first time). Frames
+        from a FrameBuffer are reused, so they are copied right away.
+        """
+        self.start()
+        if not callable(data):
+            data = np.asarray(getattr(data, 'data', data))
+        with self._condition:
+            pending = self._pending.get(title)
+            if pending is not None:
+                self.number_coalesced += 1
+            if not callable(data):
+                # The buffer of an update that was not shown yet is overwritten, otherwise a free one is used
+                buffer = pending if isinstance(pending, np.ndarray) else self._free.pop(title, None)
+                if buffer is None or buffer.shape != data.shape or buffer.dtype != data.dtype:
+                    buffer = np.empty_like(data)
+                np.copyto(buffer, data)
+                data = buffer
+            self._pending[title] = data
+            self._condition.notify_all()
+
+    def _next_due(self):
+        # Returns (title, wait time) of the pending update that can be sent next
+        now = time.perf_counter()
+        result = (None, None)
+        for title in self._pending:
+            if title in self._in_flight:
+                continue
+            wait = self._last_sent.get(title, -np.inf) + 1 / self.max_rate - now if self.max_rate else 0
+            if wait <= 0:
+                return (title, 0)
+            if result[1] is None or wait < result[1]:
+                result = (title, wait)
+        return result
+
+    def _display_thread(self):
+        while True:
+            with self._condition:
+                while True:
+                    title, wait = self._next_due()
+                    if title is not None and wait == 0:
+                        break
+                    if self._stop and not self._pending and not self._in_flight:
+                        return
+                    self._condition.wait(timeout=wait)
+                data = self._pending.pop(title)
+                self._in_flight.add(title)
+                self._last_sent[title] = time.perf_counter()
+            try:
+                if callable(data):
+                    data = data()
+                    if data is not None:
+                        data = bin_image(data, self.max_size)
+                else:
+                    buffer = data
+                    data = bin_image(buffer, self.max_size)
+                    with self._condition:
+                        self._free[title] = buffer
+                if data is None:
+                    self._finished(title)
+                else:
+                    self.document_controller.queue_task(lambda title=title, data=data: self._show(title, data))
+            except Exception as detail:
+                logging.error('Could not update {:s}. Reason: {:s}'.format(title, str(detail)))
+                self._finished(title)
+
+    def _show(self, title, data):
+        # Runs in the UI thread
+        try:
+            data_item = self.data_items.get(title)
+            if data_item is None:
+                data_item = self.document_controller.library.create_data_item(title)
+                self.data_items[title] = data_item
+            data_item.set_data(data)
+            with self._condition:
+                self.number_updates += 1
+        finally:
+            self._finished(title)
+
+    def _finished(self, title):
+        with self._condition:
+            self._in_flight.discard(title)
+            self._condition.notify_all()
+
+    def close(self, timeout=None):
+        """
+        Sends the updates that are still pending, waits until the UI thread showed them and stops the display thread.
+        """
+        with self._condition:
+            self._stop = True
+            self._condition.notify_all()
+        if self._t is not None:
+            self._t.join(timeout=timeout)
+
+    def report(self):
+        with self._condition:
+            return {'updates': self.number_updates, 'coalesced': self.number_coalesced,
+                    'pending': len(self._pending)}
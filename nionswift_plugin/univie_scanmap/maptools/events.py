@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 01:18:25 2026
+
+@author: mittelberger
+"""
+
+import logging
+import threading
+import time
+
+
+class Event(object):
+    """
+    Base class of all events on an EventBus. Every event knows the frame it belongs to ("info" is the info dictionary
+    of the frame in the processing loop): "tile" is the frame number of the tile, "name" the name the frame is saved
+    with, "is_first" and "is_last" its place in the series and "acquired_at" the time (time.time()) when the frame
+    arrived from the microscope. "published_at" is set by the EventBus.
+    """
+
+    def __init__(self, info=None, **kwargs):
+        info = info or {}
+        self.info = info
+        self.tile = info.get('tile', {}).get('number')
+        self.name = info.get('name')
+        self.is_first = bool(info.get('is_first'))
+        self.is_last = bool(info.get('is_last'))
+        self.acquired_at = info.get('timestamp')
+        self.published_at = None
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    @property
+    def latency(self):
+        """
+        Time between the arrival of the frame and the publication of the event (s).
+        """
+        if self.acquired_at is None or self.published_at is None:
+            return None
+        return self.published_at - self.acquired_at
+
+    def __repr__(self):
+        return '{:s}(tile={:s}, name={:s})'.format(self.__class__.__name__, str(self.tile), str(self.name))
+
+
+class TaskFinished(Event):
+    """
+    A processing task returned "result" (not None). "task" is the name of the task.
+    """
+
+
+class DirtCoverage(Event):
+    """
+    "fraction" of the frame is covered with dirt, which is more than "limit".
+    """
+
+
+class IntensityChange(Event):
+    """
+    The mean intensity of the frame ("intensity") dropped below (or, for a negative abort threshold, rose above)
+    "threshold".
+    """
+
+
+class TuningNeeded(Event):
+    """
+    The frame shows that the microscope has to be tuned again. "reason" says why.
+    """
+
+
+class SeriesProcessed(Event):
+    """
+    All frames of the series at "tile" were processed.
+    """
+
+
+class EventBus(object):
+    """
+    Delivers events to subscribers. Callbacks are subscribed for an event class (and get all events of its
+    subclasses as well) with a priority: Callbacks with higher priority are called first, so that urgent reactions
+    (e.g. aborting a series) do not wait for slow ones (e.g. retuning). "publish" calls the callbacks directly in the
+    thread that publishes the event, so there is no delay, but callbacks that take long hold up the publisher.
+    Exceptions in callbacks are logged and do not stop the delivery to the remaining callbacks.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+        self._counter = 0
+
+    def subscribe(self, event_class, callback, priority=0):
+        """
+        Calls "callback(event)" for all events that are instances of "event_class". Returns a token for "unsubscribe".
+        """
+        with self._lock:
+            self._counter += 1
+            self._subscriptions.append((-priority, self._counter, event_class, callback))
+            self._subscriptions.sort(key=lambda subscription: subscription[:2])
+            return self._counter
+
+    def unsubscribe(self, token):
+        with self._lock:
+            self._subscriptions = [subscription for subscription in self._subscriptions if subscription[1] != token]
+
+    def publish(self, event):
+        event.published_at = time.time()
+        with self._lock:
+            callbacks = [subscription[3] for subscription in self._subscriptions
+                         if isinstance(event, subscription[2])]
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as detail:
+                logging.error('Error in event handler {:s} for {:s}: {:s}'.format(str(callback), repr(event),
+                                                                                  str(detail)))
@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 18:31:52 2026
+
+@author: mittelberger
+"""
+
+import numpy as np
+from scipy.interpolate import Rbf, SmoothBivariateSpline
+from scipy.spatial import cKDTree
+
+
+class SampleIndex(object):
+    """
+    KD-tree over sample points for fast nearest neighbour queries and local interpolation between them. "points" is an
+    array (or list of tuples) with shape (N, C) in which the first two columns are (x, y) stage coordinates (m) and the
+    remaining C-2 columns are the values to interpolate (e.g. z and focus). All methods work on many targets at once.
+    """
+
+    def __init__(self, points):
+        self.points = np.asarray(points, dtype=np.float64)
+        self.tree = cKDTree(self.points[:, :2])
+
+    def __len__(self):
+        return len(self.points)
+
+    def nearest(self, targets, k):
+        """
+        Returns distances and indices of the "k" nearest sample points for each of the (M, 2) "targets", both as (M, k)
+        arrays sorted by distance. "k" is limited to the number of sample points.
+        """
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+        distances, indices = self.tree.query(targets, k=min(k, len(self)))
+        return distances.reshape(len(targets), -1), indices.reshape(len(targets), -1)
+
+    def interpolate(self, targets, method='bilinear', k=6, power=2):
+        """
+        Interpolates the values of the sample points at all (M, 2) "targets". Returns an (M, C-2) array.
+
+        Parameters
+        -----------
+        method : optional, str
+            "bilinear": Bilinear interpolation in the quadrangle formed by the 4 nearest points (the same as in
+            Mapping.interpolation). Where these points do not form a proper quadrangle (e.g. they lie on a line) or
+            the target lies outside of it, "idw" is used instead. Only if there are exactly 4 sample points, values
+            outside of the quadrangle are extrapolated.
+            "idw": Inverse distance weighting of the "k" nearest points with weights 1/distance**power.
+            "thin_plate": Thin plate spline (with affine part) through the "k" nearest points of each target, like
+            scipy's RBFInterpolator(kernel='thin_plate_spline') fitted to only these points. Where the points do not
+            determine a spline (e.g. they lie on a line), "idw" is used instead.
+        """
+        targets = np.asarray(targets, dtype=np.float64).reshape(-1, 2)
+        if method == 'bilinear':
+            return self._bilinear(targets)
+        elif method == 'idw':
+            return self._weighted(targets, k, power=power)
+        elif method == 'thin_plate':
+            return self._thin_plate(targets, k)
+        raise ValueError('Unknown interpolation method {}. Possible values are "bilinear", "idw" and '
+                         '"thin_plate".'.format(method))
+
+    def _weighted(self, targets, k, power=2):
+        distances, indices = self.nearest(targets, k)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = 1 / distances**power
+        # Targets that coincide with a sample point get exactly its value
+        exact = ~np.isfinite(weights)
+        weights[exact.any(axis=1)] = 0
+        weights[exact] = 1
+        weights /= np.sum(weights, axis=1, keepdims=True)
+        return np.einsum('mk,mkc->mc', weights, self.points[indices][..., 2:])
+
+    @staticmethod
+    def _thin_plate_kernel(distances):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(distances > 0, distances**2 * np.log(distances), 0)
+
+    def _thin_plate(self, targets, k):
+        if len(self) < 3:
+            return self._weighted(targets, k)
+        distances, indices = self.nearest(targets, k)
+        neighbours = self.points[indices]
+        number_targets, k = indices.shape
+        # The coordinates are centered on the target and scaled to the distance of the farthest neighbour, so that the
+        # systems are well conditioned (the spline itself does not depend on the scale)
+        scale = np.where(distances[:, -1] > 0, distances[:, -1], 1)[:, np.newaxis, np.newaxis]
+        coordinates = (neighbours[..., :2] - targets[:, np.newaxis]) / scale
+        # Solve the spline system [[K, P], [P.T, 0]] @ [w, a] = [values, 0] for all targets at once
+        system = np.zeros((number_targets, k + 3, k + 3))
+        system[:, :k, :k] = self._thin_plate_kernel(np.linalg.norm(coordinates[:, :, np.newaxis] -
+                                                                   coordinates[:, np.newaxis], axis=-1))
+        system[:, :k, k] = system[:, k, :k] = 1
+        system[:, :k, k+1:] = coordinates
+        system[:, k+1:, :k] = np.swapaxes(coordinates, 1, 2)
+        values = np.zeros((number_targets, k + 3, self.points.shape[1] - 2))
+        values[:, :k] = neighbours[..., 2:]
+        result = np.empty((number_targets, self.points.shape[1] - 2))
+        solvable = np.linalg.cond(system) < 1e12
+        if solvable.any():
+            coefficients = np.linalg.solve(system[solvable], values[solvable])
+            # The target is at the origin of its coordinates, so the affine part is only the constant term
+            kernel = self._thin_plate_kernel(distances[solvable] / scale[solvable, 0])
+            result[solvable] = np.einsum('mk,mkc->mc', kernel, coefficients[:, :k]) + coefficients[:, k]
+        if not solvable.all():
+            result[~solvable] = self._weighted(targets[~solvable], k)
+        return result
+
+    def _bilinear(self, targets):
+        if len(self) < 4:
+            return self._weighted(targets, 4, power=2)
+        indices = self.nearest(targets, 4)[1]
+        corners = self.points[indices]
+        # Sort the 4 points of each target into a quadrangle in the same way as Mapping.sort_quadrangle: The two points
+        # with the smaller x are on the left, the upper one of each pair is at the top.
+        order = np.lexsort((corners[..., 1], corners[..., 0]), axis=-1)
+        corners = np.take_along_axis(corners, order[..., np.newaxis], axis=1)
+        left_swapped = (corners[:, 0, 1] < corners[:, 1, 1])[:, np.newaxis]
+        right_swapped = (corners[:, 2, 1] < corners[:, 3, 1])[:, np.newaxis]
+        top_left = np.where(left_swapped, corners[:, 1], corners[:, 0])
+        bottom_left = np.where(left_swapped, corners[:, 0], corners[:, 1])
+        top_right = np.where(right_swapped, corners[:, 3], corners[:, 2])
+        bottom_right = np.where(right_swapped, corners[:, 2], corners[:, 3])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            m = ((targets[:, 0] - top_left[:, 0]) / (top_right[:, 0] - top_left[:, 0]))[:, np.newaxis]
+            n = ((targets[:, 0] - bottom_left[:, 0]) / (bottom_right[:, 0] - bottom_left[:, 0]))[:, np.newaxis]
+            q1 = top_left + m*(top_right - top_left)
+            q2 = bottom_left + n*(bottom_right - bottom_left)
+            l = ((targets[:, 1] - q1[:, 1]) / (q2[:, 1] - q1[:, 1]))[:, np.newaxis]
+            result = (q1 + l*(q2 - q1))[:, 2:]
+        failed = ~np.all(np.isfinite(result), axis=1)
+        if len(self) > 4:
+            with np.errstate(invalid='ignore'):
+                inside = np.all((np.hstack((m, n, l)) > -1e-6) & (np.hstack((m, n, l)) < 1 + 1e-6), axis=1)
+            failed |= ~inside
+        if failed.any():
+            result[failed] = self._weighted(targets[failed], 4, power=2)
+        return result
+
+
+# Methods of FocusSurface that interpolate locally between the closest sample points
+local_methods = ('bilinear', 'idw', 'thin_plate')
+
+
+class FocusSurface(object):
+    """
+    Stage z and fine focus (EHTFocus) as smooth functions of the stage position. The surface is fitted to the sample
+    points in a coord_dict (values are (x, y, z, focus) tuples) and can be evaluated for many positions at once.
+
+    Points added by retuning ("new_point_XXXX") are added one after the other with "add_point". Each of them is
+    compared to the prediction of the surface before it was added. If the difference is larger than
+    "outlier_threshold" times the robust standard deviation (from the median absolute deviation of all accepted
+    points so far) the point is rejected as outlier: It is kept in "points", but not used for the fit. This way a single
+    failed autofocus cannot warp the surface for the rest of the map.
+
+    Parameters
+    -----------
+    method : optional, str
+        "spline" for a smoothing spline (points added by retuning are weighted higher, the same as in
+        Mapping.interpolation_spline) or "rbf" for a thin plate radial basis function that goes through all points.
+        "bilinear", "idw" and "thin_plate" only use the closest points for each position (see SampleIndex.interpolate).
+    order : optional, int
+        Order of the spline. Defaults to sqrt(number of points) - 1, limited to 1...3.
+    outlier_threshold : optional, float
+        Number of standard deviations a new point can differ from the prediction.
+    default_sigma : optional, tuple
+        Standard deviation of (z, focus) in m that is used as long as less than three retuning points were accepted.
+    min_sigma : optional, tuple
+        Lower limit for the standard deviation of (z, focus) in m.
+    """
+
+    def __init__(self, coord_dict, method='spline', order=None, **kwargs):
+        self.method = method
+        self.outlier_threshold = kwargs.get('outlier_threshold', 3.5)
+        self.default_sigma = np.array(kwargs.get('default_sigma', (200e-9, 10e-9)))
+        self.min_sigma = np.array(kwargs.get('min_sigma', (20e-9, 1e-9)))
+        self.keys = []
+        # Number of each point from retuning ("new_point_XXXX"), -1 for all other points
+        self.sequence = np.zeros(0, dtype=np.int64)
+        # residuals are (z, focus) of a point minus the prediction before it was added (0 for the initial points)
+        self.points = np.zeros((0, 4))
+        self.residuals = np.zeros((0, 2))
+        self.inliers = np.zeros(0, dtype=bool)
+        self._interpolators = None
+        # Increased with every refit, so that cached evaluations of the surface can be checked for being up to date
+        self.version = 0
+        new_points = []
+        for key, value in coord_dict.items():
+            if value is None:
+                continue
+            if key.startswith('new'):
+                new_points.append((key, value))
+            else:
+                self._append(key, value, (0, 0), True)
+        if order is None:
+            order = int(np.sqrt(len(self.points)) - 1)
+        self.order = int(np.clip(order, 1, 3))
+        self.fit()
+        for key, value in sorted(new_points):
+            self.add_point(key, value)
+
+    @staticmethod
+    def sequence_number(key):
+        """
+        Returns the number of a point from retuning ("new_point_XXXX") or -1 for all other points.
+        """
+        splitkey = key.split('_')
+        if splitkey[0] == 'new':
+            return int(splitkey[-1])
+        return -1
+
+    @staticmethod
+    def sample_weights(sequence, number_points):
+        """
+        Points from retuning (with a "sequence" number >= 0, see "sequence_number") get a weight of 10 that is halved
+        for every point that was added after them, but never drops below 1. All other points have the weight 1.
+        """
+        sequence = np.asarray(sequence)
+        with np.errstate(over='ignore'):
+            weights = np.maximum(10 / 2.0**(number_points - 4 - sequence), 1)
+        weights[sequence < 0] = 1
+        return weights
+
+    @property
+    def weights(self):
+        return self.sample_weights(self.sequence, len(self.sequence))
+
+    @property
+    def sigma(self):
+        """
+        Robust estimate of the standard deviation of (z, focus) of the accepted retuning points.
+        """
+        accepted = self.residuals[self.inliers & (self.sequence >= 0)]
+        if len(accepted) < 3:
+            return self.default_sigma.copy()
+        return np.maximum(1.4826 * np.median(np.abs(accepted), axis=0), self.min_sigma)
+
+    def _append(self, key, point, residual, inlier):
+        self.keys.append(key)
+        self.sequence = np.append(self.sequence, self.sequence_number(key))
+        self.points = np.vstack((self.points, np.asarray(point[:4], dtype=np.float64)))
+        self.residuals = np.vstack((self.residuals, np.asarray(residual, dtype=np.float64)))
+        self.inliers = np.append(self.inliers, inlier)
+
+    def add_point(self, key, point):
+        """
+        Adds a new sample point and refits the surface if the point is not an outlier.
+        Returns the residual (z, focus) of the point and whether it was accepted.
+        """
+        residual = np.asarray(point[2:4], dtype=np.float64) - np.array([values[0] for values in
+                                                                        self(point[0:1], point[1:2])])
+        accepted = bool(np.all(np.abs(residual) <= self.outlier_threshold * self.sigma))
+        self._append(key, point, residual, accepted)
+        if accepted:
+            self.fit()
+        return residual, accepted
+
+    def residual(self, key):
+        """
+        Returns the residual (z, focus) of the point "key" and whether it is used for the fit.
+        """
+        index = self.keys.index(key)
+        return self.residuals[index], bool(self.inliers[index])
+
+    def fit(self):
+        self.version += 1
+        x, y, z, focus = self.points[self.inliers].T
+        if self.method == 'spline':
+            weights = self.weights[self.inliers]
+            self._interpolators = [SmoothBivariateSpline(x, y, values, kx=self.order, ky=self.order, w=weights)
+                                   for values in (z, focus)]
+        elif self.method == 'rbf':
+            self._interpolators = [Rbf(x, y, values, function='thin_plate') for values in (z, focus)]
+        elif self.method in local_methods:
+            self._interpolators = SampleIndex(self.points[self.inliers])
+        else:
+            raise ValueError('Unknown focus surface method {}. Possible values are "spline", "rbf", "bilinear", '
+                             '"idw" and "thin_plate".'.format(self.method))
+
+    def __call__(self, x, y):
+        """
+        Returns z and focus at the positions (x, y) as two arrays with the shape of x.
+        """
+        x = np.asarray(x, dtype=np.float64)
+        y = np.asarray(y, dtype=np.float64)
+        if self.method == 'spline':
+            return tuple(interpolator.ev(x, y) for interpolator in self._interpolators)
+        if self.method in local_methods:
+            values = self._interpolators.interpolate(np.column_stack((x.ravel(), y.ravel())), method=self.method)
+            return tuple(np.reshape(values[:, i], x.shape) for i in range(2))
+        return tuple(np.reshape(interpolator(x.ravel(), y.ravel()), x.shape) for interpolator in self._interpolators)
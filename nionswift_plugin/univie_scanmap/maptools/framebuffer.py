@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 22:10:17 2026
+
+@author: mittelberger
+"""
+
+import logging
+import os
+import queue
+import threading
+import numpy as np
+
+from . import offload
+
+
+class Frame(object):
+    """
+    Stand-in for the data_and_metadata objects returned by SuperScan. Only "data" is kept, which is all the processing
+    tasks use. If the data lies in shared memory, "shared" is its (name, offset, shape, dtype) there (see
+    offload.ProcessBackend).
+    """
+
+    def __init__(self, data, shared=None):
+        self.data = data
+        self.shared = shared
+
+
+class SpilledFrame(object):
+    """
+    A frame that was written to disk because the frame buffer was full. The data is only read back when "data" is
+    accessed for the first time.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = None
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = np.load(self.path)
+        return self._data
+
+
+class FrameBuffer(object):
+    """
+    Ring buffer of preallocated frame slots that replaces Buffer between AcquisitionLoop and ProcessingLoop.
+    Every slot holds "number_channels" frames of "shape". "put" copies the frames of an image into a free slot and
+    replaces the data in the image by Frame objects that are views into the slot. The slot is reused as soon as the
+    consumer calls "release" with the value of the key "slot" of the image, so tasks that keep frames must copy them.
+    If no slot is free, frames are spilled to "spill_path" (if given, otherwise "put" blocks like queue.Queue.put).
+    Frames that do not fit the slots (a different size or a dtype that cannot be cast to the slots without loss) are
+    copied into new arrays.
+    The number of slots is chosen so that they do not need more than "max_memory" bytes (at most "max_slots").
+    If "shared" is True, the slots are allocated in shared memory, so that worker processes can read the frames without
+    copying them. "close" has to be called to free the shared memory in this case.
+    """
+
+    def __init__(self, shape, number_channels=1, dtype=np.float32, **kwargs):
+        self.shape = tuple(int(value) for value in shape)
+        self.number_channels = int(number_channels)
+        self.dtype = np.dtype(dtype)
+        self.max_memory = kwargs.get('max_memory', 2*1024**3)
+        self.max_slots = kwargs.get('max_slots', 200)
+        self.spill_path = kwargs.get('spill_path')
+        slot_size = self.number_channels * int(np.prod(self.shape)) * self.dtype.itemsize
+        number_slots = int(np.clip(self.max_memory // max(slot_size, 1), 1, self.max_slots))
+        self._shared_memory = None
+        if kwargs.get('shared') and offload.shared_memory_available():
+            self._shared_memory = offload.create_shared_memory(number_slots * slot_size)
+            self._slots = np.ndarray((number_slots, self.number_channels) + self.shape, dtype=self.dtype,
+                                     buffer=self._shared_memory.buf)
+        else:
+            self._slots = np.empty((number_slots, self.number_channels) + self.shape, dtype=self.dtype)
+        self._slot_size = slot_size
+        self._number_slots = number_slots
+        self._free = list(range(number_slots - 1, -1, -1))
+        self._queue = queue.Queue()
+        self._condition = threading.Condition()
+        self._spill_counter = 0
+        self.high_water_mark = 0
+        self.number_frames = 0
+        self.number_spilled = 0
+        self.number_unpooled = 0
+
+    @classmethod
+    def from_frame_parameters(cls, nion_frame_parameters, detectors, **kwargs):
+        """
+        Creates a frame buffer for images acquired with "nion_frame_parameters" (see
+        SuperScanMapper.create_nion_frame_parameters) from all enabled "detectors".
+        """
+        number_channels = max(int(np.count_nonzero(list(detectors.values()))), 1)
+        return cls(nion_frame_parameters['size'], number_channels=number_channels, **kwargs)
+
+    @property
+    def number_slots(self):
+        return self._number_slots
+
+    @property
+    def occupancy(self):
+        """
+        Number of slots that are in use.
+        """
+        with self._condition:
+            return self.number_slots - len(self._free)
+
+    def qsize(self):
+        return self._queue.qsize()
+
+    def report(self):
+        """
+        Returns a dictionary with the current state and the statistics of the buffer.
+        """
+        with self._condition:
+            return {'slots': self.number_slots, 'occupied': self.number_slots - len(self._free),
+                    'high_water_mark': self.high_water_mark, 'queued': self._queue.qsize(),
+                    'frames': self.number_frames, 'spilled': self.number_spilled, 'unpooled': self.number_unpooled}
+
+    def put(self, image, block=True, timeout=None):
+        arrays = [np.asarray(getattr(frame, 'data', frame)) for frame in image['data']]
+        fits = (0 < len(arrays) <= self.number_channels and
+                all(np.shape(array) == self.shape and np.can_cast(array.dtype, self.dtype, 'safe')
+                    for array in arrays))
+        slot = None
+        if fits:
+            with self._condition:
+                if not self._free and self.spill_path is None:
+                    if not block or not self._condition.wait_for(lambda: self._free, timeout=timeout):
+                        raise queue.Full
+                if self._free:
+                    slot = self._free.pop()
+                    self.high_water_mark = max(self.high_water_mark, self.number_slots - len(self._free))
+        image = dict(image)
+        if slot is not None:
+            frames = []
+            for channel, array in enumerate(arrays):
+                self._slots[slot, channel] = array
+                shared = None
+                if self._shared_memory is not None:
+                    offset = slot * self._slot_size + channel * self._slots[slot, channel].nbytes
+                    shared = (self._shared_memory.name, offset, self.shape, self.dtype.str)
+                frames.append(Frame(self._slots[slot, channel], shared=shared))
+            image['data'] = frames
+        elif fits:
+            slot = self._spill(arrays)
+            image['data'] = [SpilledFrame(path) for path in slot]
+        else:
+            image['data'] = [Frame(np.array(array)) for array in arrays]
+            self.number_unpooled += 1
+        image['slot'] = slot
+        self.number_frames += 1
+        self._queue.put(image)
+
+    def _spill(self, arrays):
+        if not os.path.exists(self.spill_path):
+            os.makedirs(self.spill_path)
+        paths = []
+        for array in arrays:
+            with self._condition:
+                self._spill_counter += 1
+                path = os.path.join(self.spill_path, '{:06d}.npy'.format(self._spill_counter))
+            np.save(path, array)
+            paths.append(path)
+        self.number_spilled += 1
+        return paths
+
+    def get(self, block=True, timeout=None):
+        return self._queue.get(block=block, timeout=timeout)
+
+    def release(self, slot):
+        """
+        Gives the slot of an image (the value of its key "slot") back to the buffer. Has to be called exactly once for
+        every image returned by "get" when all tasks are done with it.
+        """
+        if isinstance(slot, list):
+            for path in slot:
+                try:
+                    os.remove(path)
+                except OSError as detail:
+                    logging.warning('Could not remove spilled frame {:s}. Reason: {:s}'.format(path, str(detail)))
+        elif slot is not None:
+            with self._condition:
+                self._free.append(slot)
+                self._condition.notify()
+        self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+    def close(self):
+        """
+        Frees the shared memory of the slots. The buffer cannot be used anymore afterwards.
+        """
+        if self._shared_memory is not None:
+            self._slots = None
+            offload.release_shared_memory(self._shared_memory)
+            self._shared_memory = None
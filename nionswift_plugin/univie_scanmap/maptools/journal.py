@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 17:05:33 2026
+
+@author: mittelberger
+"""
+
+import json
+import logging
+import os
+import threading
+
+
+class TileJournal(object):
+    """
+    Append-only journal of a map. Every entry is one line of JSON that is flushed to disk (and fsynced) before "write"
+    returns, so after a crash the journal contains everything that was finished up to that point.
+    Entries for finished tiles have the key "number" (the frame number), entries for other events have the key
+    "event" (e.g. "new_point" when retuning added a new sample point to coord_dict).
+    """
+
+    filename = 'tile_journal.txt'
+
+    def __init__(self, path):
+        self.path = os.path.normpath(path)
+        self._lock = threading.Lock()
+        self._file = None
+
+    def open(self, mode='a'):
+        """
+        Opens the journal file. Use mode='w' to start a new journal, mode='a' to continue an existing one.
+        """
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, mode=mode)
+
+    def write(self, entry):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, mode='a')
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read(path):
+        """
+        Returns all entries in the journal at "path" as list of dictionaries. A broken last line (e.g. from a crash
+        during writing) is ignored.
+        """
+        entries = []
+        if not os.path.isfile(path):
+            return entries
+        with open(path) as journal_file:
+            for line in journal_file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    logging.warning('Skipping broken line in tile journal: ' + line)
+        return entries
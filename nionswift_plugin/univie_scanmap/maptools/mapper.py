@@ -18,9 +18,26 @@ with warnings.catch_warnings():
 
 from .autotune import Imaging, Tuning, DirtError
 from scipy.interpolate import Rbf, SmoothBivariateSpline
-from .autoalign import align
+from .average import RunningAverage
+from .display import DisplayUpdater
+from .tileplan import TilePlan
+from .traversal import get_traversal_order, travel_report
+from .regions import points_in_polygon
+from .settle import SettleModel, measure_drift
+from .journal import TileJournal
+from .tilelog import TileLog
+from .focus import FocusSurface, SampleIndex
+from .framebuffer import FrameBuffer
+from . import offload
+from .timing import TimingRecorder
+from .writer import FrameWriter
+from .series import SeriesSaver
+from .mosaic import MosaicStore
+from .events import (EventBus, TaskFinished, DirtCoverage, IntensityChange, TuningNeeded, SeriesProcessed)
+from .streaming import PartialFrameMonitor, read_partial_frame
 import threading
 import queue
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 
 class Mapping(object):
 
@@ -62,14 +79,60 @@ class Mapping(object):
         self.isotope_mapping_settings = kwargs.get('isotope_mapping_settings', {})
         self.average_number = kwargs.get('average_number', 1)
         self.max_align_dist = kwargs.get('max_align_dist', 0.01)
-        self.average_data_item_HAADF = None
-        self.average_data_item_MAADF = None
-        self.last_frames_HAADF = []
-        self.last_frames_MAADF = []
+        # Running averages (average.RunningAverage) of the last "average_number" frames of the current series
+        self.last_frames_HAADF = RunningAverage(self.average_number, max_shift=self.max_align_dist)
+        self.last_frames_MAADF = RunningAverage(self.average_number, max_shift=self.max_align_dist)
         self.sleeptime = kwargs.get('sleeptime', 2)
+        # Live images and averages are shown in Nion Swift by a display.DisplayUpdater as previews with at most
+        # "display_size" pixels per side and at most "display_rate" updates per second for each data item
+        self.display_size = kwargs.get('display_size', 512)
+        self.display_rate = kwargs.get('display_rate', 2)
+        self.display = None
+        # Wait time after the move to the first tile (s)
+        self.first_wait_time = kwargs.get('first_wait_time', 10)
         self.nion_frame_parameters = {}
         self.number_samples = 4
         self.intensity_threshold_for_abort = 0.1
+        self.tile_plan = None
+        # Name of one of the orders in traversal.traversal_orders or a function that takes a TilePlan and returns an
+        # index array.
+        self.traversal_order = kwargs.get('traversal_order', 'row_snake')
+        # Optional restrictions of the mapped area: "map_polygon" is a list of (x, y) stage coordinates, "map_mask" a
+        # regions.MapMask instance (e.g. created from an overview image). Only tiles whose center lies inside both
+        # will be visited.
+        self.map_polygon = kwargs.get('map_polygon')
+        self.map_mask = kwargs.get('map_mask')
+        # If the switch "adaptive_settle_time" is on, the wait time after each stage move is predicted by a
+        # settle.SettleModel. It is loaded from "settle_model_path" (which is per instrument) if not given.
+        self.settle_model = kwargs.get('settle_model')
+        self.instrument_name = kwargs.get('instrument_name', 'default')
+        self.settle_model_path = kwargs.get('settle_model_path', SettleModel.default_path(self.instrument_name))
+        # Two-pass mapping (switch "survey_first"): All tiles are acquired with "survey_frame_parameters" first (they
+        # update "frame_parameters", but the field of view is always the same) and only tiles with a graphene fraction
+        # of at least "survey_threshold" and at least "survey_minimum_peaks" visible lattice reflections are acquired
+        # again with the full "frame_parameters" and "number_of_images".
+        self.survey_frame_parameters = kwargs.get('survey_frame_parameters', {'size_pixels': (512, 512)})
+        self.survey_threshold = kwargs.get('survey_threshold', 0.5)
+        self.survey_minimum_peaks = kwargs.get('survey_minimum_peaks', 4)
+        # Frames are written by a writer.FrameWriter in its own thread. "fsync_policy" is its "fsync" setting ("never",
+        # "batch" or "always").
+        self.fsync_policy = kwargs.get('fsync_policy', 'never')
+        # With the switch "compress_frames", frames are compressed with "compression_codec" ("zlib" or "lzma") at
+        # "compression_level" by "compression_workers" threads and frames that only contain counts are saved as uint16.
+        self.compression_codec = kwargs.get('compression_codec', 'zlib')
+        self.compression_level = kwargs.get('compression_level', 6)
+        self.compression_workers = kwargs.get('compression_workers', 4)
+        # With the switch "abort_on_partial_frames", the checks for aborting a series on dirt or intensity changes also
+        # run on the frame that is being acquired, every "partial_frame_interval" seconds (see
+        # streaming.PartialFrameMonitor)
+        self.partial_frame_interval = kwargs.get('partial_frame_interval', 0.5)
+        # With the switch "live_mosaic", every tile is put into a mosaic.MosaicStore in the folder "mosaic" of the map
+        # as soon as it is acquired. The tiles are downsampled by "mosaic_binning".
+        self.mosaic_binning = kwargs.get('mosaic_binning', 4)
+        # Cache for the focus surfaces (one per method) and the z and focus values in tile_plan (see
+        # "update_focus_map")
+        self._focus_surfaces = {}
+        self._focus_map_state = None
 
     @property
     def online(self):
@@ -94,6 +157,24 @@ class Mapping(object):
         self._savepath = os.path.normpath(savepath)
 
     def add_to_last_images(self, image, *args, **kwargs):
+        """
+        Adds "image" to the running averages of the last frames. A new average starts with the first frame of every
+        series. With the switch "aligned_average", frames are aligned to the first frame of the series.
+        """
+        if kwargs.get('is_first'):
+            self.reset_last_images()
+        # "average_number" and "max_align_dist" can be changed in the GUI while mapping
+        for detector in ['HAADF', 'MAADF']:
+            average = getattr(self, 'last_frames_' + detector)
+            if average.length != max(self.average_number, 1) or average.max_shift != self.max_align_dist:
+                setattr(self, 'last_frames_' + detector,
+                        RunningAverage(self.average_number, max_shift=self.max_align_dist))
+        if isinstance(image, (list, tuple)):
+            # Frames from the frame buffer are views into reused slots. They do not have to be copied here, because
+            # RunningAverage.add copies them into its ring before this task returns and the slot can be reused.
+            image = [getattr(frame, 'data', frame) for frame in image]
+            if len(image) == 1:
+                image = image[0]
         if self.detectors['HAADF'] and self.detectors['MAADF']:
             haadfimage = image[0]
             maadfimage = image[1]
@@ -103,20 +184,14 @@ class Mapping(object):
             maadfimage = image
 
         if self.detectors['HAADF']:
-            if len(self.last_frames_HAADF) >= self.average_number:
-                self.last_frames_HAADF.pop(0)
-
-            if self.switches.get('aligned_average') and len(self.last_frames_HAADF) > 1:
-                haadfimage = align(self.last_frames_HAADF[0], haadfimage, ratio=self.max_align_dist)
-            self.last_frames_HAADF.append(haadfimage)
+            self.last_frames_HAADF.add(haadfimage, align=self.switches.get('aligned_average'))
 
         if self.detectors['MAADF']:
-            if len(self.last_frames_MAADF) >= self.average_number:
-                self.last_frames_MAADF.pop(0)
+            self.last_frames_MAADF.add(maadfimage, align=self.switches.get('aligned_average'))
 
-            if self.switches.get('aligned_average') and len(self.last_frames_MAADF) > 1:
-                maadfimage = align(self.last_frames_MAADF[0], maadfimage, ratio=self.max_align_dist)
-            self.last_frames_MAADF.append(maadfimage)
+    def reset_last_images(self):
+        self.last_frames_HAADF.reset()
+        self.last_frames_MAADF.reset()
 
 
     def create_map_coordinates(self, compensate_stage_error=False,
@@ -127,6 +202,11 @@ class Mapping(object):
         self.rightX = np.amax((self.coord_dict['top-right'][0], self.coord_dict['bottom-right'][0]))
         self.topY = np.amax((self.coord_dict['top-left'][1], self.coord_dict['top-right'][1]))
         self.botY = np.amin((self.coord_dict['bottom-left'][1], self.coord_dict['bottom-right'][1]))
+        # If a polygon is given it defines the mapped area instead of the four corners
+        if self.map_polygon is not None:
+            polygon = np.asarray(self.map_polygon)
+            self.leftX, self.topY = np.amin(polygon[:, 0]), np.amax(polygon[:, 1])
+            self.rightX, self.botY = np.amax(polygon[:, 0]), np.amin(polygon[:, 1])
 
         imsize = self.frame_parameters['fov']*1e-9
         distance = self.offset*imsize
@@ -134,10 +214,6 @@ class Mapping(object):
         self.num_subframes = np.array((int(np.abs(self.rightX-self.leftX)/(imsize+distance))+1,
                                        int(np.abs(self.topY-self.botY)/(imsize+distance))+1))
 
-        map_coords = []
-        frame_info = []
-
-
         # add additional lines and frames to number of subframes
         if compensate_stage_error:
             try:
@@ -162,12 +238,12 @@ class Mapping(object):
                 xfirstline = np.mean(firstlines[1]*np.array([mapnames['pixelsize']]).T, axis=0)
                 yfirstline = np.mean(firstlines[0]*np.array([mapnames['pixelsize']]).T, axis=0)
                 # Pick the offsets at the appropriate positions for this specific map and convert them to m
-                xevenline = xevenline[np.rint(np.mgrid[0:100:self.num_subframes[0]*1j]).astype(np.int)] * 1e-9
-                xoddline = xoddline[np.rint(np.mgrid[0:100:self.num_subframes[0]*1j]).astype(np.int)] * 1e-9
-                xfirstline = xfirstline[np.rint(np.mgrid[0:100:self.num_subframes[0]*1j]).astype(np.int)] * 1e-9
-                yevenline = yevenline[np.rint(np.mgrid[0:100:self.num_subframes[1]*1j]).astype(np.int)] * 1e-9
-                yoddline = yoddline[np.rint(np.mgrid[0:100:self.num_subframes[1]*1j]).astype(np.int)] * 1e-9
-                yfirstline = yfirstline[np.rint(np.mgrid[0:100:self.num_subframes[1]*1j]).astype(np.int)] * 1e-9
+                xevenline = xevenline[np.rint(np.mgrid[0:100:self.num_subframes[0]*1j]).astype(int)] * 1e-9
+                xoddline = xoddline[np.rint(np.mgrid[0:100:self.num_subframes[0]*1j]).astype(int)] * 1e-9
+                xfirstline = xfirstline[np.rint(np.mgrid[0:100:self.num_subframes[0]*1j]).astype(int)] * 1e-9
+                yevenline = yevenline[np.rint(np.mgrid[0:100:self.num_subframes[1]*1j]).astype(int)] * 1e-9
+                yoddline = yoddline[np.rint(np.mgrid[0:100:self.num_subframes[1]*1j]).astype(int)] * 1e-9
+                yfirstline = yfirstline[np.rint(np.mgrid[0:100:self.num_subframes[1]*1j]).astype(int)] * 1e-9
 
             # Do not use else here to make sure the zero-offset arrays are also created when compensate_stage_error was
             # disabled in the last step.
@@ -175,100 +251,46 @@ class Mapping(object):
             xevenline = xoddline = xfirstline = np.zeros(self.num_subframes[0])
             yevenline = yoddline = yfirstline = np.zeros(self.num_subframes[1])
 
-#            extra_lines = 2  # Number of lines to add at the beginning of the map
-#            extra_frames = 5  # Number of extra moves at each end of a line
-#            oldm = 0.25  # odd line distance mover (additional offset of odd lines, in fractions of (imsize+distance))
-#            eldm = 0  # even line distance mover (additional offset of even lines, in fractions of (imsize+distance))
-#            num_subframes = self.num_subframes + np.array((2*extra_frames, extra_lines))
-#            leftX = self.leftX - extra_frames*(imsize+distance)
-#            for i in range(extra_lines):
-#                if i % 2 == 0:  # Odd lines (have even indices because numbering starts with 0), e.g. map from left to right
-#                    topY = self.topY + imsize + oldm*distance
-#                else:
-#                    topY = self.topY + imsize + eldm*distance
-#        else:
-#            num_subframes = self.num_subframes
-#            leftX = self.leftX
-#            topY = self.topY
-#            oldm = 0
-#            eldm = 0
-        # make a list of coordinates where images will be aquired.
-        # Starting point is the upper-left corner and mapping will proceed to the right. The next line will start
-        # at the right and scan towards the left. The next line will again start at the left, and so on. E.g. a "snake shaped"
-        # path is chosen for the mapping.
-        num_subframes = self.num_subframes
-        leftX = self.leftX
-        topY = self.topY
-        # Focus interpolation will be done live to take changes of the smaple points into account. The map_coords tuples
-        # will still have len-4, because the first two coordinates are the position were the stage will move to, the
-        # last two are the target positions for the interpolation. In case of uncorrected stage movement they will be
-        # the same, otherwise they can differ.
-        for j in range(num_subframes[1]):
-            for i in range(num_subframes[0]):
-                if j == 0:
-                    map_coords.append(tuple((leftX + i*(imsize+distance),
-                                             topY - j*(imsize+distance))) +
-                                      tuple((leftX + i*(imsize+distance) + xfirstline[i],
-                                             topY - j*(imsize+distance) - yfirstline[j])))
-                    if self.retuning_mode[0] == 'edges' and i == 0:
-                        frame_info.append({'number': j*num_subframes[0]+i, 'retune': True, 'corner': 'top-left'})
-                    else:
-                        frame_info.append({'number': j*num_subframes[0]+i})
-                elif j % 2 == 0:  # Odd lines (have even indices because numbering starts with 0), e.g. map from left to right
-                    map_coords.append(tuple((leftX + i*(imsize+distance),
-                                             topY - j*(imsize+distance))) +
-                                      tuple((leftX + i*(imsize+distance) + xoddline[i],
-                                             topY - j*(imsize+distance) - yoddline[j])))
-
-                    if self.retuning_mode[0] == 'edges' and i == 0:
-                        frame_info.append({'number': j*num_subframes[0]+i, 'retune': True, 'corner': 'top-left'})
-                    else:
-                        frame_info.append({'number': j*num_subframes[0]+i})
-#                    map_coords.append(tuple((leftX+i*(imsize+distance),
-#                                             topY-j*(imsize+distance) - oldm*(imsize+distance))) +
-#                                      tuple(self.interpolation((leftX + i*(imsize+distance),
-#                                            topY-j*(imsize+distance) - oldm*(imsize+distance)))))
-
-                    # Apply correct (continuous) frame numbering for all cases. If no extra positions are added, just
-                    # append the correct frame number. Elsewise append the correct frame number if a non-additional
-                    # one, else None
-#                    if not compensate_stage_error:
-#                        frame_info.append(j*num_subframes[0]+i)
-#                    elif extra_frames <= i < num_subframes[0]-extra_frames and j >= extra_lines:
-#                        frame_info.append((j-extra_lines)*(num_subframes[0]-2*extra_frames)+(i-extra_frames))
-#                    else:
-#                        frame_info.append(None)
-
-                else: # Even lines, e.g. scan from right to left
-                    map_coords.append(tuple((leftX + (num_subframes[0] - (i+1))*(imsize + distance),
-                                             topY-j*(imsize + distance))) +
-                                      tuple((leftX + (num_subframes[0] - (i+1))*(imsize + distance) + xevenline[i],
-                                             topY-j*(imsize + distance) - yevenline[j])))
-
-                    if self.switches.get('focus_at_edges') and num_subframes[0]-(i+1) == 0:
-                        frame_info.append({'number': j*num_subframes[0]+(num_subframes[0]-(i+1)), 'retune': True,
-                                             'corner': 'top-right'})
-                    else:
-                        frame_info.append({'number': j*num_subframes[0]+(num_subframes[0]-(i+1))})
-
-#                    map_coords.append(tuple((leftX + (num_subframes[0] - (i+1))*(imsize + distance),
-#                                             topY-j*(imsize + distance) - eldm*(imsize + distance))) +
-#                                      tuple(self.interpolation(
-#                                            (leftX + (num_subframes[0] - (i+1))*(imsize + distance),
-#                                             topY-j*(imsize + distance) - eldm*(imsize + distance)))))
-#
-#                    # Apply correct (continuous) frame numbering for all cases. If no extra positions are added, just
-#                    # append the correct frame number. Elsewise append the correct frame number if a non-additional
-#                    # one, else None
-#                    if not compensate_stage_error:
-#                        frame_info.append(j*num_subframes[0]+(num_subframes[0]-(i+1)))
-#                    elif extra_frames <= i < num_subframes[0]-extra_frames and j >= extra_lines:
-#                        frame_info.append( (j-extra_lines)*(num_subframes[0]-2*extra_frames) +
-#                                             ((num_subframes[0]-2*extra_frames)-(i-extra_frames+1)) )
-#                    else:
-#                        frame_info.append(None)
+        # Build the offset arrays for the whole grid. The first line uses the "firstline" offsets, lines with odd
+        # indices (mapped from right to left) the "evenline" and all other lines the "oddline" offsets. x offsets are
+        # indexed by the position of a frame within the traversal of its line, y offsets by the line number.
+        odd_lines = (np.arange(self.num_subframes[1]) % 2 == 1)[:, np.newaxis]
+        x_corrections = np.where(odd_lines, xevenline, xoddline)
+        x_corrections[0] = xfirstline
+        y_corrections = np.where(odd_lines, yevenline[:, np.newaxis], yoddline[:, np.newaxis])
+        y_corrections = np.repeat(y_corrections, self.num_subframes[0], axis=1)
+        y_corrections[0] = yfirstline[0]
 
-        return (map_coords, frame_info)
+        # Starting point is the upper-left corner and mapping will proceed to the right. The next line will start
+        # at the right and scan towards the left. The next line will again start at the left, and so on. E.g. a "snake
+        # shaped" path is chosen for the mapping.
+        # Focus interpolation will be done live to take changes of the sample points into account. The tile plan holds
+        # the position were the stage will move to ("x_corrected", "y_corrected") and the target positions for the
+        # interpolation ("x", "y"). In case of uncorrected stage movement they will be the same, otherwise they can
+        # differ.
+        self.tile_plan = TilePlan.snake(self.leftX, self.topY, self.num_subframes, imsize+distance,
+                                        x_corrections=x_corrections, y_corrections=y_corrections)
+        keep = np.ones(len(self.tile_plan), dtype=bool)
+        if self.map_polygon is not None:
+            keep &= points_in_polygon(self.tile_plan.positions, self.map_polygon)
+        if self.map_mask is not None:
+            keep &= self.map_mask.contains(self.tile_plan.positions)
+        self.tile_plan.restrict(keep)
+
+        # The left-most remaining tile in each line counts as edge of the map
+        tiles = self.tile_plan.tiles
+        first_columns = np.full(self.num_subframes[1], np.iinfo(np.int32).max)
+        np.minimum.at(first_columns, tiles['row'], tiles['column'])
+        left_edge = tiles['column'] == first_columns[tiles['row']]
+        if self.retuning_mode[0] == 'edges':
+            tiles['retune'][left_edge & (tiles['row'] % 2 == 0)] = True
+        if self.switches.get('focus_at_edges'):
+            tiles['retune'][left_edge & (tiles['row'] % 2 == 1)] = True
+
+        # Frame numbers depend only on the grid position, so file names do not change with the traversal order
+        self.tile_plan.reorder(get_traversal_order(self.traversal_order)(self.tile_plan))
+
+        return self.tile_plan
 
     def create_sample_points(self):
         self.create_map_coordinates()
@@ -360,11 +382,16 @@ class Mapping(object):
         return (False, message)
 
     def tuning_successful(self, success, new_point):
+        """
+        Returns the key under which "new_point" was added to coord_dict (None if it was not added).
+        """
+        key = None
         if success:
             counter = 0
             while counter < 10000:
                 if not self.coord_dict.get('new_point_{:04d}'.format(counter)):
-                    self.coord_dict['new_point_{:04d}'.format(counter)] = new_point
+                    key = 'new_point_{:04d}'.format(counter)
+                    self.coord_dict[key] = new_point
                     if hasattr(self, 'interpolator'):
                         delattr(self, 'interpolator')
                     break
@@ -385,6 +412,7 @@ class Mapping(object):
                 self.missing_peaks = 0
             else:
                 pass
+        return key
 
     def handle_retuning(self, frame_coord, frame_info):
         # tests in each frame after aquisition if all 6 reflections in the fft are still there (only for frames where
@@ -534,8 +562,7 @@ class Mapping(object):
                     message += 'Found missing atom after {:d} frames '.format(i)
                     Imager.logwrite('Found missing atom after {:d} frames '.format(i))
                     break
-            self.last_frames_HAADF = []
-            self.last_frames_MAADF = []
+            self.reset_last_images()
 
 #                elif (np.sum(Imager.image) > 3 - 2*self.isotope_mapping_settings.get('intensity_threshold', 0.8) *
 #                      intensity_reference):
@@ -549,63 +576,24 @@ class Mapping(object):
 
     def interpolation(self, target):
         """
-        Bilinear Interpolation between 4 points that do not have to lie on a regular grid.
+        Bilinear Interpolation between the 4 sample points in coord_dict that are closest to target. The points do not
+        have to lie on a regular grid.
 
         Parameters
         -----------
         target : Tuple
-            (x,y) coordinates of the point you want to interpolate
-
-        points : List of tuples
-            Defines the corners of a quadrilateral. The points in the list
-            are supposed to have the order (top-left, top-right, bottom-right, bottom-left)
-            The length of the tuples has to be at least 3 and can be as long as necessary.
-            The output will always have the length (points[i] - 2).
+            (x,y) coordinates of the point you want to interpolate. x and y can also be arrays, then all points are
+            interpolated at once.
 
         Returns
         -------
         interpolated_point : Tuple
-            Tuple with the length (points[i] - 2) that contains the interpolated value(s) at target (i is
-            a number iterating over the list entries).
+            (z, focus) at target.
         """
-        result = tuple()
-        points = []
-        if len(self.coord_dict) > 4:
-            closest_points = find_nearest_neighbors(4, target, list(self.coord_dict.values()))
-            raw_closest_points = []
-            for point in closest_points:
-                raw_closest_points.append(point[1:])
-            coord_dict = self.sort_quadrangle(raw_closest_points)
-        else:
-            coord_dict = self.coord_dict
-        print(coord_dict)
-        for corner in self._corners:
-            points.append(coord_dict[corner])
-        # Bilinear interpolation within 4 points that are not lying on a regular grid.
-        m = (target[0]-points[0][0]) / (points[1][0]-points[0][0])
-        n = (target[0]-points[3][0]) / (points[2][0]-points[3][0])
-
-        Q1 = np.array(points[0]) + m*(np.array(points[1])-np.array(points[0]))
-        Q2 = np.array(points[3]) + n*(np.array(points[2])-np.array(points[3]))
-
-        l = (target[1]-Q1[1]) / (Q2[1]-Q1[1])
-
-        T = Q1 + l*(Q2-Q1)
-
-        for j in range(len(points[0])-2):
-            result += (T[j+2],)
-
-    #Interpolation with Inverse distance weighting with a Thin-PLate-Spline Kernel
-    #    for j in range(len(points[0])-2):
-    #        interpolated = 0
-    #        sum_weights = 0
-    #        for i in range(len(points)):
-    #            distance = np.sqrt((target[0]-points[i][0])**2 + (target[1]-points[i][1])**2)
-    #            weight = 1/(distance**2*np.log(distance))
-    #            interpolated += weight * points[i][j+2]
-    #            sum_weights += weight
-    #        result += (interpolated/sum_weights,)
-        return result
+        z, focus = self.get_focus_surface(method='bilinear')(target[0], target[1])
+        if np.ndim(z) == 0:
+            return (float(z), float(focus))
+        return (z, focus)
 
     def interpolation_rbf(self, target):
         if not hasattr(self, 'interpolator'):
@@ -655,6 +643,56 @@ class Mapping(object):
             self.interpolator.append(SmoothBivariateSpline(x, y, focus, kx=order, ky=order, w=weigths))
         return (float(self.interpolator[0](*target)), float(self.interpolator[1](*target)))
 
+    def get_focus_surface(self, method='spline'):
+        """
+        Returns a focus.FocusSurface for the current sample points in coord_dict. If points were only added since the
+        last call (e.g. by tuning_successful), they are added to the existing surface, which rejects outliers. The
+        surface is created from scratch only if other points or the method changed.
+        """
+        points = [(key, None if value is None else tuple(value)) for key, value in self.coord_dict.items()]
+        if method in self._focus_surfaces:
+            last_points, surface = self._focus_surfaces[method]
+            if points[:len(last_points)] == last_points:
+                for key, value in points[len(last_points):]:
+                    if value is not None:
+                        surface.add_point(key, value)
+                self._focus_surfaces[method] = (points, surface)
+                return surface
+        surface = FocusSurface(self.coord_dict, method=method, order=int(np.sqrt(self.number_samples) - 1))
+        self._focus_surfaces[method] = (points, surface)
+        return surface
+
+    def update_focus_map(self, start=0, keep=None, method='spline'):
+        """
+        Evaluates the focus surface for all tiles in tile_plan from index "start" on (in traversal order) and writes
+        the results into the fields "z" and "focus" of the plan. Nothing is computed if neither the sample points nor
+        the plan changed since the last call.
+        "keep" is an optional boolean array of tiles whose values must not be changed (e.g. already visited ones).
+        """
+        surface = self.get_focus_surface(method=method)
+        tiles = self.tile_plan.tiles
+        state = self._focus_map_state
+        if (state is not None and state[0] is tiles and state[1] is surface and state[2] == surface.version and
+                start >= state[3]):
+            return
+        self._focus_map_state = (tiles, surface, surface.version, start)
+        update = np.zeros(len(tiles), dtype=bool)
+        update[start:] = True
+        if keep is not None:
+            update &= ~np.asarray(keep, dtype=bool)
+        tiles['z'][update], tiles['focus'][update] = surface(tiles['x'][update], tiles['y'][update])
+
+    def preview_focus_map(self, method='spline'):
+        """
+        Creates the tile plan for the current settings and evaluates the focus surface for all tiles without moving
+        the stage. Returns z and focus as images with the shape of the map grid (NaN where there is no tile), which
+        makes it easy to spot bad sample points before a map is started.
+        """
+        self.coord_dict = self.sort_quadrangle()
+        self.create_map_coordinates(compensate_stage_error=self.switches.get('compensate_stage_error', False))
+        self.update_focus_map(method=method)
+        return (self.tile_plan.to_grid('z', fill_value=np.nan), self.tile_plan.to_grid('focus', fill_value=np.nan))
+
     def load_mapping_config(self, path):
         #config_file = open(os.path.normpath(path))
         #counter = 0
@@ -744,6 +782,13 @@ class Mapping(object):
             config_file.write('dirt_area: ' + str(self.dirt_area) + '\n')
             config_file.write('intensity_threshold_for_abort: ' + str(self.intensity_threshold_for_abort) + '\n')
             config_file.write('sleeptime: ' + str(self.sleeptime) + '\n')
+            config_file.write('survey_frame_parameters: ' + str(self.survey_frame_parameters) + '\n')
+            config_file.write('survey_threshold: ' + str(self.survey_threshold) + '\n')
+            config_file.write('survey_minimum_peaks: ' + str(self.survey_minimum_peaks) + '\n')
+            if self.map_polygon is not None:
+                config_file.write('map_polygon: ' + str([tuple(float(value) for value in point) for point in self.map_polygon]) + '\n')
+            if isinstance(self.traversal_order, str):
+                config_file.write('traversal_order: ' + repr(self.traversal_order) + '\n')
             config_file.write('average_number: ' + str(self.average_number) + '\n')
             config_file.write('max_align_dist: ' + str(self.max_align_dist) + '\n')
             config_file.write('number_samples: ' + str(self.number_samples))
@@ -752,24 +797,51 @@ class Mapping(object):
 
         #config_file.close()
 
+    def get_settle_model(self):
+        """
+        Returns the settle model to use for this map or None if the fixed "sleeptime" should be used.
+        """
+        if not self.switches.get('adaptive_settle_time'):
+            return None
+        if self.settle_model is None:
+            self.settle_model = SettleModel.load(self.settle_model_path, default_time=self.sleeptime)
+        return self.settle_model
+
+    def save_mapped_coordinates(self, number_tiles=None, visited=None):
+        """
+        Saves stage coordinates, z and focus values of the first "number_tiles" tiles in "tile_plan" (all tiles if
+        not given) as images with the shape of the map grid. If "visited" is given (boolean array in traversal order),
+        only these tiles are saved.
+        """
+        for field in ['x', 'y', 'x_corrected', 'y_corrected', 'z', 'focus']:
+            tifffile.imsave(os.path.join(self.store, field + '_map.tif'),
+                            np.asarray(self.tile_plan.to_grid(field, number_tiles=number_tiles, mask=visited),
+                                       dtype='float32'))
+
+    def get_display(self):
+        """
+        Returns the display.DisplayUpdater that shows data in Nion Swift. It is also used by the Tuner.
+        """
+        if self.display is None:
+            self.display = DisplayUpdater(self.document_controller, max_rate=self.display_rate,
+                                          max_size=self.display_size)
+        return self.display
+
     def show_average_of_last_frames(self, *args, **kwargs):
         assert self.document_controller is not None, 'Cannot create a data item without a document controller instance'
         if self.detectors['HAADF']:
             assert len(self.last_frames_HAADF) > 0, 'No HAADF data to average.'
         if self.detectors['MAADF']:
-            assert len(self.last_frames_MAADF) > 0 is not None, 'No MAADF data to average.'
-
-        if self.average_data_item_HAADF is None and self.detectors['HAADF']:
-            self.average_data_item_HAADF = self.document_controller.library.create_data_item(
-                                           'Average of last {:.0f} frames (HAADF)'.format(self.average_number))
-        if self.average_data_item_MAADF is None and self.detectors['MAADF']:
-            self.average_data_item_MAADF = self.document_controller.library.create_data_item(
-                                           'Average of last {:.0f} frames (MAADF)'.format(self.average_number))
+            assert len(self.last_frames_MAADF) > 0, 'No MAADF data to average.'
 
+        # The averages are only computed (in the display thread) when they are actually shown
+        display = self.get_display()
         if self.detectors['HAADF']:
-            self.document_controller.queue_task(lambda: self.average_data_item_HAADF.set_data(np.mean(self.last_frames_HAADF, axis=0)))
-        elif self.detectors['MAADF']:
-            self.document_controller.queue_task(lambda: self.average_data_item_MAADF.set_data(np.mean(self.last_frames_MAADF, axis=0)))
+            display.update('Average of last {:.0f} frames (HAADF)'.format(self.average_number),
+                           self.last_frames_HAADF.average)
+        if self.detectors['MAADF']:
+            display.update('Average of last {:.0f} frames (MAADF)'.format(self.average_number),
+                           self.last_frames_MAADF.average)
 
     def sort_quadrangle(self, *args):
         """
@@ -886,7 +958,7 @@ class Mapping(object):
 
         self.Tuner = Tuning(frame_parameters=self.frame_parameters.copy(), detectors=self.detectors, event=self.event,
                      online=self.online, document_controller=self.document_controller, as2=self.as2,
-                     superscan=self.superscan)
+                     superscan=self.superscan, display=self.get_display())
 
         # Sort coordinates in case they were not in the right order
 #        self.coord_dict = self.sort_quadrangle()
@@ -896,35 +968,45 @@ class Mapping(object):
         self.topY = np.amax((self.coord_dict['top-left'][1], self.coord_dict['top-right'][1]))
         self.botY = np.amin((self.coord_dict['bottom-left'][1], self.coord_dict['bottom-right'][1]))
 
-        map_coords, map_infos = self.create_map_coordinates(compensate_stage_error=
-                                                               self.switches['compensate_stage_error'])
+        tile_plan = self.create_map_coordinates(compensate_stage_error=self.switches['compensate_stage_error'])
         # create output folder:
         self.store = os.path.join(self.savepath, self.foldername)
         if not os.path.exists(self.store):
             os.makedirs(self.store)
 
         logfile = open(os.path.join(self.store, 'log.txt'), mode='w')
-        test_map = []
+        tile_log = TileLog(os.path.join(self.store, TileLog.filename))
+        tile_log.open(mode='w')
+        writer = self.create_writer(on_error=self.Tuner.logwrite)
         counter = 0
+        # Only used for its settle times, the stage is moved below
+        settle_loop = MappingLoop(tile_plan, wait_time=self.sleeptime, first_wait_time=self.first_wait_time,
+                                  settle_model=self.get_settle_model())
+        previous_position = None
+        previous_move = (0, 0)
         self.write_map_info_file()
-        # Now go to each position in "map_coords" and take a snapshot
-        for i in range(len(map_coords)):
+        # Now go to each position in "tile_plan" and take a snapshot
+        for i in range(len(tile_plan)):
             if self.switches.get('isotope_mapping') or self.number_of_images > 1:
                 self.gui_communication['series_running'] = True
                 self.document_controller.queue_task(lambda: self.update_button('abort_button', 'Abort series'))
-            frame_coord = map_coords[i]
-            frame_info = map_infos[i]
+            tile = tile_plan[i]
+            frame_coord = (float(tile['x']), float(tile['y']), float(tile['x_corrected']), float(tile['y_corrected']))
+            frame_info = tile_plan.info(i)
             if self.event is not None and self.event.is_set():
                 break
             counter += 1
             stagex, stagey, stagex_corrected, stagey_corrected = frame_coord
-            stagez, fine_focus = self.interpolation_rbf((stagex, stagey))
-            self.Tuner.logwrite(str(counter) + '/' + str(len(map_coords)) + ': (No. ' +
-                         str(frame_info['number']) + ') x: ' +str((stagex_corrected)) + ', y: ' +
-                         str((stagey_corrected)) + ', z: ' + str((stagez)) + ', focus: ' + str((fine_focus)))
-            logfile.write(str(counter) + '/' + str(len(map_coords)) + ': (No. ' +
-                         str(frame_info['number']) + ') x: ' +str((stagex_corrected)) + ', y: ' +
-                         str((stagey_corrected)) + ', z: ' + str((stagez)) + ', focus: ' + str((fine_focus)) + ':\n')
+            self.update_focus_map(start=i, method='rbf')
+            stagez, fine_focus = float(tile_plan.tiles['z'][i]), float(tile_plan.tiles['focus'][i])
+            message = '{:.0f}/{:.0f} (No. {:.0f}): x: {:g}, y: {:g}, z: {:g}, focus: {:g}'.format(
+                      counter, len(tile_plan), frame_info['number'], stagex_corrected, stagey_corrected, stagez,
+                      fine_focus)
+            self.Tuner.logwrite(message)
+            logfile.write(message + '\n')
+            number = frame_info['number']
+            tile_log.update(number, index=frame_info['index'], counter=counter, x=stagex, y=stagey,
+                            x_corrected=stagex_corrected, y_corrected=stagey_corrected, z=stagez, focus=fine_focus)
             # only do hardware operations when online
             if self.online:
                 if self.switches.get('blank_beam'):
@@ -937,10 +1019,14 @@ class Mapping(object):
                 self.as2.set_property_as_float('EHTFocus', fine_focus)
 
                 # Wait until movement of stage is done (wait longer time before first frame)
-                if counter == 1:
-                    time.sleep(10) # time in seconds
+                if previous_position is None:
+                    time.sleep(settle_loop.first_wait_time) # time in seconds
                 else:
-                    time.sleep(self.sleeptime)
+                    move = (stagex_corrected - previous_position[0], stagey_corrected - previous_position[1])
+                    reversal = bool(np.any(np.sign(move) * np.sign(previous_move) < 0))
+                    time.sleep(settle_loop.settle_time(move, reversal=reversal))
+                    previous_move = move
+                previous_position = (stagex_corrected, stagey_corrected)
 
                 name = str('%.4d_%.3f_%.3f.tif' % (frame_info['number'], stagex_corrected*1e6,
                                                    stagey_corrected*1e6))
@@ -950,7 +1036,8 @@ class Mapping(object):
                     if self.switches.get('blank_beam'):
                         self.verified_unblank()
                     self.Tuner.image = self.Tuner.image_grabber(show_live_image=True)[0]
-                    tifffile.imsave(os.path.join(self.store, name), self.Tuner.image)
+                    writer.write(os.path.join(self.store, name), self.Tuner.image)
+                    tile_log.append(number, 'files', name)
                 else:
                     if self.switches.get('blank_beam'):
                         self.verified_unblank()
@@ -968,7 +1055,8 @@ class Mapping(object):
                                                         show_live_image=True)[0]
                         new_name = splitname[0] + ('_{:0'+str(len(str(self.number_of_images)))+'d}'
                                                    ).format(k) + splitname[1]
-                        tifffile.imsave(os.path.join(self.store, new_name), self.Tuner.image)
+                        writer.write(os.path.join(self.store, new_name), self.Tuner.image)
+                        tile_log.append(number, 'files', new_name)
 
                         if self.switches.get('show_last_frames_average') and not self.switches.get('isotope_mapping'):
                             self.add_to_last_images(self.Tuner.image.copy())
@@ -976,12 +1064,16 @@ class Mapping(object):
 
                         if self.switches.get('abort_series_on_dirt'):
                             dirt_mask = self.Tuner.dirt_detector()
-                            if np.sum(dirt_mask)/np.prod(dirt_mask.shape) > self.dirt_area:
-                                self.Tuner.logwrite('Series was aborted because of more than ' +
-                                             str(int(self.dirt_area*100)) + '% dirt coverage.')
+                            fraction = float(np.sum(dirt_mask)/np.prod(dirt_mask.shape))
+                            tile_log.append(number, 'dirt_fraction', fraction)
+                            if fraction > self.dirt_area:
+                                message = 'Series was aborted because of more than {:.0f}% dirt coverage.'.format(
+                                          self.dirt_area*100)
+                                self.Tuner.logwrite(message)
+                                tile_log.append(number, 'events', {'event': 'series_aborted', 'reason': message,
+                                                                   'time': time.time()})
                                 break
-                    self.last_frames_HAADF = []
-                    self.last_frames_MAADF = []
+                    self.reset_last_images()
 
                 if self.switches.get('blank_beam'):
                     self.as2.set_property_as_float('C_Blank', 1)
@@ -989,54 +1081,39 @@ class Mapping(object):
                 if self.switches.get('isotope_mapping'):
                     message = self.handle_isotope_mapping(frame_coord, frame_info, name)
                     logfile.write(message + '\n')
+                    tile_log.append(number, 'events', {'event': 'isotope_mapping', 'message': message.strip(),
+                                                       'time': time.time()})
 
                 if self.tune_now_event is not None and self.tune_now_event.is_set():
                     message = self.handle_retuning(frame_coord, frame_info)
                     logfile.write(message + '\n')
+                    tile_log.append(number, 'events', {'event': 'retuning', 'reason': 'requested',
+                                                       'message': message.strip(), 'time': time.time()})
                 elif self.switches.get('do_retuning'):
                     message = self.handle_retuning(frame_coord, frame_info)
                     logfile.write(message + '\n')
-
-            test_map.append(frame_coord + (stagez, fine_focus))
+                    tile_log.append(number, 'events', {'event': 'retuning', 'message': message.strip(),
+                                                       'time': time.time()})
+            # The record is written after the files of the tile, so that it never lists files that are not on disk yet
+            writer.call(tile_log.finish, number)
 
         if self.switches.get('blank_beam'):
             self.as2.set_property_as_float('C_Blank', 0)
 
+        writer.close()
+        tile_log.close()
+        try:
+            TileLog.write_text(tile_log.path)
+        except OSError as detail:
+            self.Tuner.logwrite('Could not write the text version of the tile log. Reason: ' + str(detail))
+
         #acquire overview image if desired
         if self.online and self.switches['acquire_overview']:
             self.acquire_overview()
 
         if self.event is None or not self.event.is_set():
-            x_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-            y_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-            x_corrected_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-            y_corrected_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-            z_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-            focus_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-            for j in range(self.num_subframes[1]):
-                for i in range(self.num_subframes[0]):
-                    if j%2 == 0: #Odd lines, e.g. map from left to right
-                        x_map[j,i] = test_map[i+j*self.num_subframes[0]][0]
-                        y_map[j,i] = test_map[i+j*self.num_subframes[0]][1]
-                        x_corrected_map[j,i] = test_map[i+j*self.num_subframes[0]][2]
-                        y_corrected_map[j,i] = test_map[i+j*self.num_subframes[0]][3]
-                        z_map[j,i] = test_map[i+j*self.num_subframes[0]][4]
-                        focus_map[j,i] = test_map[i+j*self.num_subframes[0]][5]
-                    else: #Even lines, e.g. scan from right to left
-                        x_map[j,(self.num_subframes[0]-(i+1))] = test_map[i+j*self.num_subframes[0]][0]
-                        y_map[j,(self.num_subframes[0]-(i+1))] = test_map[i+j*self.num_subframes[0]][1]
-                        x_corrected_map[j,(self.num_subframes[0]-(i+1))] = test_map[i+j*self.num_subframes[0]][2]
-                        y_corrected_map[j,(self.num_subframes[0]-(i+1))] = test_map[i+j*self.num_subframes[0]][3]
-                        z_map[j,(self.num_subframes[0]-(i+1))] = test_map[i+j*self.num_subframes[0]][4]
-                        focus_map[j,(self.num_subframes[0]-(i+1))] = test_map[i+j*self.num_subframes[0]][5]
-
-
-            tifffile.imsave(os.path.join(self.store, 'x_map.tif'), np.asarray(x_map, dtype='float32'))
-            tifffile.imsave(os.path.join(self.store, 'y_map.tif'), np.asarray(y_map, dtype='float32'))
-            tifffile.imsave(os.path.join(self.store, 'x_corrected_map.tif'), np.asarray(x_corrected_map, dtype='float32'))
-            tifffile.imsave(os.path.join(self.store, 'y_corrected_map.tif'), np.asarray(y_corrected_map, dtype='float32'))
-            tifffile.imsave(os.path.join(self.store, 'z_map.tif'), np.asarray(z_map, dtype='float32'))
-            tifffile.imsave(os.path.join(self.store, 'focus_map.tif'), np.asarray(focus_map, dtype='float32'))
+            self.tile_plan = tile_plan
+            self.save_mapped_coordinates(number_tiles=counter)
 
         logfile.write('\nDONE')
         logfile.close()
@@ -1124,6 +1201,15 @@ class Mapping(object):
         time.sleep(0.5)
         return (message, (self.gui_communication.pop('new_z'), self.gui_communication.pop('new_EHTFocus')))
 
+    def create_writer(self, **kwargs):
+        """
+        Returns a writer.FrameWriter with the settings of the map. "kwargs" are passed to FrameWriter.
+        """
+        if self.switches.get('compress_frames'):
+            kwargs.update({'codec': self.compression_codec, 'level': self.compression_level,
+                           'workers': self.compression_workers, 'convert_counts': True})
+        return FrameWriter(fsync=self.fsync_policy, **kwargs)
+
     def write_map_info_file(self):
         def translator(switch_state):
             if switch_state:
@@ -1139,6 +1225,9 @@ class Mapping(object):
                      'Z Drive': translator(self.switches.get('use_z_drive')),
                      'Acquire_Overview': translator(self.switches.get('acquire_overview')),
                      'Number of frames': str(self.num_subframes[0])+'x'+str(self.num_subframes[1]),
+                     'Number of positions': str(len(self.tile_plan)) if self.tile_plan is not None else '',
+                     'Traversal order': getattr(self.traversal_order, '__name__', str(self.traversal_order)),
+                     'Survey pass': translator(self.switches.get('survey_first')),
                      'Compensate stage error': translator(self.switches.get('compensate_stage_error'))}
         for key, value in map_paras.items():
             config_file.write('{0:18}{1:}\n'.format(key+':', value))
@@ -1161,9 +1250,15 @@ class AcquisitionLoop(object):
     with the data in the key "data". The acquisition function adds additional info to each image that is retrieved by
     calling "get_info_dict". If this function is used it must be callable and take no arguments. It must return a
     dictionary whose items will be added to the buffer item.
+    If a "timer" (timing.TimingRecorder) is given, the grab latency ("grab"), the time spent in pause ("pause") and the
+    number of images in the buffer after each put ("buffer_depth") are recorded.
+    If a "partial_monitor" (streaming.PartialFrameMonitor) is given, the frame that is being acquired is read with
+    "read_partial" every "partial_interval" seconds and passed to it. When it returns an event, the scan is aborted
+    immediately, the partial frame is discarded and "on_partial_abort" is called with the event.
     """
     def __init__(self, **kwargs):
         self.buffer = kwargs.get('buffer', Buffer(maxsize=200))
+        self.timer = kwargs.get('timer')
         self.superscan = kwargs.get('superscan')
         self.nion_frame_parameters = kwargs.get('nion_frame_parameters')
         self._n = -1
@@ -1176,6 +1271,11 @@ class AcquisitionLoop(object):
         self._single_acquisition_finished_event = threading.Event()
         self._t = None
         self.get_info_dict = kwargs.get('get_info_dict')
+        self.partial_monitor = kwargs.get('partial_monitor')
+        self.read_partial = kwargs.get('read_partial', lambda: read_partial_frame(self.superscan))
+        self.partial_interval = kwargs.get('partial_interval', 0.5)
+        self.on_partial_abort = kwargs.get('on_partial_abort')
+        self._aborted_mid_frame = False
 
     @property
     def is_acquiring(self):
@@ -1186,6 +1286,7 @@ class AcquisitionLoop(object):
             return
         self._pause_event.set()
         self._abort_event.clear()
+        self._aborted_mid_frame = False
         self._acquisition_finished_event.clear()
         if n > 0:
             self._n = n
@@ -1204,9 +1305,15 @@ class AcquisitionLoop(object):
             self.superscan.start_playing()
         self._pause_event.set()
 
-    def abort(self):
+    def abort(self, immediately=False):
+        """
+        Stops the acquisition after the current frame or, if "immediately" is True, in the middle of it.
+        """
         self._abort_event.set()
-        self.superscan.stop_playing()
+        if immediately:
+            self.superscan.abort_playing()
+        else:
+            self.superscan.stop_playing()
 
     def wait_for_acquisition(self, timeout=None):
         return self._acquisition_finished_event.wait(timeout=timeout)
@@ -1215,6 +1322,15 @@ class AcquisitionLoop(object):
         return self._single_acquisition_finished_event.wait(timeout=timeout)
 
     def _acquisition_thread(self):
+        try:
+            self._acquire()
+        finally:
+            # Nobody must wait forever for an acquisition that failed
+            self._single_acquisition_finished_event.set()
+            self._acquisition_finished_event.set()
+            self._n = -1
+
+    def _acquire(self):
         counter = 0
         self.superscan.set_frame_parameters(self.nion_frame_parameters)
         self.superscan.start_playing()
@@ -1227,7 +1343,27 @@ class AcquisitionLoop(object):
                 image['is_last'] = True
             if counter == 0:
                 image['is_first'] = True
-            image['data'] = self.superscan.grab_next_to_finish()
+            grab_starttime = time.perf_counter()
+            frame_done = None
+            if self.partial_monitor is not None and not self._abort_event.is_set():
+                frame_done = threading.Event()
+                threading.Thread(target=self._watch_partial_frame, args=(frame_done, counter == 0),
+                                 daemon=True).start()
+            try:
+                image['data'] = self.superscan.grab_next_to_finish()
+            except Exception as detail:
+                # Aborting the scan can make grab fail. Other failures only lose this frame, the acquisition goes on.
+                if not self._aborted_mid_frame:
+                    logging.error('Could not grab frame {:d}. Reason: {:s}'.format(counter, str(detail)))
+                    image['data'] = []
+            finally:
+                if frame_done is not None:
+                    frame_done.set()
+            if self._aborted_mid_frame:
+                self._single_acquisition_finished_event.set()
+                break
+            grab_time = time.perf_counter() - grab_starttime
+            image['timestamp'] = time.time()
             try:
                 if callable(self.get_info_dict):
                     info_dict = self.get_info_dict()
@@ -1237,6 +1373,10 @@ class AcquisitionLoop(object):
             else:
                 if len(image['data']) > 0:
                     self.buffer.put(image, timeout=self.buffer_timeout)
+            tile = image.get('tile', {}).get('number')
+            if self.timer is not None:
+                self.timer.record('grab', grab_time, tile=tile)
+                self.timer.record('buffer_depth', self.buffer.qsize())
             self._single_acquisition_finished_event.set()
 #            if not self._pause_event.is_set() or self._abort_event.is_set():
 #                self._acquisition_finished_event.set()
@@ -1246,15 +1386,30 @@ class AcquisitionLoop(object):
             if not self._pause_event.is_set():
                 print('Pausing acquisition loop')
                 pausing = True
+                pause_starttime = time.perf_counter()
             self._pause_event.wait(timeout=self._pause_timeout)
             if pausing:
                 print('Unpaused acquisition loop')
+                if self.timer is not None:
+                    self.timer.record('pause', time.perf_counter() - pause_starttime, tile=tile)
             counter += 1
         self.superscan.abort_playing()
         if (np.array(self.nion_frame_parameters['size']) > 2048).any():
             time.sleep(2)
-        self._acquisition_finished_event.set()
-        self._n = -1
+
+    def _watch_partial_frame(self, frame_done, is_first):
+        self.partial_monitor.reset(is_first=is_first, started_at=time.time())
+        while not frame_done.wait(timeout=self.partial_interval):
+            partial = self.read_partial()
+            if partial is None:
+                continue
+            event = self.partial_monitor.update(*partial)
+            if event is not None and not frame_done.is_set():
+                self._aborted_mid_frame = True
+                self.abort(immediately=True)
+                if callable(self.on_partial_abort):
+                    self.on_partial_abort(event)
+                break
 
     def close(self):
         self.abort()
@@ -1271,6 +1426,12 @@ class Buffer(queue.Queue):
         self.task_done()
         return obj
 
+    def release(self, slot):
+        """
+        Counterpart of FrameBuffer.release. Items in this buffer do not need to be released.
+        """
+        pass
+
 class ProcessingLoop(object):
     """
     This class will process data from a buffer and notify the main thread about important events found during processing.
@@ -1278,16 +1439,34 @@ class ProcessingLoop(object):
     which must be a valid function that can be run by this code. Further entries in a "task" dictionary are:
     args: tuple/list, positional arguments passed to the respective funtion
     kwargs: dictionary, keyword arguments passed to the respective function
+    depends_on: list, names of the tasks (names of their functions) that have to be finished before this task starts
+    backend: str, "process" runs the task in "process_backend" (see offload.ProcessBackend) if one is given. These tasks
+             get the first channel of an image as array and only their own "args" and "kwargs", not the info dictionary
+             of the image. The function has to be importable by the worker processes.
+    The tasks for one image run as a small task graph on a pool of "max_workers" threads: Every task starts as soon as
+    all tasks it depends on are finished (dependencies on tasks that are not in the list or skipped for an image are
+    ignored). Images are still processed one after the other, so tasks can rely on the order of the images.
+    For every task that returns something else than None, "on_found_something" is called with the name of the task,
+    its result and the info dictionary of the image and an events.TaskFinished event is published on "event_bus" (if
+    one is given). Both happen in the processing thread as soon as the task is finished.
+    A task that raises an exception is logged and counts as finished with the result None, so the other tasks still
+    run. After all tasks ran on an image, its slot is released in the buffer (see FrameBuffer.release).
+    If a "timer" (timing.TimingRecorder) is given, the run time of every task is recorded with the name of the task.
     """
 
     def __init__(self, buffer, **kwargs):
         self.buffer = buffer
         self.tasks = kwargs.get('tasks', [])
+        self.max_workers = kwargs.get('max_workers', 4)
+        self.process_backend = kwargs.get('process_backend')
+        self.timer = kwargs.get('timer')
+        self.event_bus = kwargs.get('event_bus')
         self.buffer_timeout = None
         self._pause_timeout = None
         self._pause_event = threading.Event()
         self._abort_event = threading.Event()
         self._t = None
+        self._executor = None
         self.on_found_something = None
 
     def start(self):
@@ -1295,6 +1474,8 @@ class ProcessingLoop(object):
             return
         self._pause_event.set()
         self._abort_event.clear()
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=max(self.max_workers, 1))
         self._t = threading.Thread(target=self._processing_thread, daemon=True)
         self._t.start()
 
@@ -1311,76 +1492,194 @@ class ProcessingLoop(object):
         while not self._abort_event.is_set():
             image = self.buffer.get(timeout=self.buffer_timeout)
             data = image.pop('data')
+            slot = image.pop('slot', None)
             skip_tasks = image.pop('skip_tasks', list())
-            for task in self.tasks:
-                if task in skip_tasks:
-                    continue
-                function = task['function']
-                args = task.get('args', tuple())
-                kwargs = task.get('kwargs', dict())
-                kwargs.update(image)
-                res = function(data, *args, **kwargs)
-                if res is not None and callable(self.on_found_something):
-                    self.on_found_something(function.__name__, res)
+            try:
+                self._run_tasks([task for task in self.tasks if task not in skip_tasks], data, image)
+            except Exception as detail:
+                logging.error('Could not process image {:s}. Reason: {:s}'.format(str(image.get('name')),
+                                                                                   str(detail)))
+            finally:
+                self.buffer.release(slot)
             self._pause_event.wait(timeout=self._pause_timeout)
 
+    def _run_tasks(self, tasks, data, image):
+        names = set(task['function'].__name__ for task in tasks)
+        tile = image.get('tile', {}).get('number')
+        finished = set()
+        waiting = list(tasks)
+        running = {}
+        try:
+            while waiting or running:
+                for task in list(waiting):
+                    if all(name in finished or name not in names for name in task.get('depends_on', list())):
+                        waiting.remove(task)
+                        kwargs = dict(task.get('kwargs', dict()))
+                        function = task['function']
+                        if task.get('backend') == 'process' and self.process_backend is not None:
+                            starttime = time.perf_counter()
+                            future = self.process_backend.submit(function, data[0], *task.get('args', tuple()),
+                                                                 **kwargs)
+                            if self.timer is not None:
+                                future.add_done_callback(lambda future, name=function.__name__, starttime=starttime:
+                                                         self.timer.record(name, time.perf_counter() - starttime,
+                                                                           tile=tile))
+                        else:
+                            kwargs.update(image)
+                            if self.timer is not None:
+                                function = self.timer.timed(function, tile=tile)
+                            future = self._executor.submit(function, data, *task.get('args', tuple()), **kwargs)
+                        running[future] = task
+                if not running:
+                    raise RuntimeError('The dependencies of the tasks {:s} cannot be resolved.'.format(
+                                       str([task['function'].__name__ for task in waiting])))
+                done, not_done = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)['function'].__name__
+                    finished.add(name)
+                    try:
+                        res = future.result()
+                    except Exception as detail:
+                        logging.error('Task {:s} failed for image {:s}. Reason: {:s}'.format(
+                                      name, str(image.get('name')), str(detail)))
+                        continue
+                    if res is not None and self.event_bus is not None:
+                        self.event_bus.publish(TaskFinished(image, task=name, result=res))
+                    if res is not None and callable(self.on_found_something):
+                        self.on_found_something(name, res, image)
+        finally:
+            # The tasks read the frames in the slot of the image, so it must not be released while any of them runs
+            wait(running)
+
     def close(self):
         self.buffer.join()
         self.abort()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        if self.process_backend is not None:
+            self.process_backend.shutdown(wait=False)
 
 class MappingLoop(object):
     """
-    This class will iterate over a coordinate list and move the stage to each position. It also takes care of focus
+    This class will iterate over a TilePlan and move the stage to each position. It also takes care of focus
     interpolation. After the "start" method is called it will move to the first position and block until the stabilize
     timeout is over. For each of the following elements its "next" method has to be called, which also blocks until the
     stabilize timeout for each position is over.
-    The attribute "coordinate_info" can be set to a list of the same length as "coordinate_list". If it is given,
-    "start" and "next" will return the corresponding info to each coordinate.
+    "start" and "next" return the coordinates of a tile together with its info dictionary (see TilePlan.info).
+    If "focus_map" is given, it is called with the index of the next tile and "skip" before each move and has to write
+    z and focus of all remaining tiles into the tile plan (see Mapping.update_focus_map). Otherwise "interpolation" is
+    called for each tile separately and the interpolated values are written back into the tile plan.
+    If a "settle_model" is given, the wait time after each move (except the first one) is predicted from the move
+    distance and direction instead of using the fixed "wait_time". The info dictionary then also contains the move
+    ("move", "reversal") and the time when the stage arrived ("moved_at"), which is needed for calibrating the model.
+    "skip" is an optional boolean array (in traversal order) of tiles that are not visited, e.g. because they were
+    already finished before a map was resumed. The counter in the returned coordinates is the number of tiles visited
+    so far (skipped tiles are not counted), "number_to_visit" the number of tiles that are not skipped and "visited"
+    a boolean array of the tiles that were visited.
+    If a "timer" (timing.TimingRecorder) is given, the time for updating the focus map ("focus_map"), for moving the
+    stage ("move") and for waiting until it settled ("settle") is recorded for each tile.
     """
 
-    def __init__(self, coordinate_list, **kwargs):
-        self._coordinate_list = coordinate_list
+    def __init__(self, tile_plan, **kwargs):
+        self.tile_plan = tile_plan
         self.as2 = kwargs.get('as2')
         self.switches = kwargs.get('switches', dict())
         self.interpolation = kwargs.get('interpolation')
-        self.coordinate_info = kwargs.get('coordinate_info')
+        self.focus_map = kwargs.get('focus_map')
         self.first_wait_time = kwargs.get('first_wait_time', 10)
         self.wait_time = kwargs.get('wait_time', 2)
+        self.settle_model = kwargs.get('settle_model')
+        self.skip = kwargs.get('skip')
+        self.timer = kwargs.get('timer')
         self.counter = 0
+        self.number_visited = 0
         self._current_position = None
+        self._last_move = (0, 0)
 
     @property
     def current_position(self):
         return self._current_position
 
+    @property
+    def number_to_visit(self):
+        return len(self.tile_plan) - (np.count_nonzero(self.skip) if self.skip is not None else 0)
+
+    @property
+    def visited(self):
+        visited = np.arange(len(self.tile_plan)) < self.counter
+        if self.skip is not None:
+            visited &= ~np.asarray(self.skip, dtype=bool)
+        return visited
+
     def start(self):
-        self._coordinate_iterator = iter(self._coordinate_list)
-        self._coordinate_info_iterator = iter(self.coordinate_info) if self.coordinate_info is not None else None
+        self.counter = 0
+        self.number_visited = 0
+        self._current_position = None
+        self._last_move = (0, 0)
         return self._next(self.first_wait_time)
 
     def next(self):
-        return self._next(self.wait_time)
-
-    def _next(self, wait_time):
+        return self._next()
+
+    def settle_time(self, move, reversal=False):
+        if self.settle_model is not None:
+            return float(self.settle_model.predict([move], reversals=[reversal])[0])
+        return self.wait_time
+
+    def _next(self, wait_time=None):
+        if self.skip is not None:
+            while self.counter < len(self.tile_plan) and self.skip[self.counter]:
+                self.counter += 1
+        if self.counter >= len(self.tile_plan):
+            raise StopIteration
+        index = self.counter
         self.counter += 1
-        self._current_position = next(self._coordinate_iterator)
+        self.number_visited += 1
+        tile = self.tile_plan[index]
+        previous_position = self._current_position
+        self._current_position = (float(tile['x']), float(tile['y']), float(tile['x_corrected']),
+                                  float(tile['y_corrected']))
         stagex, stagey, stagex_corrected, stagey_corrected = self.current_position
-        stagez, fine_focus = self.interpolation((stagex, stagey))
-        #self.as2.set_property_as_float('StageOutX', stagex_corrected)
+        if previous_position is not None:
+            move = (stagex_corrected - previous_position[2], stagey_corrected - previous_position[3])
+        else:
+            move = (0, 0)
+        reversal = bool(np.any(np.sign(move) * np.sign(self._last_move) < 0))
+        self._last_move = move
+        if wait_time is None:
+            wait_time = self.settle_time(move, reversal=reversal)
+        number = int(tile['number'])
+        starttime = time.perf_counter()
+        if callable(self.focus_map):
+            self.focus_map(index, self.skip)
+            stagez = float(self.tile_plan.tiles['z'][index])
+            fine_focus = float(self.tile_plan.tiles['focus'][index])
+        else:
+            stagez, fine_focus = self.interpolation((stagex, stagey))
+            self.tile_plan.tiles['z'][index] = stagez
+            self.tile_plan.tiles['focus'][index] = fine_focus
+        if self.timer is not None:
+            self.timer.record('focus_map', time.perf_counter() - starttime, tile=number)
+            starttime = time.perf_counter()
         try:
             self.as2.set_control_output('StageOutX', stagex_corrected, options={'confirm': True})
             self.as2.set_control_output('StageOutY', stagey_corrected, options={'confirm': True})
-            #self.as2.set_property_as_float('StageOutY', stagey_corrected)
             if self.switches.get('use_z_drive'):
                 self.as2.set_control_output('StageOutZ', stagez, options={'confirm': True})
             self.as2.set_control_output('EHTFocus', fine_focus, options={'confirm': True})
         except TimeoutError:
             pass
+        moved_at = time.time()
+        if self.timer is not None:
+            self.timer.record('move', time.perf_counter() - starttime, tile=number)
         time.sleep(wait_time)
-        return_value = (stagex, stagey, stagex_corrected, stagey_corrected, stagez, fine_focus, self.counter)
-        if self._coordinate_info_iterator is not None:
-            return_value += (next(self._coordinate_info_iterator), )
-        return return_value
+        if self.timer is not None:
+            self.timer.record('settle', wait_time, tile=number)
+        info = self.tile_plan.info(index)
+        if self.settle_model is not None:
+            info.update({'move': move, 'reversal': reversal, 'moved_at': moved_at})
+        return (stagex, stagey, stagex_corrected, stagey_corrected, stagez, fine_focus, self.number_visited, info)
 
 class SuperScanMapper(Mapping):
     """
@@ -1400,60 +1699,206 @@ class SuperScanMapper(Mapping):
         self._t = None
         self.tasks = []
         self.on_low_level_event_occured = None
-
-    def start(self):
+        self.journal = None
+        self._journal_pending = None
+        self._journal_lock = threading.Lock()
+        # Structured log with one record per tile (see tilelog.TileLog) and the tile whose record "log_tile" fills
+        self.tile_log = None
+        self._tile_log_current = None
+        # Log messages that still have to be shown in Nion Swift (see "write_log")
+        self._log_messages = []
+        self._log_lock = threading.Lock()
+        # Held while the stage moves, so that retuning cannot happen in the middle of a move
+        self._stage_lock = threading.Lock()
+        self._acquiring_tile = None
+        self._resumed = False
+        # Tiles that were finished before a map was resumed
+        self._finished = None
+        # Upper limit for the memory used by the frame buffer (bytes). Frames that do not fit are spilled to disk.
+        self.buffer_memory = kwargs.get('buffer_memory', 2*1024**3)
+        # Keyword arguments of the tasks that run in worker processes (see "start"). The dirt threshold found by the
+        # first of them is put in here for all following ones.
+        self._offload_kwargs = {}
+        # Records how long the different stages of the map take (see timing.TimingRecorder). It is written to the map
+        # folder at the end of the map.
+        self.timer = None
+        self.writer = None
+        self.series_saver = None
+        self.mosaic = None
+        # Results of the processing tasks are published on this events.EventBus (see "subscribe_events")
+        self.event_bus = None
+
+    def start(self, resume=False):
+        """
+        Starts a new map. If "resume" is True, the map in "foldername" is continued instead (see "resume").
+        """
         if self._t is not None and self._t.is_alive():
             return
         self._abort_event.clear()
         self._pause_event.set()
-        self.foldername = 'map_' + time.strftime('%Y_%m_%d_%H_%M')
-        self.save_mapping_config()
+        if not resume:
+            self.foldername = 'map_' + time.strftime('%Y_%m_%d_%H_%M')
+            self.save_mapping_config()
         if callable(self.on_low_level_event_occured):
             self.on_low_level_event_occured('map_started')
         self.Tuner = Tuning(frame_parameters=self.frame_parameters.copy(), detectors=self.detectors, event=self.event,
                             online=self.online, document_controller=self.document_controller, as2=self.as2,
-                            superscan=self.superscan)
+                            superscan=self.superscan, display=self.get_display())
         if hasattr(self, '_dirt_threshold'):
             self.Tuner.dirt_threshold = self._dirt_threshold
             delattr(self, '_dirt_threshold')
         self.create_nion_frame_parameters()
+        if hasattr(self, '_last_drift_frame'):
+            delattr(self, '_last_drift_frame')
         # Sort coordinates in case they were not in the right order
         self.coord_dict = self.sort_quadrangle()
-        self.map_coords, self.map_infos = self.create_map_coordinates(compensate_stage_error=
-                                                            self.switches['compensate_stage_error'])
-        self.mapping_loop = MappingLoop(self.map_coords, coordinate_info=self.map_infos, as2=self.as2,
-                                        switches=self.switches, interpolation = self.interpolation_spline,
-                                        wait_time=self.sleeptime)
-        self.buffer = Buffer(maxsize=200)
-        self.processing_loop = ProcessingLoop(self.buffer)
         # create output folder:
         self.store = os.path.join(self.savepath, self.foldername)
         if not os.path.exists(self.store):
             os.makedirs(self.store)
-        self.logfile = open(os.path.join(self.store, 'log.txt'), mode='w')
+        self.tile_plan = self.create_map_coordinates(compensate_stage_error=self.switches['compensate_stage_error'])
+        plan_path = os.path.join(self.store, 'tile_plan.npz')
+        self.journal = TileJournal(os.path.join(self.store, TileJournal.filename))
+        self._journal_pending = None
+        self.tile_log = TileLog(os.path.join(self.store, TileLog.filename))
+        self._tile_log_current = None
+        finished = None
+        if resume and os.path.isfile(plan_path):
+            # Use the stored plan because the map area might depend on things that are not in the config file
+            self.tile_plan = TilePlan.load(plan_path)
+        self._resumed = resume
+        if resume:
+            finished = self.read_journal()
+        else:
+            self.tile_plan.save(plan_path)
+        self._finished = finished
+        self.journal.open(mode='a' if resume else 'w')
+        self.tile_log.open(mode='a' if resume else 'w')
+        self.update_focus_map(keep=finished)
+        self.timer = TimingRecorder()
+        self.mapping_loop = MappingLoop(self.tile_plan, as2=self.as2, switches=self.switches,
+                                        focus_map=self.update_focus_map, wait_time=self.sleeptime,
+                                        first_wait_time=self.first_wait_time, settle_model=self.get_settle_model(),
+                                        skip=finished, timer=self.timer)
+        # With the switch "offload_processing", dirt detection and intensity comparison run in worker processes that
+        # read the frames directly from the shared memory of the frame buffer
+        offload_processing = self.switches.get('offload_processing') and offload.shared_memory_available()
+        self.buffer = FrameBuffer.from_frame_parameters(self.nion_frame_parameters, self.detectors,
+                                                        max_memory=self.buffer_memory,
+                                                        spill_path=os.path.join(self.store, 'spill'),
+                                                        shared=offload_processing)
+        self.event_bus = EventBus()
+        self.subscribe_events()
+        self.processing_loop = ProcessingLoop(self.buffer, process_backend=offload.ProcessBackend()
+                                                                           if offload_processing else None,
+                                              timer=self.timer, event_bus=self.event_bus)
+        self._offload_kwargs = {'dirt_threshold': self.Tuner.dirt_threshold,
+                                'exclude_dirt': self.switches.get('exclude_contamination', False)}
+        self.logfile = open(os.path.join(self.store, 'log.txt'), mode='a' if resume else 'w')
+        # With the switch "series_container", all frames of a series are written into one multi-page TIFF per position
+        self.series_saver = SeriesSaver()
+        self.writer = self.create_writer(on_error=self.write_log, save_function=self.series_saver)
+        self.mosaic = None
+        if self.switches.get('live_mosaic'):
+            mosaic_path = os.path.join(self.store, 'mosaic')
+            if resume and MosaicStore.exists(mosaic_path):
+                self.mosaic = MosaicStore.open(mosaic_path)
+            else:
+                size = self.nion_frame_parameters['size']
+                self.mosaic = MosaicStore(mosaic_path, self.tile_plan.shape, size, spacing=1+self.offset,
+                                          binning=self.mosaic_binning,
+                                          pixel_size=float(self.frame_parameters['fov']*1e-9/size[0]*
+                                                           self.mosaic_binning))
 
-        self._mapped_coordinates = []
         self.write_map_info_file()
+        if finished is not None:
+            self.write_log('\nResuming map. {:.0f} of {:.0f} positions were already finished.'.format(
+                           np.count_nonzero(finished), len(self.tile_plan)))
+            if finished.all():
+                self.write_log('\nDONE')
+                if callable(self.on_low_level_event_occured):
+                    self.on_low_level_event_occured('map_finished')
+                self.close()
+                return
+        report = travel_report(self.tile_plan, first_wait_time=self.mapping_loop.first_wait_time,
+                               wait_time=self.mapping_loop.wait_time, settle_time=self.mapping_loop.settle_model)
+        self.write_log('Mapping {:.0f} positions. Total stage travel: {:.2f} um, longest move: {:.2f} um, predicted '
+                       'settle time: {:.0f} s.'.format(len(self.tile_plan), report['travel']*1e6,
+                                                       report['longest_move']*1e6, report['settle_time']))
+        if len(self.tile_plan) > 0:
+            self.write_log('Focus map: z from {:g} to {:g}, EHTFocus from {:g} to {:g}.'.format(
+                           np.nanmin(self.tile_plan.tiles['z']), np.nanmax(self.tile_plan.tiles['z']),
+                           np.nanmin(self.tile_plan.tiles['focus']), np.nanmax(self.tile_plan.tiles['focus'])))
+        # Tasks run concurrently unless they depend on each other (see ProcessingLoop)
         if self.switches.get('save_images', True):
             self.tasks.append({'function': self.save_image})
+        self.tasks.append({'function': self.journal_tile, 'depends_on': ['save_image']})
+        if self.mosaic is not None:
+            self.tasks.append({'function': self.add_to_mosaic})
         if self.switches.get('show_last_frames_average'):
             self.tasks.append({'function': self.add_to_last_images})
-            self.tasks.append({'function': self.show_average_of_last_frames})
+            self.tasks.append({'function': self.show_average_of_last_frames, 'depends_on': ['add_to_last_images']})
         if self.switches.get('abort_series_on_dirt'):
-            self.tasks.append({'function': self.Tuner.dirt_detector})
+            if offload_processing:
+                self.tasks.append({'function': offload.dirt_fraction, 'backend': 'process',
+                                   'kwargs': self._offload_kwargs})
+            else:
+                self.tasks.append({'function': self.dirt_detector})
         if self.switches.get('abort_series_on_intensity_drop'):
-            self.tasks.append({'function': self.compare_intensity})
+            if offload_processing:
+                self.tasks.append({'function': offload.mean_intensity, 'backend': 'process',
+                                   'kwargs': self._offload_kwargs})
+            else:
+                self.tasks.append({'function': self.compare_intensity})
+        if self.mapping_loop.settle_model is not None and self.number_of_images > 1:
+            self.tasks.append({'function': self.measure_settle_drift})
 #        if self.switches.get('do_retuning'):
 #            self.tasks.append({'function': self.tuning_necessary})
-        self.tasks.append({'function': self.processing_finished})
         # Replace string names in self.tasks with actual functions
         self.setup_tasks()
+        # The tile log collects the results of all other tasks, so it has to run after them
+        self.tasks.append({'function': self.log_tile,
+                           'depends_on': [task['function'].__name__ for task in self.tasks]})
+        self.tasks.append({'function': self.processing_finished,
+                           'depends_on': [task['function'].__name__ for task in self.tasks]})
         self.processing_loop.tasks = self.tasks
-        self.processing_loop.on_found_something = self.processing_event_occured
         self.processing_loop.start()
         self._t = threading.Thread(target=self._mapping_thread)
         self._t.start()
 
+    def resume(self, path):
+        """
+        Continues a map that was interrupted (e.g. by a crash). "path" is the folder of the map (or the config file in
+        it). All parameters are loaded from the config file in this folder and all positions that are recorded as
+        finished in its tile journal are skipped. New images are saved into the same folder.
+        """
+        path = os.path.normpath(path)
+        if os.path.isfile(path):
+            path = os.path.dirname(path)
+        self.load_mapping_config(os.path.join(path, 'configs_map.txt'))
+        self.savepath, self.foldername = os.path.split(path)
+        self.start(resume=True)
+
+    def read_journal(self):
+        """
+        Reads the tile journal of the current map. Focus values of finished tiles are written into the tile plan and
+        sample points that were added by retuning are put back into coord_dict.
+        Returns a boolean array (in traversal order) that is True for all finished tiles.
+        """
+        finished = np.zeros(len(self.tile_plan), dtype=bool)
+        place = dict(zip(self.tile_plan.tiles['number'].tolist(), range(len(self.tile_plan))))
+        for entry in TileJournal.read(self.journal.path):
+            if entry.get('event') == 'new_point':
+                self.coord_dict[entry['key']] = tuple(entry['point'])
+                if hasattr(self, 'interpolator'):
+                    delattr(self, 'interpolator')
+            elif entry.get('number') in place:
+                index = place[entry['number']]
+                finished[index] = True
+                self.tile_plan.tiles['z'][index] = entry['z']
+                self.tile_plan.tiles['focus'][index] = entry['focus']
+        return finished
+
     @property
     def is_running(self):
         return self._t is not None and self._t.is_alive()
@@ -1491,111 +1936,298 @@ class SuperScanMapper(Mapping):
         self.acquisition_loop.abort()
 
     def _mapping_thread(self):
-        stagex, stagey, stagex_corrected, stagey_corrected, stagez, focus, counter, info_dict = self.mapping_loop.start()
-        self.write_log('{:.0f}/{:.0f} (No. {:.0f}): x: {:g}, y: {:g}, z: {:g}, focus: {:g}'.format(counter,
-                                                                                                   len(self.map_coords),
-                                                                                                   info_dict['number'],
-                                                                                                   stagex_corrected,
-                                                                                                   stagey_corrected,
-                                                                                                   float(stagez),
-                                                                                                   float(focus)))
-#        self.write_log('{:.0f}/{:.0f} (No. {:.0f}): x: {:f}, y: {:f}, z: {:f}, focus: {:f}'.format(counter,
-#                                                                                                   len(self.map_coords),
-#                                                                                                   info_dict['number'],
-#                                                                                                   stagex_corrected,
-#                                                                                                   stagey_corrected,
-#                                                                                                   stagez,
-#                                                                                                   focus))
-        basename = '{:04d}_{:g}_{:g}'.format(info_dict['number'], stagex_corrected, stagey_corrected)
-
+        # The mapping thread works as a pipeline: As soon as all images of a position are acquired, the stage moves on
+        # to the next position while the images are still being processed. Before the acquisition at the next position
+        # starts, it waits for the processing to finish (if the switch "wait_for_processing" is on), so that decisions
+        # from processing (series aborts, retuning) are enforced before the beam is on the next position.
+        if self.switches.get('survey_first'):
+            keep = self.read_survey() if self._resumed else None
+            if keep is None:
+                keep = self.survey(skip=self.mapping_loop.skip)
+            if self.mapping_loop.skip is not None:
+                self.mapping_loop.skip = self.mapping_loop.skip | ~keep
+            else:
+                self.mapping_loop.skip = ~keep
+        position = None
+        if not self._abort_event.is_set():
+            try:
+                with self._stage_lock:
+                    position = self.mapping_loop.start()
+            except StopIteration:
+                pass
+        if position is not None:
+            self.log_position(position)
         self.processing_loop.start()
-        while not self._abort_event.is_set():
-            self._mapped_coordinates.append((stagex, stagey, stagex_corrected, stagey_corrected, stagez, focus))
+        while position is not None and not self._abort_event.is_set():
+            self._pause_event.wait()
             if self.switches.get('do_retuning') and self.retuning_mode[0] == 'at_every_position':
                 self.handle_retuning()
-            if self.number_of_images < 2:
-                image_info = [{'name': basename}]
-            else:
-                num_len = str(len(str(self.number_of_images)))
-                image_info = [{'name': basename + ('_{:0' + num_len + 'd}').format(i)}
-                              for i in range(self.number_of_images)]
-            def get_info_dict():
-                return image_info.pop(0)
-            self.acquisition_loop = AcquisitionLoop(buffer=self.buffer, get_info_dict=get_info_dict,
-                                                    superscan=self.superscan,
-                                                    nion_frame_parameters=self.nion_frame_parameters)
-            self.acquisition_loop.start(n=self.number_of_images)
-            self.wait_for_message_or_finished()
+            self.acquire_position(position)
+            self.acquisition_loop.wait_for_acquisition()
             self._pause_event.wait()
-            try:
-                stagex, stagey, stagex_corrected, stagey_corrected, stagez, focus, counter, info_dict = self.mapping_loop.next()
-            except StopIteration:
+            next_position = None
+            if not self._abort_event.is_set():
+                try:
+                    with self._stage_lock:
+                        next_position = self.mapping_loop.next()
+                except StopIteration:
+                    pass
+            self.wait_for_processing()
+            if next_position is None:
                 break
-            self.write_log('{:.0f}/{:.0f} (No. {:.0f}): x: {:g}, y: {:g}, z: {:g}, focus: {:g}'.format(counter,
-                                                                                                   len(self.map_coords),
-                                                                                                   info_dict['number'],
-                                                                                                   stagex_corrected,
-                                                                                                   stagey_corrected,
-                                                                                                   float(stagez),
-                                                                                                   float(focus)))
-            basename = '{:04d}_{:g}_{:g}'.format(info_dict['number'], stagex_corrected, stagey_corrected)
+            position = next_position
+            self.log_position(position)
 
         if self.switches.get('acquire_overview'):
             self.acquire_overview()
+        surface = self.get_focus_surface()
+        retuned = np.array([key.startswith('new') for key in surface.keys], dtype=bool)
+        if retuned.any():
+            self.write_log('Focus surface: {:.0f} retuning points, {:.0f} rejected as outliers.'.format(
+                           np.count_nonzero(retuned), np.count_nonzero(retuned & ~surface.inliers)))
+        self.writer.call(self.series_saver.close)
+        if self.mosaic is not None:
+            self.writer.call(self.mosaic.flush)
+        self.writer.flush()
+        self.write_log('Frame writer: {written:.0f} frames ({bytes:.0f} bytes, {stored:.0f} bytes on disk, ratio '
+                       '{ratio:.2f}, {converted:.0f} as uint16) in {write_time:.1f} s ({throughput:.3g} B/s), '
+                       '{errors:.0f} errors, {coalesced:.0f} coalesced, longest queue: {high_water_mark:.0f}.'.format(
+                       **self.writer.report()))
+        self.write_log('Frame buffer: {slots:.0f} slots, high-water mark: {high_water_mark:.0f}, {frames:.0f} frames, '
+                       '{spilled:.0f} spilled to disk, {unpooled:.0f} not matching the slots.'.format(
+                       **self.buffer.report()))
+        if self.display is not None and self.display.report()['updates'] > 0:
+            self.write_log('Display: {updates:.0f} updates, {coalesced:.0f} coalesced.'.format(
+                           **self.display.report()))
         self.write_log('\nDONE')
-        self.save_mapped_coordinates()
+        # Tiles that were skipped (e.g. rejected by the survey) are not saved, finished tiles of a resumed map are
+        visited = self.mapping_loop.visited
+        if self._finished is not None:
+            visited |= self._finished
+        self.save_mapped_coordinates(visited=visited)
+        self.update_settle_model()
+        self.save_timing()
         if callable(self.on_low_level_event_occured):
             self.on_low_level_event_occured('map_finished')
         self.close()
 
 
     def write_log(self, message):
-        try:
-            self.Tuner.logwrite(message)
-        except Exception as e:
-            print('Could not print log message! Reason: ' + str(e))
         try:
             self.logfile.write(message + '\n')
         except Exception as e:
             print('Could not write log message to logfile! Reason: ' + str(e))
+        # Messages are shown in batches: Only one task is queued in the UI thread until it has shown the messages
+        with self._log_lock:
+            self._log_messages.append(message)
+            if len(self._log_messages) > 1:
+                return
+        try:
+            if self.document_controller is None:
+                self._show_log_messages()
+            else:
+                self.document_controller.queue_task(self._show_log_messages)
+        except Exception as e:
+            print('Could not print log message! Reason: ' + str(e))
+
+    def _show_log_messages(self):
+        with self._log_lock:
+            messages = self._log_messages
+            self._log_messages = []
+        if messages:
+            logging.info('\n'.join(messages))
+
+    def log_position(self, position):
+        stagex, stagey, stagex_corrected, stagey_corrected, stagez, focus, counter, info_dict = position
+        # Only the tiles that are actually visited are counted, not the skipped ones
+        self.write_log('{:.0f}/{:.0f} (No. {:.0f}): x: {:g}, y: {:g}, z: {:g}, focus: {:g}'.format(
+                       counter, self.mapping_loop.number_to_visit, info_dict['number'], stagex_corrected,
+                       stagey_corrected, float(stagez), float(focus)))
+
+    def acquire_position(self, position):
+        """
+        Starts the acquisition of all images at "position" (as returned by MappingLoop.next). Returns immediately.
+        """
+        stagex, stagey, stagex_corrected, stagey_corrected, stagez, focus, counter, info_dict = position
+        basename = '{:04d}_{:g}_{:g}'.format(info_dict['number'], stagex_corrected, stagey_corrected)
+        if self.number_of_images < 2:
+            image_info = [{'name': basename}]
+        elif self.switches.get('series_container'):
+            image_info = [{'name': basename, 'page': i} for i in range(self.number_of_images)]
+        else:
+            num_len = str(len(str(self.number_of_images)))
+            image_info = [{'name': basename + ('_{:0' + num_len + 'd}').format(i)}
+                          for i in range(self.number_of_images)]
+        tile_info = {'number': info_dict['number'], 'index': info_dict['index'], 'x': stagex, 'y': stagey,
+                     'x_corrected': stagex_corrected, 'y_corrected': stagey_corrected, 'z': float(stagez),
+                     'focus': float(focus)}
+        for entry in image_info:
+            entry['tile'] = tile_info
+        if self.tile_log is not None:
+            self.tile_log.update(info_dict['number'], **{key: value for key, value in tile_info.items()
+                                                         if key != 'number'})
+        if 'moved_at' in info_dict:
+            for entry in image_info:
+                entry.update({key: info_dict[key] for key in ['move', 'reversal', 'moved_at']})
+        def get_info_dict():
+            return image_info.pop(0)
+        self._acquiring_tile = info_dict['number']
+        self.acquisition_loop = AcquisitionLoop(buffer=self.buffer, get_info_dict=get_info_dict,
+                                                superscan=self.superscan,
+                                                nion_frame_parameters=self.nion_frame_parameters, timer=self.timer,
+                                                partial_monitor=self.create_partial_monitor(),
+                                                partial_interval=self.partial_frame_interval,
+                                                on_partial_abort=self.partial_frame_failed)
+        self.acquisition_loop.start(n=self.number_of_images)
+
+    def create_partial_monitor(self):
+        """
+        Returns a streaming.PartialFrameMonitor for the series abort checks that are switched on or None if partial
+        frames should not be checked.
+        """
+        if not self.switches.get('abort_on_partial_frames') or self.number_of_images < 2:
+            return None
+        kwargs = {}
+        if self.switches.get('abort_series_on_dirt'):
+            kwargs.update({'get_dirt_threshold': lambda: self.Tuner.dirt_threshold, 'dirt_area': self.dirt_area})
+        if self.switches.get('abort_series_on_intensity_drop'):
+            # The reference of the previous series must not be used for this one
+            kwargs.update({'get_intensity_reference': lambda: getattr(self, 'intensity_reference', None)
+                           if getattr(self, '_intensity_reference_tile', None) == self._acquiring_tile else None,
+                           'intensity_threshold': self.intensity_threshold_for_abort})
+        if not kwargs:
+            return None
+        return PartialFrameMonitor(**kwargs)
+
+    def partial_frame_failed(self, event):
+        """
+        Called by the acquisition loop when it aborted the series in the middle of a frame. The event is published on
+        self.event_bus like the results of the processing tasks.
+        """
+        event.tile = self._acquiring_tile
+        self.event_bus.publish(event)
 
-    def wait_for_message_or_finished(self):
-        print('waiting for acquisition')
+    def wait_for_processing(self):
+        """
+        Blocks until all images of the last position were processed (or its series was aborted) if the switch
+        "wait_for_processing" is on.
+        """
         if self.switches.get('wait_for_processing', False):
             self._processing_finished_event.wait()
             self._processing_finished_event.clear()
-        else:
-            self.acquisition_loop.wait_for_acquisition()
 
-    def processing_event_occured(self, taskname, obj):
+    def subscribe_events(self):
         """
-        Handles events from the processing loop.
-        taskname : (str) name of the task that fired that event
-        obj : (object) object that was returned by the task
+        Subscribes the reactions of the mapper to the events on self.event_bus. Aborting a series has the highest
+        priority, so that it happens before retuning, which can take long.
         """
+        self.event_bus.subscribe(TaskFinished, self.processing_event_occured, priority=100)
+        self.event_bus.subscribe(DirtCoverage, self.abort_series_on_dirt, priority=50)
+        self.event_bus.subscribe(IntensityChange, self.abort_series_on_intensity_change, priority=50)
+        self.event_bus.subscribe(SeriesProcessed, lambda event: self._processing_finished_event.set(), priority=10)
+        self.event_bus.subscribe(DirtCoverage, self.retune_on_dirt)
+        self.event_bus.subscribe(TuningNeeded, self.retune_on_request)
+
+    def processing_event_occured(self, event):
+        """
+        Translates the result of a processing task (events.TaskFinished) into the typed events the mapper reacts to
+        and publishes them on self.event_bus.
+        """
+        taskname, obj, info = event.task, event.result, event.info
         if taskname == 'processing_finished':
-            self._processing_finished_event.set()
+            self.event_bus.publish(SeriesProcessed(info))
         elif taskname == 'tuning_necessary':
             if obj[0]:
-                self.write_log('Starting retuning, reason: ' + obj[1])
-                self.handle_retuning()
-        elif taskname == 'dirt_detector':
-            if np.sum(obj) > np.prod(obj.shape)*self.dirt_area:
-                if self.switches.get('do_retuning') and self.retuning_mode[0] == 'on_dirt':
-                    self.handle_retuning()
-                if self.switches.get('abort_series_on_dirt'):
-                    self.acquisition_loop.abort()
-                    self._processing_finished_event.set()
-                    self.write_log('Aborted series because of too high dirt coverage.')
-        elif taskname == 'compare_intensity':
-            self.acquisition_loop.abort()
-            self._processing_finished_event.set()
-            if self.intensity_threshold_for_abort < 0:
-                self.write_log('Aborted series because the image intensity ({:g}) exceeded the threshold ({:g}).'.format(*obj))
+                self.event_bus.publish(TuningNeeded(info, reason=obj[1]))
+        elif taskname in ['dirt_detector', 'dirt_fraction']:
+            if taskname == 'dirt_fraction':
+                # Result of the worker process: (dirt fraction, dirt threshold)
+                self.share_dirt_threshold(obj[1])
+                fraction = obj[0]
             else:
-                self.write_log('Aborted series because the image intensity ({:g}) dropped below the threshold ({:g}).'.format(*obj))
+                fraction = np.sum(obj) / np.prod(obj.shape)
+            self.log_tile_value(event.tile, 'dirt_fraction', float(fraction))
+            if fraction > self.dirt_area:
+                self.event_bus.publish(DirtCoverage(info, fraction=fraction, limit=self.dirt_area))
+        elif taskname == 'mean_intensity':
+            # Result of the worker process: (mean intensity, dirt threshold)
+            self.share_dirt_threshold(obj[1])
+            self.log_tile_value(event.tile, 'intensity', float(obj[0]))
+            result = self.check_intensity(obj[0], is_first=info.get('is_first'),
+                                          tile=info.get('tile', {}).get('number'))
+            if result is not None:
+                self.event_bus.publish(IntensityChange(info, intensity=result[0], threshold=result[1]))
+        elif taskname == 'compare_intensity':
+            self.log_tile_value(event.tile, 'intensity', float(obj[0]))
+            self.event_bus.publish(IntensityChange(info, intensity=obj[0], threshold=obj[1]))
+
+    def _abort_series_for_event(self, event, message):
+        """
+        Aborts the series at the current position because of "event" and logs "message".
+        """
+        # Because the stage moves on while images are still processed, a series abort can arrive after the acquisition
+        # at the next position has started. It must not abort that series.
+        if event.tile is not None and event.tile != self._acquiring_tile:
+            return
+        self.acquisition_loop.abort()
+        self._processing_finished_event.set()
+        if getattr(event, 'partial', False):
+            message += ' after {:.0f} lines of the frame'.format(event.rows)
+        if event.latency is not None:
+            if self.timer is not None:
+                self.timer.record('abort_latency', event.latency, tile=event.tile)
+            message += ' ({:.0f} ms after the frame {:s})'.format(event.latency*1000, 'started' if
+                                                                   getattr(event, 'partial', False) else 'arrived')
+        self.log_tile_value(self._acquiring_tile, 'events', {'event': 'series_aborted', 'reason': message,
+                                                             'time': time.time()})
+        self.write_log(message + '.')
+
+    def abort_series_on_dirt(self, event):
+        if self.switches.get('abort_series_on_dirt'):
+            self._abort_series_for_event(event, 'Aborted series because of too high dirt coverage')
+
+    def abort_series_on_intensity_change(self, event):
+        if self.intensity_threshold_for_abort < 0:
+            message = 'Aborted series because the image intensity ({:g}) exceeded the threshold ({:g})'
+        else:
+            message = 'Aborted series because the image intensity ({:g}) dropped below the threshold ({:g})'
+        self._abort_series_for_event(event, message.format(event.intensity, event.threshold))
+
+    def retune_on_dirt(self, event):
+        if self.switches.get('do_retuning') and self.retuning_mode[0] == 'on_dirt':
+            self.log_tile_value(event.tile, 'events', {'event': 'retuning', 'reason': 'dirt', 'time': time.time()})
+            self.handle_retuning()
+
+    def retune_on_request(self, event):
+        self.write_log('Starting retuning, reason: ' + event.reason)
+        self.log_tile_value(event.tile, 'events', {'event': 'retuning', 'reason': event.reason, 'time': time.time()})
+        self.handle_retuning()
+
+    def log_tile_value(self, tile, key, value):
+        """
+        Appends "value" to the list "key" in the record of "tile" (a frame number) in the tile log.
+        """
+        if self.tile_log is not None and tile is not None:
+            self.tile_log.append(tile, key, value)
+
+    def share_dirt_threshold(self, dirt_threshold):
+        """
+        Stores a dirt threshold that was found in a worker process, so that it does not have to be found again.
+        """
+        if dirt_threshold is not None and self._offload_kwargs.get('dirt_threshold') is None:
+            self._offload_kwargs['dirt_threshold'] = dirt_threshold
+            if self.Tuner.dirt_threshold is None:
+                self.Tuner.dirt_threshold = dirt_threshold
 
     def handle_retuning(self, *args, **kwargs):
+        with self._stage_lock:
+            if self.timer is not None:
+                with self.timer.measure('retuning', tile=self._acquiring_tile):
+                    self._handle_retuning()
+            else:
+                self._handle_retuning()
+
+    def _handle_retuning(self):
         self.pause()
         if self.acquisition_loop is not None:
             self.acquisition_loop.pause()
@@ -1615,7 +2247,14 @@ class SuperScanMapper(Mapping):
 
         if focused is not None:
             new_z, newEHTFocus = focused
-            self.tuning_successful(True, self.mapping_loop.current_position[:2] + (new_z, newEHTFocus))
+            new_point = self.mapping_loop.current_position[:2] + (new_z, newEHTFocus)
+            key = self.tuning_successful(True, new_point)
+            if key is not None and self.journal is not None:
+                self.journal.write({'event': 'new_point', 'key': key, 'point': [float(value) for value in new_point]})
+            if key is not None:
+                residual, accepted = self.get_focus_surface().residual(key)
+                self.write_log('\tFocus surface residual: z: {:g}, EHTFocus: {:g}{:s}'.format(
+                               residual[0], residual[1], '' if accepted else ' (rejected as outlier)'))
             self.write_log('\tNew focus: ' + str(newEHTFocus))
         else:
             self.tuning_successful(False, None)
@@ -1647,44 +2286,95 @@ class SuperScanMapper(Mapping):
         return (self.as2.get_control_output('C10'), self.as2.get_control_output('EHTFocus'))
 
     def save_image(self, image, *args, **kwargs):
-        tifffile.imsave(os.path.join(self.store, kwargs.get('name') + '.tif'), image[0].data)
-
-    def save_mapped_coordinates(self):
-        x_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-        y_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-        x_corrected_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-        y_corrected_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-        z_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-        focus_map = np.zeros((self.num_subframes[1], self.num_subframes[0]))
-        exit_loop = False
-        for j in range(self.num_subframes[1]):
-            for i in range(self.num_subframes[0]):
-                if i+j*self.num_subframes[0] >= len(self._mapped_coordinates):
-                    exit_loop = True
-                    break
-                if j%2 == 0: #Odd lines, e.g. map from left to right
-                    x_map[j,i] = self._mapped_coordinates[i+j*self.num_subframes[0]][0]
-                    y_map[j,i] = self._mapped_coordinates[i+j*self.num_subframes[0]][1]
-                    x_corrected_map[j,i] = self._mapped_coordinates[i+j*self.num_subframes[0]][2]
-                    y_corrected_map[j,i] = self._mapped_coordinates[i+j*self.num_subframes[0]][3]
-                    z_map[j,i] = self._mapped_coordinates[i+j*self.num_subframes[0]][4]
-                    focus_map[j,i] = self._mapped_coordinates[i+j*self.num_subframes[0]][5]
-                else: #Even lines, e.g. scan from right to left
-                    x_map[j,(self.num_subframes[0]-(i+1))] = self._mapped_coordinates[i+j*self.num_subframes[0]][0]
-                    y_map[j,(self.num_subframes[0]-(i+1))] = self._mapped_coordinates[i+j*self.num_subframes[0]][1]
-                    x_corrected_map[j,(self.num_subframes[0]-(i+1))] = self._mapped_coordinates[i+j*self.num_subframes[0]][2]
-                    y_corrected_map[j,(self.num_subframes[0]-(i+1))] = self._mapped_coordinates[i+j*self.num_subframes[0]][3]
-                    z_map[j,(self.num_subframes[0]-(i+1))] = self._mapped_coordinates[i+j*self.num_subframes[0]][4]
-                    focus_map[j,(self.num_subframes[0]-(i+1))] = self._mapped_coordinates[i+j*self.num_subframes[0]][5]
-            if exit_loop:
-                break
+        # Only queues the frame, it is written by self.writer
+        path = os.path.join(self.store, kwargs.get('name') + '.tif')
+        if kwargs.get('page') is not None:
+            self.writer.write(path, image[0].data, page=kwargs['page'], is_last=bool(kwargs.get('is_last')))
+        else:
+            self.writer.write(path, image[0].data)
+
+    def add_to_mosaic(self, image, *args, **kwargs):
+        """
+        Puts the first frame of every position into the live mosaic. It is downsampled here, because the frame is
+        reused by the frame buffer, and written by self.writer.
+        """
+        if not kwargs.get('is_first') or kwargs.get('tile') is None:
+            return
+        self.writer.call(self.mosaic.add_tile, kwargs['tile']['number'], self.mosaic.downsample(image[0]), binned=True)
+
+    def journal_tile(self, image, *args, **kwargs):
+        """
+        Records finished tiles in the tile journal. A tile is finished when its last image was processed or, if its
+        series was aborted, when the first image of the next tile arrives. This task has to run after "save_image".
+        The entries are written by the frame writer after the images of the tile, so that the journal never lists files
+        that are not on disk yet.
+        """
+        tile = kwargs.get('tile')
+        if tile is None:
+            return
+        with self._journal_lock:
+            if self.journal is None:
+                return
+            if self._journal_pending is not None and self._journal_pending['number'] != tile['number']:
+                self.writer.call(self.journal.write, self._journal_pending)
+                self._journal_pending = None
+            if self._journal_pending is None:
+                self._journal_pending = dict(tile, files=[])
+            if self.switches.get('save_images', True) and kwargs.get('name') + '.tif' not in self._journal_pending['files']:
+                self._journal_pending['files'].append(kwargs.get('name') + '.tif')
+            if kwargs.get('is_last'):
+                self.writer.call(self.journal.write, self._journal_pending)
+                self._journal_pending = None
+
+    def log_tile(self, image, *args, **kwargs):
+        """
+        Adds the files of a tile to its record in the tile log and finishes the record when the tile is finished (like
+        in "journal_tile"). This task runs after all other tasks, so their results are in the record when it is
+        finished. Records are finished by the frame writer, so that they never list files that are not on disk yet.
+        """
+        tile = kwargs.get('tile')
+        if tile is None or self.tile_log is None:
+            return
+        number = tile['number']
+        if self._tile_log_current is not None and self._tile_log_current != number:
+            self.writer.call(self.finish_tile_log, self._tile_log_current)
+        self._tile_log_current = number
+        if self.switches.get('save_images', True):
+            self.tile_log.append(number, 'files', kwargs.get('name') + '.tif', unique=True)
+        if kwargs.get('is_last'):
+            self.writer.call(self.finish_tile_log, number)
+            self._tile_log_current = None
+
+    def finish_tile_log(self, number):
+        self.tile_log.finish(number, timing=self.timer.tile_record(number) if self.timer is not None else {})
 
-        tifffile.imsave(os.path.join(self.store, 'x_map.tif'), np.asarray(x_map, dtype='float32'))
-        tifffile.imsave(os.path.join(self.store, 'y_map.tif'), np.asarray(y_map, dtype='float32'))
-        tifffile.imsave(os.path.join(self.store, 'x_corrected_map.tif'), np.asarray(x_corrected_map, dtype='float32'))
-        tifffile.imsave(os.path.join(self.store, 'y_corrected_map.tif'), np.asarray(y_corrected_map, dtype='float32'))
-        tifffile.imsave(os.path.join(self.store, 'z_map.tif'), np.asarray(z_map, dtype='float32'))
-        tifffile.imsave(os.path.join(self.store, 'focus_map.tif'), np.asarray(focus_map, dtype='float32'))
+    def close_tile_log(self):
+        """
+        Writes the remaining records of the tile log and its human readable version (TileLog.text_filename).
+        """
+        if self.tile_log is None:
+            return
+        if self._tile_log_current is not None:
+            self.finish_tile_log(self._tile_log_current)
+            self._tile_log_current = None
+        self.tile_log.close()
+        try:
+            TileLog.write_text(self.tile_log.path)
+        except OSError as detail:
+            logging.error('Could not write the text version of the tile log. Reason: ' + str(detail))
+        self.tile_log = None
+
+    def close_journal(self):
+        if self.writer is not None:
+            self.writer.flush()
+        with self._journal_lock:
+            if self.journal is None:
+                return
+            if self._journal_pending is not None:
+                self.journal.write(self._journal_pending)
+                self._journal_pending = None
+            self.journal.close()
+            self.journal = None
 
     def processing_finished(self, *args, **kwargs):
         """
@@ -1708,24 +2398,222 @@ class SuperScanMapper(Mapping):
                     tasks.append(task)
         self.tasks = tasks
 
-    def create_nion_frame_parameters(self):
-        self.nion_frame_parameters = {}
-        self.nion_frame_parameters['size'] = tuple(self.frame_parameters['size_pixels'])
-        self.nion_frame_parameters['pixel_time_us'] = self.frame_parameters['pixeltime']
-        self.nion_frame_parameters['fov_nm'] = self.frame_parameters['fov']
-        self.nion_frame_parameters['rotation_rad'] = self.frame_parameters['rotation']/180*np.pi
-        self.nion_frame_parameters['flyback_time_us'] = 120
+    def create_nion_frame_parameters(self, frame_parameters=None):
+        """
+        Translates "frame_parameters" into the format SuperScan uses and returns the result. If no "frame_parameters"
+        are given, the ones of the map are used and the result is stored in "nion_frame_parameters".
+        """
+        nion_frame_parameters = {}
+        source = frame_parameters if frame_parameters is not None else self.frame_parameters
+        nion_frame_parameters['size'] = tuple(source['size_pixels'])
+        nion_frame_parameters['pixel_time_us'] = source['pixeltime']
+        nion_frame_parameters['fov_nm'] = source['fov']
+        nion_frame_parameters['rotation_rad'] = source['rotation']/180*np.pi
+        nion_frame_parameters['flyback_time_us'] = 120
+        if frame_parameters is None:
+            self.nion_frame_parameters = nion_frame_parameters
+        return nion_frame_parameters
+
+    def survey(self, skip=None):
+        """
+        First pass of a two-pass map: Acquires one image with "survey_frame_parameters" at every tile that is not in
+        "skip" and scores it with "score_survey_image". Scoring runs in the background while the stage moves on. If the
+        survey was not aborted, the results are written to "survey.txt" in the map folder.
+        Returns a boolean array (in traversal order) that is True for all tiles that should be acquired in the second
+        pass.
+        """
+        frame_parameters = self.frame_parameters.copy()
+        frame_parameters.update(self.survey_frame_parameters)
+        frame_parameters['fov'] = self.frame_parameters['fov']
+        nion_frame_parameters = self.create_nion_frame_parameters(frame_parameters)
+        survey_loop = MappingLoop(self.tile_plan, as2=self.as2, switches=self.switches, focus_map=self.update_focus_map,
+                                  wait_time=self.sleeptime, first_wait_time=self.first_wait_time,
+                                  settle_model=self.mapping_loop.settle_model, skip=skip)
+        buffer = Buffer()
+        scores = {}
+        self.write_log('Starting survey pass with frame parameters: ' + str(frame_parameters))
+        process_backend = self.processing_loop.process_backend
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            try:
+                with self._stage_lock:
+                    position = survey_loop.start()
+                while not self._abort_event.is_set():
+                    self._pause_event.wait()
+                    self.acquisition_loop = AcquisitionLoop(buffer=buffer, superscan=self.superscan,
+                                                            nion_frame_parameters=nion_frame_parameters)
+                    self.acquisition_loop.start(n=1)
+                    self.acquisition_loop.wait_for_acquisition()
+                    try:
+                        image = buffer.get(block=False)
+                    except queue.Empty:
+                        self.write_log('No survey image for No. {:.0f}.'.format(position[7]['number']))
+                    else:
+                        if process_backend is not None:
+                            scores[position[7]['index']] = process_backend.submit(offload.score_survey_image,
+                                                                                  image['data'][0],
+                                                                                  self.frame_parameters['fov'])
+                        else:
+                            scores[position[7]['index']] = executor.submit(self.score_survey_image,
+                                                                           image['data'][0].data)
+                        if self.mosaic is not None:
+                            # Survey images are replaced by the real tiles later
+                            self.writer.call(self.mosaic.add_tile, position[7]['number'],
+                                             self.mosaic.downsample(image['data'][0]), binned=True)
+                    with self._stage_lock:
+                        position = survey_loop.next()
+            except StopIteration:
+                pass
+            scores = {index: future.result() for index, future in scores.items()}
+
+        keep = np.zeros(len(self.tile_plan), dtype=bool)
+        for index, (graphene_fraction, number_peaks) in scores.items():
+            keep[index] = graphene_fraction >= self.survey_threshold and number_peaks >= self.survey_minimum_peaks
+        if not self._abort_event.is_set():
+            self.save_survey(scores, keep)
+        self.write_log('Survey finished. {:.0f} of {:.0f} positions will be acquired.'.format(np.count_nonzero(keep),
+                                                                                             len(scores)))
+        return keep
+
+    def score_survey_image(self, image):
+        """
+        Returns the fraction of clean graphene in "image" (from Imaging.dirt_detector) and the number of first-order
+        lattice reflections that can be found in its FFT (0 - 6).
+        """
+        return offload.score_survey_image(image, self.frame_parameters['fov'])
+
+    def save_survey(self, scores, keep):
+        with open(os.path.join(self.store, 'survey.txt'), 'w') as survey_file:
+            survey_file.write('# Survey results. Threshold for graphene fraction: {:g}, minimum number of peaks: '
+                              '{:.0f}\n'.format(self.survey_threshold, self.survey_minimum_peaks))
+            survey_file.write('# number\tindex\tx\ty\tgraphene_fraction\tnumber_peaks\tkeep\n')
+            for index, (graphene_fraction, number_peaks) in sorted(scores.items()):
+                tile = self.tile_plan[index]
+                survey_file.write('{:d}\t{:d}\t{:g}\t{:g}\t{:.4f}\t{:d}\t{:d}\n'.format(
+                                  int(tile['number']), int(index), tile['x'], tile['y'], graphene_fraction,
+                                  number_peaks, int(keep[index])))
+
+    def read_survey(self):
+        """
+        Reads the decisions from "survey.txt" in the map folder (e.g. when a map is resumed). Returns a boolean array
+        (in traversal order) that is True for all tiles that should be acquired or None if there is no survey.
+        """
+        path = os.path.join(self.store, 'survey.txt')
+        if not os.path.isfile(path):
+            return None
+        place = dict(zip(self.tile_plan.tiles['number'].tolist(), range(len(self.tile_plan))))
+        keep = np.zeros(len(self.tile_plan), dtype=bool)
+        with open(path) as survey_file:
+            for line in survey_file:
+                if line.startswith('#') or not line.strip():
+                    continue
+                values = line.split()
+                if int(values[0]) in place:
+                    keep[place[int(values[0])]] = bool(int(values[-1]))
+        return keep
+
+    def measure_settle_drift(self, image, *args, **kwargs):
+        """
+        Measures the drift between consecutive frames at one position and adds it as sample to the settle model.
+        """
+        data = image[0].data
+        timestamp = kwargs.get('timestamp')
+        if kwargs.get('is_first') or not hasattr(self, '_last_drift_frame'):
+            self._last_drift_frame = (data.copy(), timestamp)
+            return
+        last_data, last_timestamp = self._last_drift_frame
+        self._last_drift_frame = (data.copy(), timestamp)
+        if timestamp is None or last_timestamp is None or kwargs.get('moved_at') is None:
+            return
+        pixelsize = self.frame_parameters['fov'] / self.frame_parameters['size_pixels'][1]
+        frame_time = (np.prod(self.frame_parameters['size_pixels']) * np.mean(self.frame_parameters['pixeltime']) *
+                      1e-6)
+        try:
+            speed = measure_drift(last_data, data, pixelsize, timestamp - last_timestamp)
+        except RuntimeError:
+            return
+        time_since_move = (timestamp + last_timestamp) / 2 - frame_time / 2 - kwargs['moved_at']
+        self.mapping_loop.settle_model.add_sample(kwargs['move'], kwargs['reversal'], time_since_move, speed)
+
+    def save_timing(self):
+        """
+        Writes the timing records of this map and their summary to the map folder and the most important numbers to the
+        log. Maps that were resumed get a separate file for every run.
+        """
+        if self.timer is None:
+            return
+        self.timer.finish()
+        frame_time = (np.prod(self.frame_parameters['size_pixels']) * np.mean(self.frame_parameters['pixeltime']) *
+                      1e-6)
+        filename = TimingRecorder.filename
+        if self._resumed:
+            filename = 'timing_resume_' + time.strftime('%Y_%m_%d_%H_%M') + '.json'
+        try:
+            self.timer.save(os.path.join(self.store, filename), dwell_time=frame_time)
+        except OSError as detail:
+            self.write_log('Could not save timing. Reason: ' + str(detail))
+        summary = self.timer.summary(dwell_time=frame_time)
+        stages = ', '.join('{:s}: {:.1f} s'.format(stage, values['total']) for stage, values in
+                           summary['stages'].items() if stage != 'buffer_depth')
+        self.write_log('Timing: wall time {:.0f} s, dwell time {:.0f} s ({:.0%} overhead). {:s}.'.format(
+                       summary['wall_time'], summary['dwell_time'], summary['overhead_fraction'] or 0, stages))
+
+    def update_settle_model(self):
+        """
+        Refits the settle model with the drift measured during this map and stores it for the instrument.
+        """
+        settle_model = self.mapping_loop.settle_model
+        if settle_model is None or not hasattr(self, '_last_drift_frame'):
+            return
+        if settle_model.fit():
+            self.write_log('Updated settle model: tau: {:.2f} s, coefficients: {:s}.'.format(
+                           settle_model.tau, str(np.round(settle_model.coefficients, 3).tolist())))
+        try:
+            settle_model.save(self.settle_model_path)
+        except OSError as detail:
+            self.write_log('Could not save settle model. Reason: ' + str(detail))
+
+    def dirt_detector(self, image, *args, **kwargs):
+        """
+        Processing task that returns the dirt mask of the first channel of "image".
+        """
+        return self.detect_dirt(image)
+
+    def detect_dirt(self, image):
+        """
+        Returns the dirt mask of "image" (see Imaging.dirt_detector). A separate Imaging instance is used for every call,
+        so that several processing tasks can do this at the same time. Only the dirt threshold is shared with the Tuner.
+        """
+        if isinstance(image, (list, tuple)):
+            image = image[0]
+        imager = Imaging(online=False)
+        imager.dirt_threshold = self.Tuner.dirt_threshold
+        mask = imager.dirt_detector(image=np.asarray(getattr(image, 'data', image)))
+        if self.Tuner.dirt_threshold is None:
+            self.Tuner.dirt_threshold = imager.dirt_threshold
+        return mask
 
     def compare_intensity(self, image, *args, **kwargs):
+        if isinstance(image, (list, tuple)):
+            image = image[0]
+        image = np.asarray(getattr(image, 'data', image))
         if self.switches.get('exclude_contamination'):
-            mask = self.Tuner.dirt_detector(image=image)
-            image = image.copy() #make a copy because we are changing it
+            mask = self.detect_dirt(image)
+            image = image.astype(np.float32) #make a copy because we are changing it
             image[mask==1] = np.nan
 
-        if kwargs.get('is_first'):
-            self.intensity_reference = np.nanmean(image)
+        return self.check_intensity(np.nanmean(image), is_first=kwargs.get('is_first'),
+                                    tile=kwargs.get('tile', {}).get('number'))
+
+    def check_intensity(self, intensity, is_first=False, tile=None):
+        """
+        Uses "intensity" as reference for the series if "is_first" is True, otherwise compares it to the reference.
+        Returns (intensity, threshold) if the series should be aborted and None otherwise.
+        "tile" is the frame number of the tile the reference belongs to.
+        """
+        if is_first:
+            self.intensity_reference = intensity
+            self._intensity_reference_tile = tile
         else:
-            intensity = np.nanmean(image)
             if self.intensity_threshold_for_abort < 0:
                 if intensity > (1-self.intensity_threshold_for_abort)*self.intensity_reference:
                     return (intensity, self.intensity_reference)
@@ -1736,9 +2624,19 @@ class SuperScanMapper(Mapping):
 
 
     def close(self):
-        self.logfile.close()
-        self.acquisition_loop.close()
+        if self.acquisition_loop is not None:
+            self.acquisition_loop.close()
         self.processing_loop.close()
+        self.buffer.close()
+        self.close_journal()
+        self.writer.call(self.series_saver.close)
+        if self.mosaic is not None:
+            self.writer.call(self.mosaic.close)
+        self.writer.close()
+        self.close_tile_log()
+        if self.display is not None:
+            self.display.close(timeout=5)
+        self.logfile.close()
 
 
 #def find_offset_and_rotation(as2, superscan):
@@ -1796,16 +2694,7 @@ def find_nearest_neighbors(number, target, points):
         The tuples are the same as in the imput with an additional entry at their first position
         which is the distance to target.
     """
-    nearest = []
-    for i in range(number):
-        nearest.append((np.inf,))
-
-    for point in points:
-        distance = np.sqrt((target[0]-point[0])**2 + (target[1]-point[1])**2)
-        if distance < nearest[0][0]:
-            nearest[0] = (distance,) + point
-            nearest.sort(reverse=True)
-
-    nearest.sort()
-
-    return nearest
\ No newline at end of file
+    if len(points) == 0:
+        return []
+    distances, indices = SampleIndex(np.array([point[:2] for point in points])).nearest([target[:2]], number)
+    return [(distance,) + tuple(points[index]) for distance, index in zip(distances[0], indices[0])]
@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 00:41:53 2026
+
+@author: mittelberger
+"""
+
+import json
+import os
+import threading
+import numpy as np
+
+
+class MosaicStore(object):
+    """
+    On-disk mosaic of a map that is filled while the map is acquired. The mosaic ("mosaic.npy") and a copy of every
+    (downsampled) tile ("tiles.npy") are numpy memmaps in the folder "path", so they can be opened with
+    np.load(..., mmap_mode='r') at any time, also while the map is still running.
+    Tiles are placed at their nominal grid position: The tile with frame number "number" (see tileplan.TilePlan) is in
+    row number // columns and column number % columns, neighbouring tiles are "spacing" tile sizes apart (1 + offset
+    of the map). Scan rotation is not taken into account. Positions found later (e.g. by find_positions.Positionfinder)
+    can be applied with "apply_positions", which re-places all tiles from "tiles.npy" without reading the raw files.
+    "binning" is the factor the tiles are downsampled with.
+    """
+
+    filename = 'mosaic.npy'
+    tiles_filename = 'tiles.npy'
+    info_filename = 'mosaic.json'
+
+    def __init__(self, path, grid_shape, tile_shape, spacing=1, binning=1, **kwargs):
+        self.path = path
+        self.grid_shape = tuple(int(value) for value in grid_shape)
+        self.tile_shape = tuple(int(value) for value in tile_shape)
+        self.spacing = float(spacing)
+        self.binning = max(int(binning), 1)
+        # Size of one pixel in the mosaic (m), only written to the info file
+        self.pixel_size = kwargs.get('pixel_size')
+        self.binned_shape = tuple(max(value // self.binning, 1) for value in self.tile_shape)
+        self._lock = threading.Lock()
+        number_tiles = self.grid_shape[0] * self.grid_shape[1]
+        # Top-left corners (y, x) of all tiles in mosaic pixels, indexed by frame number
+        self.positions = self.nominal_positions()
+        self.placed = np.zeros(number_tiles, dtype=bool)
+        if kwargs.get('create', True):
+            if not os.path.exists(self.path):
+                os.makedirs(self.path)
+            shape = tuple(int(np.ceil(np.amax(self.positions[:, i]))) + self.binned_shape[i] for i in range(2))
+            self.mosaic = np.lib.format.open_memmap(os.path.join(self.path, self.filename), mode='w+',
+                                                    dtype=np.float32, shape=shape)
+            self.tiles = np.lib.format.open_memmap(os.path.join(self.path, self.tiles_filename), mode='w+',
+                                                   dtype=np.float32, shape=(number_tiles,) + self.binned_shape)
+            self.save_info()
+
+    @classmethod
+    def open(cls, path):
+        """
+        Opens an existing mosaic store (e.g. to continue it when a map is resumed or to apply corrected positions).
+        """
+        with open(os.path.join(path, cls.info_filename)) as info_file:
+            info = json.load(info_file)
+        store = cls(path, info['grid_shape'], info['tile_shape'], spacing=info['spacing'], binning=info['binning'],
+                    pixel_size=info.get('pixel_size'), create=False)
+        store.positions = np.array(info['positions'], dtype=np.float64)
+        store.placed[info['placed']] = True
+        store.mosaic = np.load(os.path.join(path, cls.filename), mmap_mode='r+')
+        store.tiles = np.load(os.path.join(path, cls.tiles_filename), mmap_mode='r+')
+        return store
+
+    @classmethod
+    def exists(cls, path):
+        return all(os.path.isfile(os.path.join(path, name))
+                   for name in [cls.filename, cls.tiles_filename, cls.info_filename])
+
+    def nominal_positions(self):
+        rows, columns = np.divmod(np.arange(self.grid_shape[0] * self.grid_shape[1]), self.grid_shape[1])
+        return np.column_stack((rows * self.spacing * self.binned_shape[0],
+                                columns * self.spacing * self.binned_shape[1]))
+
+    def downsample(self, data):
+        """
+        Returns a downsampled copy of "data" with the shape of the tiles in the mosaic. Frames with the size of the map
+        frames are binned, all others (e.g. survey images) are resampled to the same shape.
+        """
+        data = np.asarray(getattr(data, 'data', data), dtype=np.float32)
+        factors = [data.shape[i] // self.binned_shape[i] for i in range(2)]
+        if min(factors) > 0 and all(data.shape[i] == factors[i] * self.binned_shape[i] for i in range(2)):
+            return data.reshape(self.binned_shape[0], factors[0], self.binned_shape[1], factors[1]).mean(axis=(1, 3))
+        rows = np.linspace(0, data.shape[0] - 1, self.binned_shape[0]).astype(int)
+        columns = np.linspace(0, data.shape[1] - 1, self.binned_shape[1]).astype(int)
+        return data[np.ix_(rows, columns)]
+
+    def add_tile(self, number, data, binned=False):
+        """
+        Puts the tile with frame number "number" into the mosaic. "data" is downsampled first unless "binned" is True
+        (i.e. it is the result of "downsample").
+        """
+        if not binned:
+            data = self.downsample(data)
+        with self._lock:
+            self.tiles[number] = data
+            self.placed[number] = True
+            self._place(number)
+
+    def _place(self, number):
+        top, left = np.rint(self.positions[number]).astype(int)
+        height, width = self.binned_shape
+        # Tiles that are shifted over the border of the mosaic are clipped
+        y0, x0 = max(top, 0), max(left, 0)
+        y1, x1 = min(top + height, self.mosaic.shape[0]), min(left + width, self.mosaic.shape[1])
+        if y1 > y0 and x1 > x0:
+            self.mosaic[y0:y1, x0:x1] = self.tiles[number][y0-top:y1-top, x0-left:x1-left]
+
+    def apply_positions(self, positions, scale=1):
+        """
+        Moves all tiles to "positions" and redraws the mosaic in place.
+
+        Parameters
+        -----------
+        positions : ndarray
+            Top-left corners (y, x) of all tiles with the shape (rows, columns, 2), like Positionfinder's
+            "optimized_positions". Tiles with negative coordinates (positions that were not found) keep their nominal
+            position.
+        scale : optional, float
+            Factor that converts "positions" to mosaic pixels (e.g. pixel size of the overview Positionfinder used
+            divided by the pixel size of the mosaic).
+        """
+        positions = np.reshape(np.asarray(positions, dtype=np.float64), (-1, 2)) * scale
+        found = (positions >= 0).all(axis=1)
+        nominal = self.nominal_positions()
+        if found.any():
+            # The found positions are only relative to each other, so they are aligned to the nominal grid on average
+            positions = positions - np.mean(positions[found] - nominal[found], axis=0)
+        with self._lock:
+            self.positions = np.where(found[:, np.newaxis], positions, nominal)
+            self.mosaic[:] = 0
+            for number in np.flatnonzero(self.placed):
+                self._place(number)
+        self.flush()
+
+    def save_info(self):
+        info = {'grid_shape': self.grid_shape, 'tile_shape': self.tile_shape, 'spacing': self.spacing,
+                'binning': self.binning, 'pixel_size': self.pixel_size, 'positions': self.positions.tolist(),
+                'placed': np.flatnonzero(self.placed).tolist()}
+        with open(os.path.join(self.path, self.info_filename), 'w') as info_file:
+            json.dump(info, info_file)
+
+    def flush(self):
+        with self._lock:
+            self.mosaic.flush()
+            self.tiles.flush()
+            self.save_info()
+
+    def close(self):
+        self.flush()
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 22:47:05 2026
+
+@author: mittelberger
+"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    # multiprocessing.shared_memory needs Python 3.8
+    shared_memory = None
+    logging.info('Could not import multiprocessing.shared_memory. Processing tasks cannot run in other processes.')
+
+from .autotune import Imaging, Peaking
+
+
+# Shared memory blocks that are attached in a worker process
+_attached = {}
+
+
+def shared_memory_available():
+    return shared_memory is not None
+
+
+def create_shared_memory(size):
+    return shared_memory.SharedMemory(create=True, size=max(int(size), 1))
+
+
+def release_shared_memory(block, unlink=True):
+    try:
+        block.close()
+    except BufferError:
+        # There are still arrays using the block. Its memory is freed when they are garbage collected.
+        pass
+    if unlink:
+        try:
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 registers the block with the resource tracker. The workers share the tracker of the main
+        # process (see ProcessBackend.submit), which already knows the block, so this does not change anything.
+        return shared_memory.SharedMemory(name=name)
+
+
+def _run_shared(function, reference, args, kwargs, temporary=False):
+    """
+    Runs in the worker process: Creates an array from "reference" ((name, offset, shape, dtype) of a shared memory
+    block) and calls "function" with it. Blocks of the frame buffer stay attached, temporary ones are detached again.
+    """
+    name, offset, shape, dtype = reference
+    if temporary:
+        block = _attach(name)
+    else:
+        block = _attached.get(name)
+        if block is None:
+            block = _attached[name] = _attach(name)
+    image = np.ndarray(shape, dtype=dtype, buffer=block.buf, offset=offset)
+    try:
+        return function(image, *args, **kwargs)
+    finally:
+        del image
+        if temporary:
+            block.close()
+
+
+class ProcessBackend(object):
+    """
+    Runs CPU-heavy processing tasks in a pool of worker processes, so that they do not compete for the GIL with the UI
+    and the acquisition thread. Frames are not pickled: Frames from a FrameBuffer with shared slots are referenced by
+    their position in the shared memory block, all other frames are copied into a temporary block once.
+    Functions that are submitted must be importable by the workers (module-level functions), must not change the image
+    and should only return small results.
+    "start_method" is the multiprocessing start method. The default ("spawn") is safe in a process with many threads.
+    """
+
+    def __init__(self, max_workers=None, **kwargs):
+        self.max_workers = max_workers
+        self.start_method = kwargs.get('start_method', 'spawn')
+        self._executor = None
+
+    def submit(self, function, frame, *args, **kwargs):
+        """
+        Calls "function(image, *args, **kwargs)" in a worker process, where "image" is the data of "frame" (a Frame or
+        an array). Returns a concurrent.futures.Future.
+        """
+        if self._executor is None:
+            # Started before the workers, so that they use the same resource tracker as this process
+            resource_tracker.ensure_running()
+            self._executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                 mp_context=multiprocessing.get_context(self.start_method))
+        reference = getattr(frame, 'shared', None)
+        if reference is not None:
+            return self._executor.submit(_run_shared, function, reference, args, kwargs)
+        data = np.ascontiguousarray(getattr(frame, 'data', frame))
+        block = create_shared_memory(data.nbytes)
+        np.ndarray(data.shape, dtype=data.dtype, buffer=block.buf)[:] = data
+        future = self._executor.submit(_run_shared, function, (block.name, 0, data.shape, data.dtype.str), args,
+                                       kwargs, True)
+        future.add_done_callback(lambda future: release_shared_memory(block))
+        return future
+
+    def shutdown(self, wait=True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
+            self._executor = None
+
+
+def dirt_fraction(image, dirt_threshold=None, **kwargs):
+    """
+    Returns the fraction of "image" that is covered with dirt and the dirt threshold that was used (found
+    automatically if "dirt_threshold" is None).
+    """
+    imager = Imaging(online=False)
+    imager.dirt_threshold = dirt_threshold
+    mask = imager.dirt_detector(image=image)
+    return (float(np.mean(mask)), imager.dirt_threshold)
+
+
+def mean_intensity(image, dirt_threshold=None, exclude_dirt=False, **kwargs):
+    """
+    Returns the mean intensity of "image" (only of the clean areas if "exclude_dirt" is True) and the dirt threshold
+    that was used.
+    """
+    if not exclude_dirt:
+        return (float(np.mean(image)), dirt_threshold)
+    imager = Imaging(online=False)
+    imager.dirt_threshold = dirt_threshold
+    mask = imager.dirt_detector(image=image)
+    return (float(np.mean(image[mask == 0])) if np.any(mask == 0) else np.nan, imager.dirt_threshold)
+
+
+def score_survey_image(image, imsize):
+    """
+    Returns the fraction of clean graphene in "image" (from Imaging.dirt_detector) and the number of first-order
+    lattice reflections that can be found in its FFT (0 - 6). "imsize" is the field of view in nm.
+    """
+    image = np.asarray(image, dtype=np.float32)
+    # Blur kernels of dirt_detector are made for 2048 px images
+    scale = image.shape[0] / 2048
+    mask = Imaging(online=False).dirt_detector(image=image, median_blur_diam=max(int(59*scale), 3),
+                                                gaussian_blur_radius=max(3*scale, 1))
+    graphene_fraction = 1 - np.mean(mask)
+    number_peaks = 0
+    if graphene_fraction > 0:
+        # Areas without graphene are set to the mean intensity of graphene to improve peak finding
+        clean = image.copy()
+        clean[mask == 1] = np.mean(image[mask == 0])
+        try:
+            peaks = Peaking(image=clean, imsize=imsize, online=False).find_peaks()
+        except (RuntimeError, ValueError, IndexError):
+            pass
+        else:
+            number_peaks = int(np.count_nonzero(np.any(peaks != 0, axis=1)))
+    return (float(graphene_fraction), number_peaks)
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 13:40:05 2026
+
+@author: mittelberger
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from .autotune import Imaging
+
+
+def points_in_polygon(points, polygon):
+    """
+    Checks which points lie inside a polygon (even-odd rule).
+
+    Parameters
+    -----------
+    points : array-like
+        (N, 2) array of (x, y) coordinates.
+    polygon : array-like
+        (M, 2) array or list of (x, y) tuples with the vertices of the polygon in drawing order. The polygon is closed
+        automatically.
+
+    Returns
+    --------
+    inside : ndarray
+        Boolean array of length N.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    polygon = np.asarray(polygon, dtype=np.float64).reshape(-1, 2)
+    x = points[:, 0, np.newaxis]
+    y = points[:, 1, np.newaxis]
+    x1, y1 = polygon[:, 0], polygon[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    # Count for each point the edges that are crossed by a ray going from the point in +x direction
+    crosses_line = (y1 > y) != (y2 > y)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x_intersect = x1 + (y - y1) * (x2 - x1) / (y2 - y1)
+    crossings = np.sum(crosses_line & (x < x_intersect), axis=1)
+    return crossings % 2 == 1
+
+
+class MapMask(object):
+    """
+    A boolean mask in image coordinates that defines which parts of a sample should be mapped (True means "map this").
+    The mask is positioned in stage coordinates by "center" (stage x, y of the image center in m), "fov" (field of
+    view of the image in nm) and "rotation" (scan rotation of the image in degrees).
+    """
+
+    def __init__(self, mask, center, fov, rotation=0):
+        self.mask = np.asarray(mask, dtype=bool)
+        self.center = tuple(center)
+        self.fov = fov
+        self.rotation = rotation
+
+    @classmethod
+    def from_overview(cls, image, center, fov, rotation=0, dirt_threshold=None, vacuum_threshold=None):
+        """
+        Creates a mask from an overview image that excludes vacuum and heavy contamination.
+        Vacuum is everything darker than "vacuum_threshold" after a slight gaussian blur. If no "vacuum_threshold" is
+        given, a quarter of the 90th percentile of the image intensity is used (vacuum is almost black in dark field
+        images). Contamination is found afterwards with Imaging.dirt_detector (with "dirt_threshold" or an
+        automatically determined threshold). Vacuum areas are filled with the median intensity of the sample before,
+        so that they do not influence the automatic dirt threshold.
+        """
+        image = np.asarray(image, dtype=np.float32)
+        blurred = gaussian_filter(image, 3)
+        if vacuum_threshold is None:
+            vacuum_threshold = 0.25 * np.percentile(blurred, 90)
+        vacuum = blurred < vacuum_threshold
+        sample = image.copy()
+        if vacuum.all():
+            return cls(np.zeros(image.shape, dtype=bool), center, fov, rotation=rotation)
+        sample[vacuum] = np.median(image[~vacuum])
+        imager = Imaging(image=sample, imsize=fov, dirt_threshold=dirt_threshold, online=False)
+        dirt = imager.dirt_detector() > 0
+        return cls(~(dirt | vacuum), center, fov, rotation=rotation)
+
+    def contains(self, points):
+        """
+        Returns a boolean array that is True for all (x, y) stage positions in "points" that fall onto a True pixel of
+        the mask. Positions outside of the image are False.
+        """
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        shape = np.array(self.mask.shape)
+        pixelsize = self.fov * 1e-9 / shape[1]
+        rotation = self.rotation / 180 * np.pi
+        dx = points[:, 0] - self.center[0]
+        dy = points[:, 1] - self.center[1]
+        # Image rows go from top to bottom, stage y goes from bottom to top
+        column = (np.cos(rotation) * dx + np.sin(rotation) * dy) / pixelsize + shape[1] / 2
+        row = (np.sin(rotation) * dx - np.cos(rotation) * dy) / pixelsize + shape[0] / 2
+        column = np.floor(column).astype(np.int64)
+        row = np.floor(row).astype(np.int64)
+        inside = (row >= 0) & (row < shape[0]) & (column >= 0) & (column < shape[1])
+        result = np.zeros(len(points), dtype=bool)
+        result[inside] = self.mask[row[inside], column[inside]]
+        return result
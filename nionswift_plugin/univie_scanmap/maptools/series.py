@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 00:06:38 2026
+
+@author: mittelberger
+"""
+
+import logging
+import threading
+import warnings
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from . import tifffile
+
+
+class SeriesSaver(object):
+    """
+    Save function for writer.FrameWriter that writes all frames of a series into one multi-page TIFF per position
+    instead of one file per frame. It is called as saver(path, data, page=None, is_last=False). Frames without "page"
+    are written as single TIFFs like tifffile.imsave does.
+    A container stays open until its last frame ("is_last") arrives, a frame for another container is written (e.g.
+    because the series was aborted) or "close" is called. Pages have to arrive in order.
+    """
+
+    def __init__(self, bigtiff=False):
+        self.bigtiff = bigtiff
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, path, data, page=None, is_last=False, **kwargs):
+        if page is None:
+            tifffile.imsave(path, data, **kwargs)
+            return
+        with self._lock:
+            for other_path in [other_path for other_path in self._open if other_path != path]:
+                self._close(other_path)
+            tiff = self._open.get(path)
+            if tiff is None or page == 0:
+                if tiff is not None:
+                    self._close(path)
+                tiff = self._open[path] = tifffile.TiffWriter(path, bigtiff=self.bigtiff)
+            try:
+                tiff.save(data, **kwargs)
+            finally:
+                if is_last:
+                    self._close(path)
+
+    def _close(self, path):
+        try:
+            self._open.pop(path).close()
+        except Exception as detail:
+            logging.error('Could not close {:s}. Reason: {:s}'.format(path, str(detail)))
+
+    def close(self):
+        with self._lock:
+            for path in list(self._open):
+                self._close(path)
+
+
+def number_of_frames(path):
+    """
+    Returns the number of frames (pages) in the TIFF at "path".
+    """
+    with tifffile.TiffFile(path) as tiff:
+        return len(tiff.pages)
+
+
+def read_frame(path, index=0):
+    """
+    Reads frame "index" from the TIFF at "path". This works for single frames and for series containers written by
+    SeriesSaver, where only the requested page is read. Negative indices count from the end. Single frames are
+    returned for every index.
+    """
+    with tifffile.TiffFile(path) as tiff:
+        number_pages = len(tiff.pages)
+        if number_pages < 2:
+            return np.asarray(tiff.asarray())
+        if index < 0:
+            index += number_pages
+        if not 0 <= index < number_pages:
+            raise IndexError('{:s} contains only {:.0f} frames.'.format(path, number_pages))
+        return np.asarray(tiff.asarray(key=index))
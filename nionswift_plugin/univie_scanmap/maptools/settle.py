@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 15:21:48 2026
+
+@author: mittelberger
+"""
+
+import json
+import logging
+import os
+import numpy as np
+from scipy.ndimage import shift as shift_image
+
+from .autoalign import shift_fft
+from .autotune import Imaging
+
+
+def direction_reversals(moves):
+    """
+    Returns a boolean array that is True for every move in "moves" ((N, 2) array of (dx, dy)) that goes in the
+    opposite x or y direction than the move before. Reversals are where stage backlash shows up.
+    """
+    moves = np.asarray(moves, dtype=np.float64).reshape(-1, 2)
+    signs = np.sign(moves)
+    reversals = np.zeros(len(moves), dtype=bool)
+    if len(moves) > 1:
+        reversals[1:] = np.any(signs[1:] * signs[:-1] < 0, axis=1)
+    return reversals
+
+
+def measure_drift(frame1, frame2, pixelsize, time_difference):
+    """
+    Measures the drift speed (nm/s) between two consecutive frames of the same position. "pixelsize" is in nm,
+    "time_difference" in s. Raises RuntimeError if the frames cannot be registered.
+    """
+    shift = shift_fft(np.asarray(frame1, dtype=np.float32), np.asarray(frame2, dtype=np.float32))
+    return np.sqrt(np.sum(np.square(shift))) * pixelsize / time_difference
+
+
+class SettleModel(object):
+    """
+    Predicts how long the stage needs to settle after a move.
+    After a move the drift speed is modeled as v(t) = A * exp(-t/tau), with
+    log(A) = a0 + ax*|dx| + ay*|dy| + ar*reversal (dx, dy in um, reversal is 1 if the move changes its direction).
+    The time until the drift drops below "drift_tolerance" (nm/s) is then tau * (log(A) - log(drift_tolerance)), which
+    is linear in the move distance. The parameters are found by a least squares fit to measured drift speeds (see
+    "add_sample" and "fit"). As long as the model is not calibrated, "predict" returns "default_time" for every move.
+    """
+
+    def __init__(self, **kwargs):
+        # coefficients are (a0, ax, ay, ar)
+        self.coefficients = np.array(kwargs.get('coefficients', (0, 0, 0, 0)), dtype=np.float64)
+        self.tau = kwargs.get('tau')
+        self.drift_tolerance = kwargs.get('drift_tolerance', 0.05)
+        self.min_time = kwargs.get('min_time', 0.2)
+        self.max_time = kwargs.get('max_time', 10)
+        self.default_time = kwargs.get('default_time', 2)
+        self.max_samples = kwargs.get('max_samples', 5000)
+        # Samples are (|dx| (um), |dy| (um), reversal, time since move (s), drift speed (nm/s))
+        self.samples = kwargs.get('samples', [])
+
+    @property
+    def is_calibrated(self):
+        return self.tau is not None
+
+    def predict(self, moves, reversals=None):
+        """
+        Returns the settle time (s) for each move in "moves" ((N, 2) array of (dx, dy) in m). If "reversals" is not
+        given, direction changes are determined from the sequence of moves itself.
+        """
+        moves = np.asarray(moves, dtype=np.float64).reshape(-1, 2)
+        if not self.is_calibrated:
+            return np.full(len(moves), float(self.default_time))
+        if reversals is None:
+            reversals = direction_reversals(moves)
+        log_amplitude = (self.coefficients[0] + self.coefficients[1] * np.abs(moves[:, 0]) * 1e6 +
+                         self.coefficients[2] * np.abs(moves[:, 1]) * 1e6 +
+                         self.coefficients[3] * np.asarray(reversals, dtype=np.float64))
+        times = self.tau * (log_amplitude - np.log(self.drift_tolerance))
+        return np.clip(times, self.min_time, self.max_time)
+
+    def __call__(self, moves):
+        return self.predict(moves)
+
+    def add_sample(self, move, reversal, time_since_move, drift_speed):
+        """
+        Adds one drift measurement. "move" is the (dx, dy) move (m) before the measurement, "time_since_move" the time
+        (s) between the end of the move and the middle of the two frames used for measuring "drift_speed" (nm/s).
+        """
+        if drift_speed <= 0 or not np.isfinite(drift_speed):
+            return
+        self.samples.append((abs(move[0]) * 1e6, abs(move[1]) * 1e6, float(bool(reversal)), float(time_since_move),
+                             float(drift_speed)))
+        if len(self.samples) > self.max_samples:
+            self.samples.pop(0)
+
+    def fit(self, min_samples=10):
+        """
+        Fits the model to all samples. Returns True if the fit was successful. A fit that results in drift increasing
+        with time is rejected and the old parameters are kept.
+        """
+        if len(self.samples) < min_samples:
+            return False
+        samples = np.array(self.samples)
+        design = np.column_stack((np.ones(len(samples)), samples[:, 0], samples[:, 1], samples[:, 2], -samples[:, 3]))
+        # Columns that never change (e.g. no reversals were measured) cannot be fitted and are fixed to zero
+        variable = np.ones(design.shape[1], dtype=bool)
+        variable[1:4] = np.ptp(design[:, 1:4], axis=0) > 0
+        solution = np.zeros(design.shape[1])
+        solution[variable] = np.linalg.lstsq(design[:, variable], np.log(samples[:, 4]), rcond=None)[0]
+        if solution[4] <= 0:
+            logging.warning('Settle model fit rejected because drift does not decay with time.')
+            return False
+        self.coefficients = solution[:4]
+        self.tau = 1 / solution[4]
+        return True
+
+    def to_dict(self):
+        return {'coefficients': self.coefficients.tolist(), 'tau': self.tau, 'drift_tolerance': self.drift_tolerance,
+                'min_time': self.min_time, 'max_time': self.max_time, 'default_time': self.default_time,
+                'samples': self.samples[-self.max_samples:]}
+
+    def save(self, path):
+        path = os.path.normpath(path)
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as model_file:
+            json.dump(self.to_dict(), model_file, indent=1)
+
+    @classmethod
+    def load(cls, path, **kwargs):
+        """
+        Loads a model from "path". If the file does not exist, a new (uncalibrated) model is returned. kwargs are used
+        as defaults for the parameters that are not in the file.
+        """
+        path = os.path.normpath(path)
+        if os.path.isfile(path):
+            with open(path) as model_file:
+                kwargs.update(json.load(model_file))
+        kwargs['samples'] = [tuple(sample) for sample in kwargs.get('samples', [])]
+        return cls(**kwargs)
+
+    @staticmethod
+    def default_path(instrument_name='default'):
+        """
+        Settle models are stored per instrument in the user's home directory.
+        """
+        return os.path.join(os.path.expanduser('~'), 'ScanMap', 'settle_model_{}.json'.format(instrument_name))
+
+
+def calibrate_offline(settle_model, moves, true_model, number_frames=4, frame_time=1.0, wait_time=0.5, fov=8,
+                      size_pixels=256):
+    """
+    Calibrates "settle_model" with frames from the graphene simulator in Imaging instead of the microscope. For each
+    move in "moves" ((N, 2) array of (dx, dy) in m) a series of "number_frames" frames is simulated that drifts
+    according to "true_model" (a calibrated SettleModel). The drift between consecutive frames is measured in exactly
+    the same way as during a map and added to "settle_model", which is fitted at the end.
+    This is mainly useful to test the calibration chain and to create a starting model for a new instrument.
+    Returns the result of "settle_model.fit()".
+    """
+    moves = np.asarray(moves, dtype=np.float64).reshape(-1, 2)
+    reversals = direction_reversals(moves)
+    pixelsize = fov / size_pixels
+    imager = Imaging(online=False, frame_parameters={'fov': fov, 'size_pixels': (size_pixels, size_pixels),
+                                                     'rotation': 0, 'pixeltime': 1})
+    # One large noise-free lattice is enough, the drift is applied by shifting it
+    lattice = imager.graphene_generator(fov, size_pixels, 0)
+    for move, reversal in zip(moves, reversals):
+        log_amplitude = (true_model.coefficients[0] + true_model.coefficients[1] * abs(move[0]) * 1e6 +
+                         true_model.coefficients[2] * abs(move[1]) * 1e6 + true_model.coefficients[3] * reversal)
+        amplitude = np.exp(log_amplitude)
+        direction = np.random.rand() * 2 * np.pi
+        times = wait_time + frame_time * np.arange(1, number_frames + 1)
+        # Integral of v(t) gives the position of the sample at the end of each frame (nm)
+        distances = amplitude * true_model.tau * (1 - np.exp(-times / true_model.tau))
+        previous = None
+        for k in range(number_frames):
+            offset = distances[k] / pixelsize * np.array((np.sin(direction), np.cos(direction)))
+            frame = shift_image(lattice, offset, order=1, mode='wrap')
+            frame = np.random.poisson(frame * 50 + 1).astype(np.float32)
+            if previous is not None:
+                try:
+                    speed = measure_drift(previous, frame, pixelsize, frame_time)
+                except RuntimeError:
+                    pass
+                else:
+                    settle_model.add_sample(move, reversal, times[k] - frame_time / 2, speed)
+            previous = frame
+    return settle_model.fit()
@@ -0,0 +1,310 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 02:24:37 2026
+
+@author: mittelberger
+"""
+
+import threading
+import time
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from .autotune import Imaging
+
+
+class SimulatedData(object):
+    """
+    Stand-in for the data_and_metadata objects returned by SuperScan.
+    """
+
+    def __init__(self, data, metadata=None):
+        self.data = data
+        self.metadata = metadata or {}
+
+
+class VirtualSpecimen(object):
+    """
+    A graphene sample on which the simulated microscope acquires its images. The lattice comes from
+    Imaging.graphene_generator and contamination from Imaging.dirt_generator. The dirt coverage changes smoothly over
+    the sample (between 0 and "max_coverage", on a length scale of "dirt_length_scale" m) and is the same whenever the
+    same position is imaged. The sample surface is a tilted plane (z = z0 + tilt*(x, y)) and images are blurred by
+    "blur_per_nm" pixels per nm that EHTFocus is away from the ideal focus there. "dirt_intensity" is the brightness of
+    contamination relative to graphene.
+    Lattices are cached for each combination of field of view and size, because generating them takes long.
+    """
+
+    def __init__(self, **kwargs):
+        self.seed = kwargs.get('seed', 0)
+        self.rotation = kwargs.get('rotation', 0)
+        self.max_coverage = kwargs.get('max_coverage', 0.6)
+        self.dirt_length_scale = kwargs.get('dirt_length_scale', 2e-6)
+        # Contamination is brighter than graphene
+        self.dirt_intensity = kwargs.get('dirt_intensity', 3)
+        self.z0 = kwargs.get('z0', 0)
+        self.tilt = np.array(kwargs.get('tilt', (0, 0)))
+        self.ideal_focus = kwargs.get('ideal_focus', 0)
+        self.blur_per_nm = kwargs.get('blur_per_nm', 0.2)
+        self.counts_per_us = kwargs.get('counts_per_us', 20)
+        self._imager = Imaging(online=False)
+        self._lattices = {}
+        self._lock = threading.Lock()
+
+    def dirt_coverage(self, x, y):
+        """
+        Returns the dirt coverage (0 - 1) at the stage position (x, y) in m.
+        """
+        phases = np.random.RandomState(self.seed).rand(4) * 2 * np.pi
+        u, v = np.array((x, y)) / self.dirt_length_scale * 2 * np.pi
+        value = np.sin(u + phases[0]) * np.sin(v + phases[1]) + 0.5 * np.sin(0.7*u - 1.3*v + phases[2])
+        return float(np.clip((value + 1.5) / 3, 0, 1) * self.max_coverage)
+
+    def focus(self, x, y):
+        """
+        Returns (z, EHTFocus) that give a sharp image at (x, y).
+        """
+        return (self.z0 + self.tilt[0]*x + self.tilt[1]*y, self.ideal_focus)
+
+    def _lattice(self, fov, size):
+        key = (float(fov), tuple(size))
+        with self._lock:
+            lattice = self._lattices.get(key)
+        if lattice is None:
+            lattice = self._imager.graphene_generator(fov, size[0], self.rotation).astype(np.float32)
+            with self._lock:
+                self._lattices[key] = lattice
+        return lattice
+
+    def image(self, x, y, focus, fov, size, pixeltime, channels=1):
+        """
+        Returns "channels" noisy images at the stage position (x, y) (m) with "focus" (EHTFocus in m), "fov" (nm),
+        "size" (pixels) and "pixeltime" (us).
+        """
+        size = tuple(int(value) for value in size)
+        lattice = self._lattice(fov, size)
+        # The lattice is shifted with the stage, so that consecutive images are not identical
+        shift = (np.array((y, x)) * 1e9 / fov * np.array(size)).astype(int) % np.array(size)
+        image = np.roll(lattice, tuple(shift), axis=(0, 1))
+        coverage = self.dirt_coverage(x, y)
+        if coverage > 0.01:
+            # Global numpy random state is used by dirt_generator, so it is seeded for this position and restored
+            state = np.random.get_state()
+            np.random.seed((self.seed + int(abs(x) * 1e9) * 7919 + int(abs(y) * 1e9)) % 2**32)
+            try:
+                dirt = self._imager.dirt_generator(fov, size[0], 2, coverage=coverage, intensity=self.dirt_intensity)
+            finally:
+                np.random.set_state(state)
+            image = image + dirt.astype(np.float32)
+        blur = abs(focus - self.focus(x, y)[1]) * 1e9 * self.blur_per_nm
+        if blur > 0.1:
+            image = gaussian_filter(image, blur)
+        rng = np.random.RandomState()
+        dose = self.counts_per_us * pixeltime
+        return [rng.poisson(np.maximum(image, 0) * dose + 0.05 * dose).astype(np.float32) for i in range(channels)]
+
+
+class SimulatedAS2(object):
+    """
+    Stand-in for the AS2 instrument object. Controls and properties are kept in a dictionary (values of controls that
+    were never set are 0). Setting a control with options={'confirm': True} takes "confirm_delay" seconds; stage
+    controls ("StageOutX/Y/Z") additionally take "move_latency" seconds plus the travel distance divided by
+    "stage_speed" (m/s). All delays are multiplied by "time_scale".
+    "failure_rate" is the probability that a confirmed control change times out with a TimeoutError, like on the
+    microscope (failure injection).
+    """
+
+    stage_controls = ['StageOutX', 'StageOutY', 'StageOutZ']
+
+    def __init__(self, **kwargs):
+        self.confirm_delay = kwargs.get('confirm_delay', 0.05)
+        self.move_latency = kwargs.get('move_latency', 0.2)
+        self.stage_speed = kwargs.get('stage_speed', 10e-6)
+        self.time_scale = kwargs.get('time_scale', 1)
+        self.failure_rate = kwargs.get('failure_rate', 0)
+        self.controls = dict(kwargs.get('controls', {}))
+        self.number_calls = 0
+        self.number_failures = 0
+        self._lock = threading.Lock()
+        self._rng = np.random.RandomState(kwargs.get('seed'))
+
+    def _delay(self, name, value):
+        delay = self.confirm_delay
+        if name in self.stage_controls:
+            delay += self.move_latency + abs(value - self.controls.get(name, 0)) / self.stage_speed
+        return delay * self.time_scale
+
+    def set_control_output(self, name, value, options=None):
+        options = options or {}
+        with self._lock:
+            self.number_calls += 1
+            if options.get('value_type') == 'delta':
+                value += self.controls.get(name, 0)
+            delay = self._delay(name, value) if options.get('confirm') else 0
+            fails = options.get('confirm') and self._rng.rand() < self.failure_rate
+            if fails:
+                self.number_failures += 1
+        if delay > 0:
+            time.sleep(delay)
+        if fails:
+            raise TimeoutError('Simulated failure: could not confirm {:s}.'.format(name))
+        with self._lock:
+            self.controls[name] = value
+
+    def get_control_output(self, name):
+        with self._lock:
+            # "^" returns the target value of a control, which is the same as its value here
+            return self.controls.get(name.lstrip('^'), 0)
+
+    def set_property_as_float(self, name, value):
+        with self._lock:
+            self.number_calls += 1
+            self.controls[name] = value
+
+    def get_property_as_float(self, name):
+        return self.get_control_output(name)
+
+
+class SimulatedSuperScan(object):
+    """
+    Stand-in for the SuperScan hardware source. Frames take as long as the real scan (pixel time and flyback time of
+    the frame parameters, multiplied by "time_scale") and are filled line by line, so that "read_partial_frame" works
+    like on the microscope. The images show "specimen" (a VirtualSpecimen) at the stage position and focus of "as2".
+    "channels" is the number of images returned for each frame (one per enabled detector).
+    Failure injection: "grab_failure_rate" is the probability that grabbing a frame fails with a RuntimeError.
+    """
+
+    def __init__(self, as2, specimen=None, **kwargs):
+        self.as2 = as2
+        self.specimen = specimen or VirtualSpecimen()
+        self.time_scale = kwargs.get('time_scale', 1)
+        self.channels = kwargs.get('channels', 1)
+        self.grab_failure_rate = kwargs.get('grab_failure_rate', 0)
+        self.frame_parameters = {'size': (512, 512), 'pixel_time_us': 1, 'fov_nm': 8, 'rotation_rad': 0,
+                                 'flyback_time_us': 120}
+        self.record_frame_parameters = dict(self.frame_parameters)
+        self.profile_index = 0
+        self.number_frames = 0
+        self.number_failures = 0
+        # Time spent generating images (s). It is part of the grab time, but would not be spent on the microscope.
+        self.simulation_time = 0
+        self._playing = threading.Event()
+        self._stop_after_frame = threading.Event()
+        self._abort = threading.Event()
+        self._lock = threading.Lock()
+        self._frame = None
+        self._valid_rows = 0
+        self._rng = np.random.RandomState(kwargs.get('seed'))
+
+    @property
+    def is_playing(self):
+        return self._playing.is_set()
+
+    def set_frame_parameters(self, frame_parameters=None, **kwargs):
+        self.frame_parameters = dict(self.frame_parameters, **dict(frame_parameters or {}, **kwargs))
+
+    def get_frame_parameters(self):
+        return dict(self.frame_parameters)
+
+    def set_record_frame_parameters(self, frame_parameters=None, **kwargs):
+        self.record_frame_parameters = dict(self.record_frame_parameters, **dict(frame_parameters or {}, **kwargs))
+
+    def get_record_frame_parameters(self):
+        return dict(self.record_frame_parameters)
+
+    def start_playing(self, *args, **kwargs):
+        self._abort.clear()
+        self._stop_after_frame.clear()
+        self._playing.set()
+
+    def stop_playing(self, *args, **kwargs):
+        # The frame that is being scanned is finished first
+        self._stop_after_frame.set()
+
+    def abort_playing(self, *args, **kwargs):
+        self._abort.set()
+        self._playing.clear()
+
+    def frame_time(self, frame_parameters=None):
+        """
+        Time one frame with "frame_parameters" takes in the simulation (s).
+        """
+        parameters = frame_parameters or self.frame_parameters
+        rows, columns = parameters['size']
+        return (rows * columns * parameters['pixel_time_us'] + rows * parameters.get('flyback_time_us', 0)) * \
+               1e-6 * self.time_scale
+
+    def _scan(self, frame_parameters, channels):
+        if self._rng.rand() < self.grab_failure_rate:
+            with self._lock:
+                self.number_failures += 1
+                # The partial frame monitor must not see the previous frame as part of the failed one
+                self._frame = None
+                self._valid_rows = 0
+            raise RuntimeError('Simulated failure: frame could not be grabbed.')
+        generation_starttime = time.perf_counter()
+        images = self.specimen.image(self.as2.get_control_output('StageOutX'),
+                                     self.as2.get_control_output('StageOutY'),
+                                     self.as2.get_control_output('EHTFocus'), frame_parameters['fov_nm'],
+                                     frame_parameters['size'], frame_parameters['pixel_time_us'], channels=channels)
+        starttime = time.perf_counter()
+        with self._lock:
+            self.simulation_time += starttime - generation_starttime
+        rows = images[0].shape[0]
+        frame = np.zeros_like(images[0])
+        with self._lock:
+            self._frame = frame
+            self._valid_rows = 0
+        # Lines arrive in blocks of about 20 ms
+        frame_time = self.frame_time(frame_parameters)
+        block = max(int(rows * 0.02 / frame_time), 1) if frame_time > 0 else rows
+        for start in range(0, rows, block):
+            if self._abort.is_set():
+                raise RuntimeError('Scan was aborted.')
+            stop = min(start + block, rows)
+            frame[start:stop] = images[0][start:stop]
+            with self._lock:
+                self._valid_rows = stop
+            wait = starttime + frame_time * stop / rows - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+        with self._lock:
+            self.number_frames += 1
+        return [SimulatedData(image, metadata={'frame_parameters': dict(frame_parameters)}) for image in images]
+
+    def grab_next_to_finish(self, *args, **kwargs):
+        if not self._playing.is_set():
+            raise RuntimeError('SuperScan is not playing.')
+        try:
+            return self._scan(self.frame_parameters, self.channels)
+        finally:
+            if self._stop_after_frame.is_set():
+                self._playing.clear()
+
+    grab_next_to_start = grab_next_to_finish
+
+    def record(self, frame_parameters=None, channels_enabled=None, **kwargs):
+        parameters = dict(self.frame_parameters)
+        parameters.update(frame_parameters or self.record_frame_parameters)
+        channels = int(np.count_nonzero(channels_enabled)) if channels_enabled is not None else self.channels
+        self._abort.clear()
+        return self._scan(parameters, max(channels, 1))
+
+    def read_partial_frame(self):
+        """
+        Returns (frame, number of valid rows) of the frame that is being scanned (see streaming.read_partial_frame).
+        """
+        with self._lock:
+            if self._frame is None:
+                return None
+            return (self._frame, self._valid_rows)
+
+
+def simulated_hardware(**kwargs):
+    """
+    Returns (superscan, as2) stand-ins for running SuperScanMapper without a microscope, e.g.
+    SuperScanMapper(superscan=superscan, as2=as2, ...). "kwargs" are passed to VirtualSpecimen, SimulatedAS2 and
+    SimulatedSuperScan (each one uses the arguments it knows).
+    """
+    as2 = SimulatedAS2(**kwargs)
+    superscan = SimulatedSuperScan(as2, specimen=VirtualSpecimen(**kwargs), **kwargs)
+    return (superscan, as2)
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 01:52:09 2026
+
+@author: mittelberger
+"""
+
+import numpy as np
+from scipy.ndimage import gaussian_filter
+
+from .events import DirtCoverage, IntensityChange
+
+
+def read_partial_frame(superscan):
+    """
+    Returns (data, valid_rows) of the frame SuperScan is currently acquiring (first channel) or None if no partial data
+    is available. Backends can provide a method "read_partial_frame" with the same return value; otherwise the data
+    channels of the Nion Swift hardware source are read.
+    """
+    read = getattr(superscan, 'read_partial_frame', None)
+    if callable(read):
+        return read()
+    hardware_source = getattr(superscan, '_HardwareSource__hardware_source', None)
+    try:
+        for data_channel in hardware_source.data_channels:
+            if data_channel.state != 'partial' or data_channel.data_and_metadata is None:
+                continue
+            sub_area = data_channel.sub_area
+            valid_rows = sub_area[0][0] + sub_area[1][0] if sub_area is not None else 0
+            return (data_channel.data_and_metadata.data, valid_rows)
+    except (AttributeError, TypeError):
+        pass
+    return None
+
+
+class PartialFrameMonitor(object):
+    """
+    Runs dirt coverage and intensity statistics on the rows of a frame that is still being acquired. "update" is
+    called with the partial frame whenever new rows arrived. The new rows are analyzed in blocks of at least
+    "block_rows" rows and the statistics are updated incrementally, so every row is only looked at once.
+    "update" returns an event (events.DirtCoverage or events.IntensityChange) as soon as the frame fails:
+        - Dirt: The pixels above the dirt threshold (after a Gaussian blur like in Imaging.dirt_detector) cover more
+          than "dirt_area" of the whole frame, or more than "dirt_area" of the rows checked so far once "min_fraction"
+          of the frame was checked. The last rows that arrived are only checked with the next block (see "_add_rows").
+        - Intensity: The mean intensity of the rows seen so far crosses the threshold of Mapping.check_intensity once
+          "min_fraction" of the frame was analyzed.
+    Dirt threshold and intensity reference are only known after the first full frames were processed, so they are
+    read from the callables "get_dirt_threshold" and "get_intensity_reference". A check is skipped while they return
+    None. The intensity is not checked for the first frame of a series, which is the reference.
+    """
+
+    def __init__(self, **kwargs):
+        self.get_dirt_threshold = kwargs.get('get_dirt_threshold')
+        self.dirt_area = kwargs.get('dirt_area')
+        self.get_intensity_reference = kwargs.get('get_intensity_reference')
+        self.intensity_threshold = kwargs.get('intensity_threshold')
+        self.block_rows = kwargs.get('block_rows', 32)
+        self.min_fraction = kwargs.get('min_fraction', 0.2)
+        self.gaussian_blur_radius = kwargs.get('gaussian_blur_radius', 3)
+        self.reset()
+
+    def reset(self, is_first=False, started_at=None):
+        """
+        Has to be called before a new frame starts.
+        """
+        self.is_first = is_first
+        self.started_at = started_at
+        self.rows = 0
+        self.dirt_pixels = 0
+        # Rows and pixels that were checked for dirt. This lags behind "rows" (see "_add_rows").
+        self.dirt_rows = 0
+        self.dirt_checked_pixels = 0
+        self.intensity_sum = 0.0
+        self.number_pixels = 0
+
+    def update(self, data, valid_rows):
+        data = np.asarray(data)
+        if valid_rows < self.rows:
+            # A new frame started
+            self.reset(is_first=False, started_at=self.started_at)
+        # Complete frames are checked by the processing tasks. They are also what is left in the data channels from
+        # the previous frame when a new one starts.
+        if valid_rows - self.rows < self.block_rows or valid_rows >= data.shape[0]:
+            return None
+        self._add_rows(data, self.rows, valid_rows)
+        return self.check(data.shape[0] * data.shape[1])
+
+    def _add_rows(self, data, start, stop):
+        block = np.asarray(data[start:stop], dtype=np.float32)
+        self.intensity_sum += float(np.sum(block))
+        self.number_pixels += block.size
+        self.rows = stop
+        dirt_threshold = self.get_dirt_threshold() if callable(self.get_dirt_threshold) else None
+        if dirt_threshold is not None and self.dirt_area is not None:
+            # A row is only checked when all rows within the reach of the blur kernel (gaussian_filter cuts it off at 4
+            # sigma) are there, so that it is blurred like in the full frame. The last rows of a block are held back
+            # until the next block arrived, the rows above the new ones are blurred together with them.
+            margin = int(4*self.gaussian_blur_radius + 0.5)
+            end = stop - margin
+            if end > self.dirt_rows:
+                top = max(self.dirt_rows - margin, 0)
+                blurred = gaussian_filter(np.asarray(data[top:stop], dtype=np.float32), self.gaussian_blur_radius)
+                self.dirt_pixels += int(np.count_nonzero(blurred[self.dirt_rows-top:end-top] > dirt_threshold))
+                self.dirt_checked_pixels += (end - self.dirt_rows) * blurred.shape[1]
+                self.dirt_rows = end
+
+    def check(self, total_pixels):
+        info = {'timestamp': self.started_at}
+        seen_enough = self.number_pixels >= self.min_fraction * total_pixels
+        if self.dirt_area is not None and self.dirt_checked_pixels > 0:
+            if (self.dirt_pixels > self.dirt_area * total_pixels or
+                    (self.dirt_checked_pixels >= self.min_fraction * total_pixels and
+                     self.dirt_pixels > self.dirt_area * self.dirt_checked_pixels)):
+                return DirtCoverage(info, fraction=self.dirt_pixels / self.dirt_checked_pixels, limit=self.dirt_area,
+                                    rows=self.rows, partial=True)
+        reference = self.get_intensity_reference() if callable(self.get_intensity_reference) else None
+        if (self.intensity_threshold is not None and reference is not None and not self.is_first and seen_enough):
+            intensity = self.intensity_sum / self.number_pixels
+            threshold = (1 - self.intensity_threshold) * reference
+            if self.intensity_threshold < 0 and intensity > threshold:
+                return IntensityChange(info, intensity=intensity, threshold=reference, rows=self.rows, partial=True)
+            if self.intensity_threshold >= 0 and intensity < threshold:
+                return IntensityChange(info, intensity=intensity, threshold=threshold, rows=self.rows, partial=True)
+        return None
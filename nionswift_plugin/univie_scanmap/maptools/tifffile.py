@@ -2278,13 +2278,13 @@ class TiffPage(object):
                         # needs the raw byte order
                         typecode = dtype
                     try:
-                        return numpy.fromstring(x, typecode)
+                        return numpy.frombuffer(x, typecode).copy()
                     except ValueError as e:
                         # strips may be missing EOI
                         warnings.warn("unpack: %s" % e)
                         xlen = ((len(x) // (bits_per_sample // 8)) *
                                 (bits_per_sample // 8))
-                        return numpy.fromstring(x[:xlen], typecode)
+                        return numpy.frombuffer(x[:xlen], typecode).copy()
 
             elif isinstance(bits_per_sample, tuple):
                 def unpack(x):
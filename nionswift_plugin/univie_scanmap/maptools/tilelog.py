@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Sat Oct 17 04:47:08 2026
+
+@author: mittelberger
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+
+class TileLog(object):
+    """
+    Structured log of a map with one line of JSON per tile. The record of a tile is collected while the tile is mapped
+    ("update" sets fields, "append" adds values to list fields, e.g. the dirt fraction of every frame or events like
+    retuning) and written when the tile is finished. Finished records are written in batches of "batch_size" or when
+    "flush_interval" seconds have passed since the last write, so logging does not cost a disk access per tile. Unlike
+    the journal.TileJournal, the log is not fsynced and is not used to resume maps.
+    Typical fields are "number", "index", "x", "y", "x_corrected", "y_corrected", "z", "focus", "files",
+    "dirt_fraction", "intensity", "events" and "timing" (seconds per stage, see timing.TimingRecorder).
+    "format_entry" turns a record into a line of text, "write_text" the whole log into a text file.
+    """
+
+    filename = 'tile_log.jsonl'
+    text_filename = 'tile_log.txt'
+
+    def __init__(self, path, batch_size=32, flush_interval=10):
+        self.path = os.path.normpath(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._records = {}
+        self._lines = []
+        self._last_flush = time.time()
+        self._file = None
+
+    def open(self, mode='a'):
+        with self._lock:
+            if self._file is None:
+                self._file = open(self.path, mode=mode)
+
+    def update(self, number, **fields):
+        with self._lock:
+            self._records.setdefault(number, {'number': number}).update(fields)
+
+    def append(self, number, key, value, unique=False):
+        """
+        Appends "value" to the list "key" of the record of tile "number". With "unique", values that are in the list
+        already are not added again.
+        """
+        with self._lock:
+            values = self._records.setdefault(number, {'number': number}).setdefault(key, [])
+            if not unique or value not in values:
+                values.append(value)
+
+    def finish(self, number, **fields):
+        """
+        Moves the record of tile "number" to the lines that will be written. Tiles that have no record are ignored.
+        """
+        with self._lock:
+            record = self._records.pop(number, None)
+            if record is None:
+                return
+            record.update(fields)
+            self._lines.append(json.dumps(record))
+            if len(self._lines) >= self.batch_size or time.time() - self._last_flush >= self.flush_interval:
+                self._flush()
+
+    def _flush(self):
+        if self._lines:
+            if self._file is None:
+                self._file = open(self.path, mode='a')
+            self._file.write('\n'.join(self._lines) + '\n')
+            self._file.flush()
+            self._lines = []
+        self._last_flush = time.time()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def close(self):
+        """
+        Writes the records of all tiles, also of those that were not finished (they get "finished": False), and closes
+        the file.
+        """
+        with self._lock:
+            for number in sorted(self._records):
+                self._lines.append(json.dumps(dict(self._records[number], finished=False)))
+            self._records = {}
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    @staticmethod
+    def read(path):
+        """
+        Returns all records in the log at "path" (a file or a map folder) as list of dictionaries, ordered by tile
+        number. If a tile was logged more than once (e.g. in a resumed map), the last record is used.
+        """
+        if os.path.isdir(path):
+            path = os.path.join(path, TileLog.filename)
+        records = {}
+        if not os.path.isfile(path):
+            return []
+        with open(path) as log_file:
+            for line in log_file:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logging.warning('Skipping broken line in tile log: ' + line)
+                else:
+                    records[record.get('number')] = record
+        return [records[number] for number in sorted(records, key=lambda number: (number is None, number))]
+
+    @staticmethod
+    def format_entry(record):
+        """
+        Returns a line of text that describes the tile in "record".
+        """
+        line = 'No. {:.0f}: x: {:g}, y: {:g}, z: {:g}, focus: {:g}'.format(
+               record.get('number', -1), record.get('x_corrected', record.get('x', 0)),
+               record.get('y_corrected', record.get('y', 0)), record.get('z', 0), record.get('focus', 0))
+        if record.get('files'):
+            line += ', {:.0f} file(s): {:s}'.format(len(record['files']), ', '.join(record['files']))
+        if record.get('dirt_fraction'):
+            line += ', dirt: ' + ', '.join('{:.0%}'.format(value) for value in record['dirt_fraction'])
+        if record.get('intensity'):
+            line += ', intensity: ' + ', '.join('{:g}'.format(value) for value in record['intensity'])
+        for event in record.get('events', []):
+            line += ', {:s}'.format(event.get('event', ''))
+            if event.get('reason'):
+                line += ' ({:s})'.format(event['reason'])
+            if event.get('message'):
+                line += ': ' + ' '.join(event['message'].split())
+        if record.get('timing'):
+            line += ', timing: ' + ', '.join('{:s} {:.2f} s'.format(stage, value) for stage, value in
+                                             sorted(record['timing'].items()))
+        if record.get('finished') is False:
+            line += ', not finished'
+        return line
+
+    @classmethod
+    def write_text(cls, path, text_path=None):
+        """
+        Writes the human readable version of the log at "path" (a file or a map folder) to "text_path" (default:
+        "tile_log.txt" next to the log).
+        """
+        records = cls.read(path)
+        if text_path is None:
+            folder = path if os.path.isdir(path) else os.path.dirname(path)
+            text_path = os.path.join(folder, cls.text_filename)
+        with open(text_path, 'w') as text_file:
+            for record in records:
+                text_file.write(cls.format_entry(record) + '\n')
+        return text_path
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 09:12:40 2026
+
+@author: mittelberger
+"""
+
+import numpy as np
+
+# Every tile of a map is one entry in a structured array with these fields. Coordinates are stage coordinates in m.
+# "number" is the frame number used in file names and only depends on the grid position of a tile, "index" is the
+# position of a tile in the traversal order.
+tile_dtype = np.dtype([('x', np.float64), ('y', np.float64), ('x_corrected', np.float64),
+                       ('y_corrected', np.float64), ('z', np.float64), ('focus', np.float64), ('row', np.int32),
+                       ('column', np.int32), ('number', np.int32), ('index', np.int32), ('retune', np.bool_)])
+
+
+class TilePlan(object):
+    """
+    Holds all tiles of a map in one numpy structured array (see "tile_dtype" for the available fields). The array is
+    always kept in traversal order, e.g. tiles[0] is the first position the stage moves to. Iterating over a TilePlan
+    yields the entries of the structured array in that order.
+    "shape" is the size of the grid the tiles were created on as (number of rows, number of columns).
+    """
+
+    def __init__(self, tiles, shape):
+        self.tiles = tiles
+        self.shape = tuple(shape)
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def __iter__(self):
+        return iter(self.tiles)
+
+    def __getitem__(self, index):
+        return self.tiles[index]
+
+    @classmethod
+    def snake(cls, left, top, num_subframes, spacing, x_corrections=None, y_corrections=None):
+        """
+        Creates a plan for a rectangular grid that is mapped in a "snake shaped" path: Starting point is the upper-left
+        corner and mapping will proceed to the right. The next line will start at the right and scan towards the left.
+        The next line will again start at the left, and so on.
+
+        Parameters
+        -----------
+        left, top : float
+            Stage coordinates of the top-left tile (m).
+        num_subframes : tuple
+            Number of tiles in (x, y) direction.
+        spacing : float
+            Distance between the centers of two neighbouring tiles (m).
+        x_corrections, y_corrections : optional, ndarray
+            Offsets (m) that are added to x and subtracted from y to get the corrected coordinates. They have to have
+            the shape (number of rows, number of columns) and are indexed by the position of a tile within the
+            traversal of its line (not by its column).
+
+        Returns
+        --------
+        tile_plan : TilePlan
+        """
+        num_columns, num_rows = int(num_subframes[0]), int(num_subframes[1])
+        rows, line_positions = np.mgrid[0:num_rows, 0:num_columns]
+        columns = line_positions.copy()
+        columns[1::2] = columns[1::2, ::-1]
+
+        tiles = np.zeros(num_rows*num_columns, dtype=tile_dtype)
+        tiles['row'] = rows.ravel()
+        tiles['column'] = columns.ravel()
+        tiles['x'] = left + tiles['column']*spacing
+        tiles['y'] = top - tiles['row']*spacing
+        tiles['x_corrected'] = tiles['x']
+        tiles['y_corrected'] = tiles['y']
+        if x_corrections is not None:
+            tiles['x_corrected'] += np.asarray(x_corrections)[rows, line_positions].ravel()
+        if y_corrections is not None:
+            tiles['y_corrected'] -= np.asarray(y_corrections)[rows, line_positions].ravel()
+        tiles['number'] = tiles['row']*num_columns + tiles['column']
+        tiles['index'] = np.arange(len(tiles))
+        tiles['z'] = np.nan
+        tiles['focus'] = np.nan
+        return cls(tiles, (num_rows, num_columns))
+
+    @property
+    def positions(self):
+        """
+        Stage positions the tiles were planned at as (N, 2) array of (x, y).
+        """
+        return np.column_stack((self.tiles['x'], self.tiles['y']))
+
+    @property
+    def corrected_positions(self):
+        """
+        Positions the stage will actually be moved to as (N, 2) array of (x, y).
+        """
+        return np.column_stack((self.tiles['x_corrected'], self.tiles['y_corrected']))
+
+    def info(self, index):
+        """
+        Returns the info dictionary of the tile at "index" in traversal order. It contains at least the frame number
+        in the key "number".
+        """
+        tile = self.tiles[index]
+        info = {'number': int(tile['number']), 'row': int(tile['row']), 'column': int(tile['column']),
+                'index': int(tile['index'])}
+        if tile['retune']:
+            info['retune'] = True
+        return info
+
+    def reorder(self, order):
+        """
+        Changes the traversal order of the plan. "order" is an index array into the current tiles. Frame numbers stay
+        the same, only the traversal index is updated.
+        """
+        self.tiles = self.tiles[np.asarray(order)]
+        self.tiles['index'] = np.arange(len(self.tiles))
+
+    def restrict(self, keep):
+        """
+        Removes all tiles for which the boolean array "keep" is False. The traversal index is updated, frame numbers
+        stay the same.
+        """
+        self.tiles = self.tiles[np.asarray(keep, dtype=bool)]
+        self.tiles['index'] = np.arange(len(self.tiles))
+
+    def to_grid(self, field, number_tiles=None, fill_value=0, mask=None):
+        """
+        Scatters a field of the tiles back onto the map grid.
+
+        Parameters
+        -----------
+        field : str
+            Name of the field in "tile_dtype".
+        number_tiles : optional, int
+            Only use the first "number_tiles" tiles in traversal order (e.g. the ones that were already visited).
+        fill_value : optional
+            Value for grid positions without a (visited) tile.
+        mask : optional, ndarray
+            Boolean array (in traversal order) of the tiles to use, e.g. the ones that were not skipped. It is combined
+            with "number_tiles".
+
+        Returns
+        --------
+        grid : ndarray
+            Array with shape "self.shape".
+        """
+        tiles = self.tiles[:number_tiles]
+        if mask is not None:
+            tiles = tiles[np.asarray(mask, dtype=bool)[:len(tiles)]]
+        grid = np.full(self.shape, fill_value, dtype=self.tiles.dtype[field])
+        grid[tiles['row'], tiles['column']] = tiles[field]
+        return grid
+
+    def save(self, path):
+        """
+        Saves the plan (in its current order, including z and focus values) to a .npz file.
+        """
+        np.savez(path, tiles=self.tiles, shape=np.array(self.shape))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['tiles'].astype(tile_dtype), tuple(data['shape']))
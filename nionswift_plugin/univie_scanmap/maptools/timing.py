@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 23:20:41 2026
+
+@author: mittelberger
+"""
+
+import contextlib
+import json
+import threading
+import time
+import numpy as np
+
+
+class TimingRecorder(object):
+    """
+    Collects timing records of the different stages of a map (e.g. "move", "settle", "grab", task names). Every record
+    is a value (s for durations, a number for other quantities like the buffer depth) that optionally belongs to a tile
+    (its frame number). All methods are thread safe.
+    "summary" condenses the records into statistics per stage and "save" writes records and summary into a JSON file.
+    """
+
+    filename = 'timing.json'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.tiles = {}
+        self.started_at = time.time()
+        self.finished_at = None
+
+    def record(self, stage, value, tile=None):
+        value = float(value)
+        with self._lock:
+            self.samples.setdefault(stage, []).append(value)
+            if tile is not None:
+                tile_record = self.tiles.setdefault(int(tile), {})
+                tile_record[stage] = tile_record.get(stage, 0) + value
+
+    def tile_record(self, tile):
+        """
+        Returns a copy of the totals per stage that were recorded for "tile".
+        """
+        with self._lock:
+            return dict(self.tiles.get(int(tile), {}))
+
+    @contextlib.contextmanager
+    def measure(self, stage, tile=None):
+        """
+        Context manager that records the time spent inside it.
+        """
+        starttime = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - starttime, tile=tile)
+
+    def timed(self, function, stage=None, tile=None):
+        """
+        Returns a function that calls "function" and records its run time (with the name of "function" as stage if no
+        "stage" is given).
+        """
+        stage = stage or function.__name__
+        def timed_function(*args, **kwargs):
+            with self.measure(stage, tile=tile):
+                return function(*args, **kwargs)
+        timed_function.__name__ = function.__name__
+        return timed_function
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def summary(self, dwell_time=None):
+        """
+        Returns statistics (number of records, total, mean, 50th, 90th and 99th percentile and maximum) for every stage.
+        If "dwell_time" (time the beam needs to scan one frame in s) is given, the pure dwell time of all grabbed frames
+        and the fraction of the wall time that was overhead are added.
+        """
+        with self._lock:
+            samples = {stage: np.array(values) for stage, values in self.samples.items()}
+        stages = {}
+        for stage, values in samples.items():
+            percentiles = np.percentile(values, [50, 90, 99])
+            stages[stage] = {'count': len(values), 'total': float(np.sum(values)), 'mean': float(np.mean(values)),
+                             'p50': float(percentiles[0]), 'p90': float(percentiles[1]),
+                             'p99': float(percentiles[2]), 'max': float(np.amax(values))}
+        wall_time = (self.finished_at or time.time()) - self.started_at
+        summary = {'wall_time': wall_time, 'number_tiles': len(self.tiles), 'stages': stages}
+        if dwell_time is not None:
+            total_dwell = dwell_time * stages.get('grab', {}).get('count', 0)
+            summary['dwell_time'] = total_dwell
+            summary['overhead_fraction'] = 1 - total_dwell / wall_time if wall_time > 0 else None
+        return summary
+
+    def save(self, path, dwell_time=None):
+        with self._lock:
+            tiles = [dict(record, number=number) for number, record in sorted(self.tiles.items())]
+        with open(path, 'w') as timing_file:
+            json.dump({'summary': self.summary(dwell_time=dwell_time), 'tiles': tiles}, timing_file, indent=1)
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 11:02:17 2026
+
+@author: mittelberger
+"""
+
+import math
+import time
+import numpy as np
+from scipy.spatial import cKDTree
+
+# All functions in this module take a TilePlan and return an index array that can be passed to TilePlan.reorder.
+# They work on arbitrary sets of tiles, e.g. they do not assume that every grid position is occupied.
+
+
+def row_snake_order(tile_plan):
+    """
+    Line by line from the top, alternating between left-to-right and right-to-left. Empty lines are skipped without
+    breaking the alternation.
+    """
+    tiles = tile_plan.tiles
+    line_rank = np.unique(tiles['row'], return_inverse=True)[1].ravel()
+    column_key = np.where(line_rank % 2 == 0, tiles['column'], -tiles['column'])
+    return np.lexsort((column_key, tiles['row']))
+
+
+def column_snake_order(tile_plan):
+    """
+    Column by column from the left, alternating between top-to-bottom and bottom-to-top.
+    """
+    tiles = tile_plan.tiles
+    column_rank = np.unique(tiles['column'], return_inverse=True)[1].ravel()
+    row_key = np.where(column_rank % 2 == 0, tiles['row'], -tiles['row'])
+    return np.lexsort((row_key, tiles['column']))
+
+
+def hilbert_index(x, y, n):
+    """
+    Position of the grid points (x, y) along a Hilbert curve that fills a n x n grid (n has to be a power of 2).
+    """
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    d = np.zeros_like(x)
+    s = n // 2
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx) ^ ry)
+        # rotate the quadrant so that the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        swap = ~ry
+        x, y = np.where(swap, y, x), np.where(swap, x, y)
+        s //= 2
+    return d
+
+
+def hilbert_order(tile_plan):
+    """
+    Orders the tiles along a Hilbert curve through the map grid. This keeps consecutive tiles close to each other
+    without long line changes, which pays off for compact, non-rectangular tile sets.
+    """
+    tiles = tile_plan.tiles
+    n = 1
+    while n < max(tile_plan.shape):
+        n *= 2
+    return np.argsort(hilbert_index(tiles['column'], tiles['row'], n), kind='stable')
+
+
+def nearest_neighbor_order(tile_plan, two_opt=True, number_neighbors=8, max_passes=10, max_segment=None,
+                           time_limit=10):
+    """
+    Greedy nearest-neighbour path over the corrected stage positions, starting at the first tile of the current order.
+    If "two_opt" is True, the path is improved afterwards by 2-opt moves between each tile and its "number_neighbors"
+    closest tiles (see two_opt_improve for "max_passes", "max_segment" and "time_limit"). The greedy path takes about
+    1 s for 10^5 tiles. The improvement is stopped after "time_limit" seconds, so that large maps do not wait for it
+    (a 300 x 300 plan needs about 13 s for all passes).
+    """
+    positions = tile_plan.corrected_positions
+    number_tiles = len(positions)
+    if number_tiles < 3:
+        return np.arange(number_tiles)
+    number_neighbors = min(number_neighbors, number_tiles - 1)
+    tree = cKDTree(positions)
+    # The neighbours of all tiles are found at once, plain python lists are faster to loop over than arrays
+    neighbors = tree.query(positions, k=number_neighbors + 1)[1].tolist()
+    visited = [False] * number_tiles
+    order = [0] * number_tiles
+    # Tree over the tiles that were not visited when it was built, for the case that all close tiles are visited. It is
+    # rebuilt when more than half of its tiles have been visited since.
+    remaining = np.arange(number_tiles)
+    remaining_tree = tree
+    visited_since = 0
+    current = 0
+    for i in range(number_tiles):
+        order[i] = current
+        visited[current] = True
+        visited_since += 1
+        if i == number_tiles - 1:
+            break
+        for neighbor in neighbors[current]:
+            if not visited[neighbor]:
+                current = neighbor
+                break
+        else:
+            if visited_since > len(remaining) // 2:
+                remaining = np.flatnonzero(~np.array(visited))
+                remaining_tree = cKDTree(positions[remaining])
+                visited_since = 0
+            k = min(2 * number_neighbors, len(remaining))
+            while True:
+                candidates = remaining[np.atleast_1d(remaining_tree.query(positions[current], k=k)[1])]
+                unvisited = [candidate for candidate in candidates.tolist() if not visited[candidate]]
+                if unvisited:
+                    current = unvisited[0]
+                    break
+                k = min(2 * k, len(remaining))
+    order = np.array(order, dtype=np.int64)
+
+    if two_opt:
+        order = two_opt_improve(positions, order, tree=tree, number_neighbors=number_neighbors, max_passes=max_passes,
+                                max_segment=max_segment, time_limit=time_limit)
+    return order
+
+
+def two_opt_improve(positions, order, tree=None, number_neighbors=8, max_passes=10, max_segment=None,
+                    time_limit=10):
+    """
+    Improves an open path through "positions" with 2-opt moves. Only moves that connect a tile with one of its
+    "number_neighbors" closest tiles are tested, which keeps a pass at O(N) instead of O(N^2). "max_segment" limits
+    the number of tiles a move may reverse (None for no limit). After the first pass only the tiles at edges that were
+    changed are tested again, for at most "max_passes" passes. The improvement stops after "time_limit" seconds (None
+    for no limit) and returns the path found so far.
+    """
+    starttime = time.perf_counter()
+    order = np.array(order).tolist()
+    number_tiles = len(order)
+    if tree is None:
+        tree = cKDTree(positions)
+    neighbors = tree.query(positions, k=number_neighbors + 1)[1][:, 1:].tolist()
+    place = [0] * number_tiles
+    for position, tile in enumerate(order):
+        place[tile] = position
+
+    # Plain python floats are much faster than numpy scalars for the single distances computed here
+    xs = positions[:, 0].tolist()
+    ys = positions[:, 1].tolist()
+
+    def distance(a, b):
+        return math.hypot(xs[a] - xs[b], ys[a] - ys[b])
+
+    active = list(range(number_tiles))
+    for k in range(max_passes):
+        changed = set()
+        for count, tile in enumerate(active):
+            if time_limit is not None and count % 1000 == 0 and time.perf_counter() - starttime > time_limit:
+                return np.array(order, dtype=np.int64)
+            for neighbor in neighbors[tile]:
+                i, j = sorted((place[tile], place[neighbor]))
+                if j - i < 2 or (max_segment is not None and j - i > max_segment):
+                    continue
+                # Both moves that connect the tiles at i and j are tested, so that the result does not depend on the
+                # direction of the path. Reversing order[i+1:j+1] replaces the edges (i, i+1) and (j, j+1) by (i, j)
+                # and (i+1, j+1), reversing order[i:j] replaces (i-1, i) and (j-1, j) by (i-1, j-1) and (i, j).
+                for start, stop in ((i+1, j+1), (i, j)):
+                    first, last = order[start], order[stop-1]
+                    gain = 0
+                    if start > 0:
+                        gain += distance(order[start-1], first) - distance(order[start-1], last)
+                    if stop < number_tiles:
+                        gain += distance(last, order[stop]) - distance(first, order[stop])
+                    if gain > 1e-12:
+                        changed.update((first, last))
+                        if start > 0:
+                            changed.add(order[start-1])
+                        if stop < number_tiles:
+                            changed.add(order[stop])
+                        order[start:stop] = order[start:stop][::-1]
+                        for position in range(start, stop):
+                            place[order[position]] = position
+                        break
+        if not changed:
+            break
+        active = sorted(changed)
+    return np.array(order, dtype=np.int64)
+
+
+# "nearest_neighbor" spends up to 10 s on improving the path of large maps (see nearest_neighbor_order)
+traversal_orders = {'row_snake': row_snake_order, 'column_snake': column_snake_order, 'hilbert': hilbert_order,
+                    'nearest_neighbor': nearest_neighbor_order}
+
+
+def get_traversal_order(order):
+    """
+    Returns the function for a traversal order. "order" can be one of the names in "traversal_orders" or a callable
+    that takes a TilePlan and returns an index array.
+    """
+    if callable(order):
+        return order
+    try:
+        return traversal_orders[order]
+    except KeyError:
+        raise ValueError('Unknown traversal order {}. Possible values are: {}.'.format(order,
+                                                                                        list(traversal_orders.keys())))
+
+
+def travel_report(tile_plan, first_wait_time=10, wait_time=2, settle_time=None):
+    """
+    Summarizes the stage movement needed for a tile plan in its current order.
+
+    Parameters
+    -----------
+    tile_plan : TilePlan
+    first_wait_time, wait_time : optional, float
+        Fixed settle times (s) for the first and every following tile. They are used if "settle_time" is None.
+    settle_time : optional, callable
+        Function that takes the moves as (N-1, 2) array of (dx, dy) in m and returns the settle time for each of them.
+
+    Returns
+    --------
+    report : dictionary
+        Contains "travel" (total stage travel in m), "longest_move" (m) and "settle_time" (total predicted settle time
+        in s, including the first tile).
+    """
+    moves = np.diff(tile_plan.corrected_positions, axis=0)
+    lengths = np.hypot(moves[:, 0], moves[:, 1])
+    if settle_time is not None:
+        settle = np.sum(settle_time(moves))
+    else:
+        settle = wait_time*len(moves)
+    return {'travel': float(np.sum(lengths)), 'longest_move': float(np.amax(lengths)) if len(lengths) > 0 else 0.0,
+            'settle_time': float(settle) + (first_wait_time if len(tile_plan) > 0 else 0)}
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 23:42:12 2026
+
+@author: mittelberger
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    from . import tifffile
+
+
+def fsync_file(path):
+    descriptor = os.open(path, os.O_RDWR)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def compact_counts(data):
+    """
+    Returns "data" as uint16 if this does not change any value (i.e. it only contains counts between 0 and 65535),
+    otherwise "data" is returned unchanged.
+    """
+    data = np.asarray(data)
+    if data.dtype.kind != 'f' or data.size == 0:
+        return data
+    if np.amin(data) < 0 or np.amax(data) > np.iinfo(np.uint16).max or not np.array_equal(data, np.rint(data)):
+        return data
+    return data.astype(np.uint16)
+
+
+class FrameWriter(object):
+    """
+    Writes frames to disk in its own thread, so that a slow disk or network share does not stall processing.
+    "write" puts a frame into a bounded queue (of "maxsize" frames) and only blocks if the queue is full. The writer
+    thread takes all queued items at once (up to "batch_size") and writes them in one go. If a path occurs more than
+    once in such a batch, only the last frame is written (frames with different "page" keyword arguments are pages of
+    one file and are all written, see series.SeriesSaver). "call" queues a function that runs after all frames queued
+    before it were written (e.g. to record them in the tile journal).
+    "fsync" can be "never", "batch" (after each batch) or "always" (after each frame). Failed writes are retried
+    "retries" times; if they still fail, "on_error" is called with a message.
+    "save_function" is called as save_function(path, data, **kwargs) for each frame (default: tifffile.imsave).
+    Frames are compressed if "codec" is "zlib" (with "level" 1 - 9) or "lzma". Compression runs in a pool of "workers"
+    threads (zlib and lzma release the GIL), which write the frames of a batch to different files at the same time.
+    Pages of one file (series.SeriesSaver) are always written one after the other. If "convert_counts" is True, frames
+    that only contain counts are written as uint16 (see compact_counts).
+    """
+
+    def __init__(self, **kwargs):
+        self.maxsize = kwargs.get('maxsize', 64)
+        self.batch_size = kwargs.get('batch_size', 16)
+        self.fsync = kwargs.get('fsync', 'never')
+        self.retries = kwargs.get('retries', 2)
+        self.retry_delay = kwargs.get('retry_delay', 1)
+        self.save_function = kwargs.get('save_function', tifffile.imsave)
+        self.on_error = kwargs.get('on_error')
+        self.codec = kwargs.get('codec')
+        self.level = kwargs.get('level', 6)
+        self.workers = kwargs.get('workers', 1)
+        self.convert_counts = kwargs.get('convert_counts', False)
+        self._save_kwargs = {}
+        if self.codec == 'zlib':
+            self._save_kwargs['compress'] = int(np.clip(self.level, 1, 9))
+        elif self.codec == 'lzma':
+            if tifffile.lzma is None:
+                logging.warning('LZMA is not available. Frames are compressed with zlib instead.')
+                self._save_kwargs['compress'] = int(np.clip(self.level, 1, 9))
+            else:
+                self._save_kwargs['compress'] = 'lzma'
+        elif self.codec is not None:
+            raise ValueError('Unknown codec {:s}. Use "zlib" or "lzma".'.format(str(self.codec)))
+        self._pool = ThreadPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        self._queue = queue.Queue(maxsize=self.maxsize)
+        self._t = None
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self.number_written = 0
+        self.number_coalesced = 0
+        self.number_errors = 0
+        self.bytes_written = 0
+        self.bytes_stored = 0
+        self.number_converted = 0
+        self.write_time = 0
+        self.high_water_mark = 0
+
+    def start(self):
+        # Frames are queued from several processing threads, which must not start more than one writer thread
+        with self._start_lock:
+            if self._t is not None and self._t.is_alive():
+                return
+            self._t = threading.Thread(target=self._writer_thread, daemon=True)
+            self._t.start()
+
+    def write(self, path, data, copy=True, timeout=None, **kwargs):
+        """
+        Queues "data" to be written to "path". The data is copied unless "copy" is False, which is only safe if it is
+        not changed anymore (frames from a FrameBuffer are reused!). "kwargs" are passed to "save_function".
+        """
+        self.start()
+        data = np.array(data) if copy else data
+        self._queue.put(('write', path, data, kwargs), timeout=timeout)
+        with self._lock:
+            self.high_water_mark = max(self.high_water_mark, self._queue.qsize())
+
+    def call(self, function, *args, **kwargs):
+        """
+        Queues a call of "function" that runs in the writer thread after all frames that were queued before.
+        """
+        self.start()
+        self._queue.put(('call', function, args, kwargs))
+
+    def flush(self, timeout=None):
+        """
+        Blocks until everything that was queued is written. Returns False if "timeout" ran out before.
+        """
+        if self._t is None or not self._t.is_alive():
+            return self._queue.unfinished_tasks == 0
+        finished = threading.Event()
+        self.call(finished.set)
+        return finished.wait(timeout=timeout)
+
+    def close(self, timeout=None):
+        self.flush(timeout=timeout)
+        if self._t is not None and self._t.is_alive():
+            self._queue.put(None)
+            self._t.join(timeout=timeout)
+        self._t = None
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+    def report(self):
+        """
+        Returns the statistics of the writer. "bytes" is the size of the frames that were written, "stored" their size
+        on disk, "ratio" the compression ratio, "throughput" the bytes written per second the writer was busy (B/s) and
+        "converted" the number of frames that were written as uint16.
+        """
+        with self._lock:
+            return {'written': self.number_written, 'coalesced': self.number_coalesced, 'errors': self.number_errors,
+                    'bytes': self.bytes_written, 'stored': self.bytes_stored, 'converted': self.number_converted,
+                    'ratio': self.bytes_written / self.bytes_stored if self.bytes_stored > 0 else 1.0,
+                    'throughput': self.bytes_written / self.write_time if self.write_time > 0 else 0.0,
+                    'write_time': self.write_time, 'high_water_mark': self.high_water_mark}
+
+    def _writer_thread(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(block=False))
+                except queue.Empty:
+                    break
+            try:
+                stop = self._write_batch(batch)
+            finally:
+                for i in range(len(batch)):
+                    self._queue.task_done()
+            if stop:
+                break
+
+    def _write_batch(self, batch):
+        # Only the last write to each path in this batch is done
+        last_writes = {}
+        for position, item in enumerate(batch):
+            if item is not None and item[0] == 'write':
+                last_writes[(item[1], item[3].get('page'))] = position
+        # Writes are collected in groups that are written one after the other, different groups run in parallel.
+        # All pages of series containers are in one group because they depend on each other.
+        groups = {}
+        written = []
+        stop = False
+        for position, item in enumerate(batch):
+            if item is None:
+                stop = True
+            elif item[0] == 'call':
+                written += self._write_groups(groups)
+                groups = {}
+                if written and self.fsync == 'batch':
+                    self._fsync(written)
+                    written = []
+                try:
+                    item[1](*item[2], **item[3])
+                except Exception as detail:
+                    self._report_error('Error in writer callback {:s}: {:s}'.format(str(item[1]), str(detail)))
+            elif last_writes[(item[1], item[3].get('page'))] != position:
+                with self._lock:
+                    self.number_coalesced += 1
+            else:
+                groups.setdefault(None if item[3].get('page') is not None else item[1], []).append(item[1:])
+        written += self._write_groups(groups)
+        if written and self.fsync == 'batch':
+            self._fsync(written)
+        return stop
+
+    def _write_group(self, group):
+        return [item[0] for item in group if self._write(*item)]
+
+    def _write_groups(self, groups):
+        if not groups:
+            return []
+        starttime = time.perf_counter()
+        if self._pool is not None and len(groups) > 1:
+            written = [path for paths in self._pool.map(self._write_group, groups.values()) for path in paths]
+        else:
+            written = [path for group in groups.values() for path in self._write_group(group)]
+        with self._lock:
+            self.write_time += time.perf_counter() - starttime
+        return written
+
+    def _write(self, path, data, kwargs):
+        number_bytes = np.asarray(data).nbytes
+        if self.convert_counts:
+            converted = compact_counts(data)
+            if converted is not data:
+                data = converted
+                with self._lock:
+                    self.number_converted += 1
+        kwargs = dict(self._save_kwargs, **kwargs)
+        for attempt in range(self.retries + 1):
+            try:
+                # Pages are appended to a file, so only the size they add is counted
+                size_before = os.path.getsize(path) if kwargs.get('page') and os.path.isfile(path) else 0
+                self.save_function(path, data, **kwargs)
+                if self.fsync == 'always':
+                    fsync_file(path)
+            except Exception as detail:
+                if attempt < self.retries:
+                    logging.warning('Could not write {:s}. Retrying. Reason: {:s}'.format(path, str(detail)))
+                    time.sleep(self.retry_delay)
+                else:
+                    self._report_error('Could not write {:s}. Reason: {:s}'.format(path, str(detail)))
+            else:
+                try:
+                    size = os.path.getsize(path) - size_before
+                except OSError:
+                    size = number_bytes
+                with self._lock:
+                    self.number_written += 1
+                    self.bytes_written += number_bytes
+                    self.bytes_stored += size
+                return True
+        return False
+
+    def _fsync(self, paths):
+        for path in paths:
+            try:
+                fsync_file(path)
+            except OSError as detail:
+                self._report_error('Could not fsync {:s}. Reason: {:s}'.format(path, str(detail)))
+
+    def _report_error(self, message):
+        with self._lock:
+            self.number_errors += 1
+        logging.error(message)
+        if callable(self.on_error):
+            try:
+                self.on_error(message)
+            except Exception as detail:
+                logging.error('Could not report writer error. Reason: ' + str(detail))
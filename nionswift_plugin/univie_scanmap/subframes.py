@@ -20,8 +20,10 @@ with warnings.catch_warnings():
     warnings.simplefilter("ignore")
     try:
         from .maptools import tifffile
+        from .maptools import series
     except:
         from maptools import tifffile
+        from maptools import series
 import scipy.optimize
 
 try:
@@ -232,17 +234,24 @@ def electron_counting(image, baseline=0.002, countlevel=0.01, peaklength=5):
 def subframes_preprocessing(filename, dirname, imsize, counts_threshold=1e-9, graphene_threshold=0, light_threshold=0,
                             heavy_threshold=0.02, median_blur_diameter=39, gaussian_blur_radius=3, counts_divisor=None,
                             minimum_graphene_area=0.5, dirt_border=100, save_fft=True, calculate_actual_counts=True,
-                            minimum_number_peaks=-1, baseline=0.002, countlevel=0.01, peakwidth=5, image_number=None):
+                            minimum_number_peaks=-1, baseline=0.002, countlevel=0.01, peakwidth=5, image_number=None,
+                            frame_index=None):
     """
     Returns tuple of the form:
             (filename, success, dirt coverage, counts divisor, angle of lattice rotation, mean peak radius)
         For files with more than 50% dirt coverage, the last 3 values will be 'None' and success will be False.
+        If "frame_index" is given, this frame is read from a series that was saved as one file per position. It is then
+        appended to the returned name like the frame number of separately saved frames.
 
     """
     print('Working on: ' + filename)
     success = True
     #load image
-    image = cv2.imread(dirname+filename, -1)
+    if frame_index is not None:
+        image = series.read_frame(dirname+filename, frame_index)
+        filename = os.path.splitext(filename)[0] + '_{:d}'.format(frame_index) + os.path.splitext(filename)[1]
+    else:
+        image = cv2.imread(dirname+filename, -1)
     if image is None:
         raise ValueError(dirname+filename+' is not an image file. Make sure you give the total path as input argument.')
     #image_org = image.copy()